@@ -2,10 +2,13 @@
 
 import json
 import logging
+import time
 from typing import Any, Dict, Optional
 from datetime import datetime, timezone
 from sqlalchemy import text
 from .db import get_session
+from . import usage_cache
+from .metrics import count_request, count_tokens, gateway_accounting_errors, gateway_accounting_lag
 
 logger = logging.getLogger(__name__)
 
@@ -29,11 +32,20 @@ async def record_request(
     status_code: Optional[int],
     error_message: Optional[str],
     latency_ms: Optional[int],
+    cache_hit: bool = False,
+    backend: Optional[str] = None,
 ) -> None:
+    # backend is the registry name, used as the (bounded) model label on metrics
+    finished = time.monotonic()
+    count_request(endpoint, backend, status_code or 0)
     try:
         logger.info("Recording request for key_id=%s user_id=%s endpoint=%s", key_id, user_id, endpoint)
 
         usage = _extract_usage(response_body or {})
+        # A cache hit keeps its usage on the request row (flagged cache_hit) but
+        # generated nothing upstream, so it counts as a request with no tokens
+        charged = dict.fromkeys(usage, 0) if cache_hit else usage
+        count_tokens(backend, key_id, charged["prompt_tokens"], charged["completion_tokens"])
         now = datetime.now(timezone.utc)
         day = now.date()
 
@@ -46,10 +58,10 @@ async def record_request(
                     """
                     INSERT INTO requests (
                         key_id, user_id, endpoint, model, request_body, response_body, status_code, error_message,
-                        prompt_tokens, completion_tokens, total_tokens, latency_ms, created_at
+                        prompt_tokens, completion_tokens, total_tokens, latency_ms, cache_hit, created_at
                     ) VALUES (
                         :key_id, :user_id, :endpoint, :model, :request_body, :response_body, :status_code, :error_message,
-                        :prompt_tokens, :completion_tokens, :total_tokens, :latency_ms, now()
+                        :prompt_tokens, :completion_tokens, :total_tokens, :latency_ms, :cache_hit, now()
                     )
                     """
                 ),
@@ -66,6 +78,7 @@ async def record_request(
                     "completion_tokens": usage["completion_tokens"],
                     "total_tokens": usage["total_tokens"],
                     "latency_ms": latency_ms,
+                    "cache_hit": cache_hit,
                 },
             )
 
@@ -88,15 +101,19 @@ async def record_request(
                     "key_id": key_id,
                     "user_id": user_id,
                     "day": day,
-                    "prompt_tokens": usage["prompt_tokens"],
-                    "completion_tokens": usage["completion_tokens"],
-                    "total_tokens": usage["total_tokens"],
+                    "prompt_tokens": charged["prompt_tokens"],
+                    "completion_tokens": charged["completion_tokens"],
+                    "total_tokens": charged["total_tokens"],
                 },
             )
 
             db.commit()
+        gateway_accounting_lag.observe(time.monotonic() - finished)
+
+        await usage_cache.record_usage(user_id, key_id, charged["total_tokens"])
 
         logger.info("Successfully recorded request for key_id=%s user_id=%s", key_id, user_id)
 
     except Exception as e:
+        gateway_accounting_errors.inc()
         logger.exception("Failed to record request: %s", e)
@@ -0,0 +1,150 @@
+# app/breaker.py
+
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Tuple
+
+import httpx
+
+from .config import settings
+from .metrics import gateway_breaker_rejections, gateway_breaker_state, gateway_breaker_transitions
+from .upstreams import is_upstream_failure
+
+logger = logging.getLogger(__name__)
+
+# Circuit breaker per model backend, around its whole upstream pool (single
+# replicas are already ejected by the pool itself).
+#
+# closed    -> open       error rate over BREAKER_WINDOW_S reaches BREAKER_ERROR_RATE
+#                         (with at least BREAKER_MIN_REQUESTS calls), BREAKER_CONNECT_FAILURES
+#                         connect failures in a row, or every replica failing its health check
+# open      -> half_open  after the open interval, which doubles on each failed recovery
+# half_open -> closed     after BREAKER_HALF_OPEN_SUCCESSES successes; probe concurrency grows
+#                         with each success so traffic comes back gradually
+# half_open -> open       on any failure
+#
+# While open, new requests are refused before queueing with 503 + Retry-After,
+# and queued jobs fail as they are dispatched.
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class BreakerOpenError(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Upstream for {name} is unavailable (circuit open)")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, pool: Any = None):
+        self.name = name
+        self.pool = pool
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.open_s = settings.breaker_open_s
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._connect_failures = 0
+        self._probes = 0
+        self._probe_successes = 0
+        gateway_breaker_state.labels(backend=name).set(0)
+
+    def _transition(self, state: str, reason: str) -> None:
+        if state == self.state:
+            return
+        logger.warning("Circuit for %s: %s -> %s (%s)", self.name, self.state, state, reason)
+        self.state = state
+        gateway_breaker_state.labels(backend=self.name).set(_STATE_VALUE[state])
+        gateway_breaker_transitions.labels(backend=self.name, to=state).inc()
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        elif state == HALF_OPEN:
+            self._probes = 0
+            self._probe_successes = 0
+        else:
+            self.open_s = settings.breaker_open_s
+            self._outcomes.clear()
+            self._connect_failures = 0
+
+    def _trip(self, reason: str) -> None:
+        if self.state == HALF_OPEN:
+            # Failed recovery: stay away longer next time
+            self.open_s = min(self.open_s * 2, settings.breaker_max_open_s)
+        self._transition(OPEN, reason)
+
+    def _all_replicas_down(self) -> bool:
+        if self.pool is None or settings.upstream_health_interval_s <= 0:
+            return False
+        return not any(u.healthy for u in self.pool.upstreams)
+
+    def retry_after(self) -> Optional[float]:
+        """Seconds until requests may be tried again, or None if they may go ahead now."""
+        if not settings.breaker_enabled:
+            return None
+        if self.state == CLOSED and self._all_replicas_down():
+            self._trip("health checks")
+        if self.state == OPEN:
+            remaining = self.opened_at + self.open_s - time.monotonic()
+            if remaining > 0:
+                return remaining
+            self._transition(HALF_OPEN, "open interval elapsed")
+        if self.state == HALF_OPEN and self._probes >= self._probe_successes + 1:
+            return 1.0
+        return None
+
+    def _record(self, ok: bool, connect_failure: bool = False) -> None:
+        now = time.monotonic()
+        if self.state == HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+            if not ok:
+                self._trip("probe failed")
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= settings.breaker_half_open_successes:
+                self._transition(CLOSED, "probes succeeded")
+            return
+        if self.state != CLOSED:
+            return
+        self._outcomes.append((now, ok))
+        while self._outcomes and self._outcomes[0][0] < now - settings.breaker_window_s:
+            self._outcomes.popleft()
+        self._connect_failures = self._connect_failures + 1 if connect_failure else 0
+        if self._connect_failures >= settings.breaker_connect_failures:
+            self._trip("connect failures")
+            return
+        if len(self._outcomes) >= settings.breaker_min_requests:
+            errors = sum(1 for _, good in self._outcomes if not good)
+            if errors / len(self._outcomes) >= settings.breaker_error_rate:
+                self._trip("error rate")
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[None]:
+        """Wrap one upstream call: refuse it while open, count its outcome otherwise."""
+        retry = self.retry_after()
+        if retry is not None:
+            gateway_breaker_rejections.labels(backend=self.name).inc()
+            raise BreakerOpenError(self.name, retry)
+        if self.state == HALF_OPEN:
+            self._probes += 1
+        try:
+            yield
+        except BaseException as e:
+            if is_upstream_failure(e):
+                self._record(False, connect_failure=isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)))
+            elif self.state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+            raise
+        else:
+            self._record(True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        window = list(self._outcomes)
+        return {
+            "state": self.state,
+            "open_s": self.open_s,
+            "retry_after_s": round(max(0.0, self.opened_at + self.open_s - time.monotonic()), 3) if self.state == OPEN else None,
+            "window_requests": len(window),
+            "window_errors": sum(1 for _, ok in window if not ok),
+        }
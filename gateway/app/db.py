@@ -1,5 +1,8 @@
+import asyncio
+import contextlib
 from contextlib import contextmanager
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker, Session
 from .config import settings
 from .models import User, APIKey, Audit
@@ -7,13 +10,48 @@ from .security import hash_key, verify_key
 import secrets
 from typing import Optional, List, Dict, Any, Tuple
 from datetime import datetime, date, time, timezone
-from sqlalchemy import asc, desc, or_, cast, String
+from sqlalchemy import asc, desc, or_, cast, String, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+import logging
+import time as _time
 import uuid
 
+logger = logging.getLogger(__name__)
+
 
 engine = create_engine(settings.database_url, pool_pre_ping=True)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+# Optional read replica with its own pool, so analytics reads never queue
+# behind accounting writes for primary connections.
+read_engine = (
+    create_engine(
+        settings.database_read_url,
+        pool_pre_ping=True,
+        pool_size=settings.database_read_pool_size,
+        max_overflow=settings.database_read_max_overflow,
+        connect_args={"connect_timeout": settings.replica_connect_timeout_s},
+    )
+    if settings.database_read_url
+    else None
+)
+ReadSessionLocal = (
+    sessionmaker(bind=read_engine, autoflush=False, autocommit=False) if read_engine is not None else None
+)
+
+# Replication lag in seconds; 0 when the replica has replayed everything it received
+_REPLICA_LAG_SQL = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+    """
+)
+_replica_state: Dict[str, Any] = {"healthy": False, "lag_s": None, "checked_at": None}
+_replica_task: Optional[asyncio.Task] = None
+
 
 async def init_db() -> None:
     # Placeholder: migrations are run in container entrypoint via Alembic
@@ -29,6 +67,86 @@ def get_session() -> Session:
         session.close()
 
 
+def _check_replica() -> None:
+    try:
+        with read_engine.connect() as conn:
+            lag = float(conn.execute(_REPLICA_LAG_SQL).scalar() or 0)
+        _replica_state.update(healthy=True, lag_s=lag)
+    except Exception as e:
+        if _replica_state["healthy"] or _replica_state["checked_at"] is None:
+            logger.warning("Read replica unavailable, using primary: %s", e)
+        _replica_state.update(healthy=False, lag_s=None)
+    _replica_state["checked_at"] = _time.monotonic()
+
+
+async def _replica_loop() -> None:
+    while True:
+        # The probe is a blocking query with a connect timeout; keep it off the event loop
+        await asyncio.to_thread(_check_replica)
+        await asyncio.sleep(settings.replica_check_interval_s)
+
+
+def start_replica_checks() -> Optional[asyncio.Task]:
+    global _replica_task
+    if read_engine is None:
+        return None
+    _replica_task = asyncio.create_task(_replica_loop(), name="replica-check")
+    return _replica_task
+
+
+async def stop_replica_checks() -> None:
+    global _replica_task
+    if _replica_task:
+        _replica_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await _replica_task
+        _replica_task = None
+
+
+def _replica_usable(max_lag_s: Optional[float]) -> bool:
+    if ReadSessionLocal is None:
+        return False
+    checked_at = _replica_state["checked_at"]
+    # In the app the background task keeps the state fresh; scripts without it probe inline
+    if _replica_task is None and (checked_at is None or _time.monotonic() - checked_at >= settings.replica_check_interval_s):
+        _check_replica()
+    if not _replica_state["healthy"]:
+        return False
+    limit = settings.replica_max_lag_s if max_lag_s is None else max_lag_s
+    return _replica_state["lag_s"] <= limit
+
+
+@contextmanager
+def get_read_session(max_lag_s: Optional[float] = None) -> Session:
+    """Session for read-only queries that tolerate some staleness.
+
+    Uses the replica when it is configured, reachable and lagging less than
+    `max_lag_s` (default REPLICA_MAX_LAG_S); otherwise the primary.
+    """
+    session: Optional[Session] = None
+    if _replica_usable(max_lag_s):
+        session = ReadSessionLocal()
+        try:
+            session.connection()  # check out now so a dead replica falls back below
+        except OperationalError as e:
+            logger.warning("Read replica connection failed, using primary: %s", e)
+            _replica_state.update(healthy=False, lag_s=None, checked_at=_time.monotonic())
+            session.close()
+            session = None
+    if session is None:
+        with get_session() as primary:
+            yield primary
+        return
+    try:
+        yield session
+    except OperationalError:
+        # Connection-level failure: stop routing to the replica until the next check
+        _replica_state.update(healthy=False, lag_s=None, checked_at=_time.monotonic())
+        raise
+    finally:
+        session.close()
+
+
 # CRUD helpers (sync, called within endpoints)
 def create_user(db: Session, name: str, email: Optional[str], status: str = "approved", password_hash: Optional[str] = None) -> Dict[str, Any]:
     user = User(name=name, email=email, status=status, password_hash=password_hash)
@@ -156,6 +274,26 @@ def list_users(
     )
 
 
+def parse_expires_at(v: Optional[str]) -> Optional[datetime]:
+    if not v:
+        return None
+    s = v.strip()
+    try:
+        # Accept full ISO datetime with or without timezone
+        dt = datetime.fromisoformat(s)
+        # If naive, assume UTC
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt
+    except Exception:
+        # Try date-only (YYYY-MM-DD) → set to end of that day in UTC
+        try:
+            d = date.fromisoformat(s)
+            return datetime.combine(d, time(23, 59, 59, 0, tzinfo=timezone.utc))
+        except Exception:
+            raise ValueError("Invalid expires_at format. Use YYYY-MM-DD or ISO datetime.")
+
+
 def create_api_key(
     db: Session,
     user_id: str,
@@ -165,25 +303,6 @@ def create_api_key(
     daily_request_quota: Optional[int] = None,
     expires_at: Optional[str] = None,
 ) -> Dict[str, Any]:
-    def _parse_expires(v: Optional[str]) -> Optional[datetime]:
-        if not v:
-            return None
-        s = v.strip()
-        try:
-            # Accept full ISO datetime with or without timezone
-            dt = datetime.fromisoformat(s)
-            # If naive, assume UTC
-            if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=timezone.utc)
-            return dt
-        except Exception:
-            # Try date-only (YYYY-MM-DD) → set to end of that day in UTC
-            try:
-                d = date.fromisoformat(s)
-                return datetime.combine(d, time(23, 59, 59, 0, tzinfo=timezone.utc))
-            except Exception:
-                raise ValueError("Invalid expires_at format. Use YYYY-MM-DD or ISO datetime.")
-
     plaintext = secrets.token_urlsafe(32)
     key_hash = hash_key(plaintext)
     last4 = plaintext[-4:]
@@ -196,7 +315,7 @@ def create_api_key(
         status="active",
         monthly_token_quota=monthly_quota_tokens,
         daily_request_quota=daily_request_quota,
-        expires_at=_parse_expires(expires_at),
+        expires_at=parse_expires_at(expires_at),
     )
     db.add(rec)
     db.commit()
@@ -358,18 +477,19 @@ def rotate_key(db: Session, key_id: str) -> Dict[str, Any]:
     db.add(new)
     db.commit()
     db.refresh(new)
-    return {"id": str(new.id), "last4": new.key_last4, "plaintext_key": plaintext}
+    return {"id": str(new.id), "user_id": str(new.user_id), "last4": new.key_last4, "plaintext_key": plaintext}
 
 
-def audit(db: Session, actor_key_id: Optional[str], action: str, target_id: Optional[str], meta: Optional[dict] = None) -> None:
-    def _as_uuid(value: Optional[str]) -> Optional[uuid.UUID]:
-        if not value:
-            return None
-        try:
-            return uuid.UUID(str(value))
-        except Exception:
-            return None
+def _as_uuid(value: Optional[str]) -> Optional[uuid.UUID]:
+    if not value:
+        return None
+    try:
+        return uuid.UUID(str(value))
+    except Exception:
+        return None
+
 
+def audit(db: Session, actor_key_id: Optional[str], action: str, target_id: Optional[str], meta: Optional[dict] = None) -> None:
     rec = Audit(
         actor_key_id=_as_uuid(actor_key_id),
         action=action,
@@ -378,3 +498,76 @@ def audit(db: Session, actor_key_id: Optional[str], action: str, target_id: Opti
     )
     db.add(rec)
     db.commit()
+
+
+def _audit_rows(actor_key_id: Optional[str], entries: List[Tuple[str, Optional[str], Optional[dict]]]) -> List[Dict[str, Any]]:
+    actor = _as_uuid(actor_key_id)
+    return [
+        {"actor_key_id": actor, "action": action, "target_id": _as_uuid(target_id), "meta": meta or {}}
+        for action, target_id, meta in entries
+    ]
+
+
+# Bulk helpers: one multi-row INSERT/UPDATE plus one audit INSERT per
+# transaction. Callers pass at most `settings.bulk_batch_size` items at a time.
+def bulk_create_users(db: Session, actor_key_id: Optional[str], items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Insert users, skipping emails that already exist; returns one result per item."""
+    rows = [
+        {"id": uuid.uuid4(), "name": it["name"], "email": it.get("email"), "status": it.get("status") or "approved"}
+        for it in items
+    ]
+    stmt = (
+        pg_insert(User)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=[User.email])
+        .returning(User.id)
+    )
+    inserted = {r.id for r in db.execute(stmt)}
+    results: List[Dict[str, Any]] = []
+    audits = []
+    for row in rows:
+        if row["id"] in inserted:
+            results.append({"ok": True, "id": str(row["id"]), "name": row["name"], "email": row["email"], "status": row["status"]})
+            audits.append(("CREATE_USER", str(row["id"]), {"name": row["name"], "bulk": True}))
+        else:
+            results.append({"ok": False, "error": "Email already exists", "email": row["email"]})
+    if audits:
+        db.execute(pg_insert(Audit).values(_audit_rows(actor_key_id, audits)))
+    db.commit()
+    return results
+
+
+def existing_user_ids(db: Session, user_ids: List[str]) -> set:
+    ids = [u for u in {_as_uuid(x) for x in user_ids} if u is not None]
+    if not ids:
+        return set()
+    return {str(r[0]) for r in db.query(User.id).filter(User.id.in_(ids)).all()}
+
+
+def bulk_insert_api_keys(db: Session, actor_key_id: Optional[str], rows: List[Dict[str, Any]]) -> None:
+    """Insert prepared api_keys rows (hashes already computed, ids pre-assigned)."""
+    if not rows:
+        return
+    db.execute(pg_insert(APIKey).values(rows))
+    audits = [("CREATE_KEY", str(r["id"]), {"name": r["name"], "bulk": True}) for r in rows]
+    db.execute(pg_insert(Audit).values(_audit_rows(actor_key_id, audits)))
+    db.commit()
+
+
+def bulk_revoke_keys(db: Session, actor_key_id: Optional[str], key_ids: List[str]) -> Dict[str, str]:
+    """Revoke keys in one UPDATE; returns {key_id: user_id} for the keys that exist."""
+    ids = [u for u in {_as_uuid(x) for x in key_ids} if u is not None]
+    if not ids:
+        return {}
+    stmt = (
+        update(APIKey)
+        .where(APIKey.id.in_(ids))
+        .values(status="revoked")
+        .returning(APIKey.id, APIKey.user_id)
+    )
+    revoked = {str(r.id): str(r.user_id) for r in db.execute(stmt)}
+    if revoked:
+        audits = [("REVOKE_KEY", key_id, {"bulk": True}) for key_id in revoked]
+        db.execute(pg_insert(Audit).values(_audit_rows(actor_key_id, audits)))
+    db.commit()
+    return revoked
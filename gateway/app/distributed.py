@@ -0,0 +1,423 @@
+# app/distributed.py
+
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import orjson
+
+from . import vllm_client
+from .config import settings
+from .metrics import gateway_queue_wait
+
+try:
+    from redis import asyncio as aioredis
+except Exception:  # pragma: no cover
+    aioredis = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Distributed mode (DISTRIBUTED_QUEUE=true): every gateway instance shares one
+# queue and one concurrency budget per model backend, so adding replicas does
+# not multiply the load on vLLM.
+#
+#  - Jobs are appended to a Redis Stream per backend (gw:jobs:<backend>) and
+#    read through the "gateway" consumer group by whichever instance has a slot.
+#  - A slot is a lease in a sorted set (gw:slots:<backend>) scored by expiry;
+#    a Lua script grants one only while fewer than the limit are live, so the
+#    global in-flight count is exact. Holders renew their leases; leases of a
+#    crashed instance expire after DISTRIBUTED_LEASE_TTL_S.
+#  - The limit itself is shared (gw:limit:<backend>): each instance's AIMD
+#    still reacts to what it observes, the most recent change by any instance
+#    is published with its timestamp, and every instance adopts it on its next
+#    heartbeat. Lease grants read the published value, never a caller's own.
+#  - Results and stream chunks go back to the instance that accepted the
+#    request through its own stream (gw:results:<instance>).
+#  - Jobs left pending by a crashed worker are claimed after two lease TTLs and
+#    answered with an error rather than re-run, since part of a stream may
+#    already have been delivered.
+
+INSTANCE_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+GROUP = "gateway"
+
+_LUA_ACQUIRE = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local limit = tonumber(redis.call('HGET', KEYS[2], 'limit') or '') or tonumber(ARGV[2])
+if redis.call('ZCARD', KEYS[1]) < limit then
+  redis.call('ZADD', KEYS[1], now + tonumber(ARGV[1]), ARGV[3])
+  return 1
+end
+return 0
+"""
+
+# Publish our limit if it changed more recently than the shared one; returns the shared limit
+_LUA_SYNC_LIMIT = """
+local at = tonumber(redis.call('HGET', KEYS[1], 'at') or '') or -1
+if tonumber(ARGV[2]) > at then
+  redis.call('HSET', KEYS[1], 'limit', ARGV[1], 'at', ARGV[2])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return redis.call('HGET', KEYS[1], 'limit')
+"""
+
+_LUA_RENEW = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+return redis.call('ZADD', KEYS[1], 'XX', 'CH', now + tonumber(ARGV[1]), ARGV[2])
+"""
+
+# Jobs accepted by this instance and waiting for results, by job id
+_pending: Dict[str, Any] = {}
+# Leases and stream entries held by this instance's workers
+_leases: Dict[str, str] = {}
+_working: Dict[str, str] = {}
+
+_client = None
+
+Execute = Callable[[Any, Any, str, Dict[str, Any], bool, Optional[float], Optional[int]], Awaitable[None]]
+
+
+def enabled() -> bool:
+    return settings.distributed_queue
+
+
+def _redis():
+    # Separate binary client: stream chunks are raw bytes and may split UTF-8 sequences
+    global _client
+    if _client is None:
+        if aioredis is None:
+            raise RuntimeError("DISTRIBUTED_QUEUE requires the redis package")
+        _client = aioredis.from_url(settings.redis_url)
+    return _client
+
+
+def _jobs_key(backend) -> str:
+    return f"gw:jobs:{backend.name}"
+
+
+def _slots_key(backend) -> str:
+    return f"gw:slots:{backend.name}"
+
+
+def _limit_key(backend) -> str:
+    return f"gw:limit:{backend.name}"
+
+
+def _results_key(instance: str) -> str:
+    return f"gw:results:{instance}"
+
+
+async def submit(job, backend) -> None:
+    """Queue a job for any instance to run; results come back to this one."""
+    r = _redis()
+    key = _jobs_key(backend)
+    # Same backpressure as the in-process queue: wait while the shared queue is full
+    while await r.xlen(key) >= backend.queue.maxsize:
+        await asyncio.sleep(0.05)
+    _pending[job.id] = job
+    try:
+        await r.xadd(
+            key,
+            {
+                "id": job.id,
+                "origin": INSTANCE_ID,
+                "endpoint": job.payload["endpoint"],
+                "body": orjson.dumps(job.payload["body"]),
+                "stream": "1" if job._stream else "0",
+                "deadline": "" if job.deadline is None else repr(job.deadline),
+                "prompt_tokens": job.prompt_tokens,
+                "cost": job.cost,
+                "enqueued_at": repr(job.enqueued_at),
+            },
+        )
+    except BaseException:
+        _pending.pop(job.id, None)
+        raise
+
+
+def forget(job_id: str) -> None:
+    """Stop waiting for a job's results, e.g. after an admin cancelled it locally."""
+    _pending.pop(job_id, None)
+
+
+# --- Results (origin side)
+
+
+async def _listen(stop: asyncio.Event) -> None:
+    r = _redis()
+    key = _results_key(INSTANCE_ID)
+    last = "0"
+    while not stop.is_set():
+        try:
+            resp = await r.xread({key: last}, count=256, block=1000)
+        except Exception as e:
+            logger.warning("Reading distributed results failed: %s", e)
+            await asyncio.sleep(1)
+            continue
+        for _, entries in resp or []:
+            for entry_id, fields in entries:
+                last = entry_id
+                _deliver(fields)
+            with contextlib.suppress(Exception):
+                await r.xdel(key, *[entry_id for entry_id, _ in entries])
+
+
+def _deliver(fields: Dict[bytes, bytes]) -> None:
+    job_id = fields[b"job"].decode()
+    job = _pending.get(job_id)
+    if job is None:
+        return
+    kind = fields[b"kind"]
+    if kind == b"chunk":
+        job.publish(fields[b"data"])
+    elif kind == b"end":
+        _pending.pop(job_id, None)
+        job.finish()
+    elif kind == b"result":
+        _pending.pop(job_id, None)
+        job.set_result(orjson.loads(fields[b"data"]))
+
+
+# --- Workers
+
+
+class _RemoteSink:
+    """Job stand-in for a worker: forwards what the upstream call produces to the origin."""
+
+    def __init__(self, job_id: str):
+        self.id = job_id
+        self.outbox: asyncio.Queue = asyncio.Queue()
+
+    def publish(self, chunk: bytes) -> None:
+        self.outbox.put_nowait((b"chunk", chunk))
+
+    def finish(self) -> None:
+        self.outbox.put_nowait((b"end", b""))
+
+    def set_result(self, result: Dict[str, Any]) -> None:
+        self.outbox.put_nowait((b"result", orjson.dumps(result)))
+
+
+async def _forward(origin: str, sink: _RemoteSink) -> None:
+    r = _redis()
+    key = _results_key(origin)
+    done = False
+    while not done:
+        batch = [await sink.outbox.get()]
+        while not sink.outbox.empty():
+            batch.append(sink.outbox.get_nowait())
+        pipe = r.pipeline(transaction=False)
+        for item in batch:
+            if item is None:
+                done = True
+                break
+            kind, data = item
+            pipe.xadd(key, {"job": sink.id, "kind": kind, "data": data}, maxlen=100_000, approximate=True)
+        pipe.expire(key, settings.distributed_result_ttl_s)
+        try:
+            await pipe.execute()
+        except Exception as e:
+            logger.warning("Forwarding results for job %s to %s failed: %s", sink.id, origin, e)
+
+
+async def _acquire_lease(backend, stop: asyncio.Event) -> Optional[str]:
+    r = _redis()
+    lease = f"{INSTANCE_ID}:{uuid.uuid4().hex[:8]}"
+    while not stop.is_set():
+        try:
+            granted = await r.eval(
+                _LUA_ACQUIRE,
+                2,
+                _slots_key(backend),
+                _limit_key(backend),
+                settings.distributed_lease_ttl_s,
+                backend.limiter.current(),
+                lease,
+            )
+        except Exception as e:
+            logger.warning("Acquiring a concurrency lease failed: %s", e)
+            granted = 0
+            await asyncio.sleep(1)
+        if granted:
+            _leases[lease] = _slots_key(backend)
+            return lease
+        await asyncio.sleep(0.02 + random.random() * 0.03)
+    return None
+
+
+async def _release_lease(lease: str) -> None:
+    key = _leases.pop(lease, None)
+    if key:
+        with contextlib.suppress(Exception):
+            await _redis().zrem(key, lease)
+
+
+async def _ensure_group(backend) -> None:
+    try:
+        await _redis().xgroup_create(_jobs_key(backend), GROUP, id="0", mkstream=True)
+    except Exception as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def _consume(backend, execute: Execute, stop: asyncio.Event, running: set) -> None:
+    r = _redis()
+    key = _jobs_key(backend)
+    has_group = False
+    backoff = 1.0
+    while not stop.is_set():
+        if not has_group:
+            # Redis may be down at startup, or flushed/failed over since (NOGROUP)
+            try:
+                await _ensure_group(backend)
+                has_group, backoff = True, 1.0
+            except Exception as e:
+                logger.warning("Creating the distributed consumer group failed, retrying in %.0fs: %s", backoff, e)
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(stop.wait(), backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+        await backend.limiter.acquire()
+        lease = await _acquire_lease(backend, stop)
+        if lease is None:
+            backend.limiter.release()
+            break
+        try:
+            resp = await r.xreadgroup(GROUP, INSTANCE_ID, {key: ">"}, count=1, block=1000)
+        except Exception as e:
+            logger.warning("Reading the distributed job queue failed: %s", e)
+            resp = None
+            if "NOGROUP" in str(e):
+                has_group = False
+            else:
+                await asyncio.sleep(1)
+        if not resp or not resp[0][1]:
+            await _release_lease(lease)
+            backend.limiter.release()
+            continue
+        entry_id, fields = resp[0][1][0]
+        task = asyncio.create_task(_run_entry(backend, lease, entry_id, fields, execute), name=f"vllm-job:{backend.name}")
+        running.add(task)
+        task.add_done_callback(running.discard)
+
+
+async def _run_entry(backend, lease: str, entry_id, fields: Dict[bytes, bytes], execute: Execute) -> None:
+    r = _redis()
+    key = _jobs_key(backend)
+    _working[entry_id] = key
+    sink = _RemoteSink(fields[b"id"].decode())
+    forwarder = asyncio.create_task(_forward(fields[b"origin"].decode(), sink))
+    cost = int(fields.get(b"cost") or 0)
+    try:
+        await backend.tokens.acquire(cost)
+        if fields.get(b"enqueued_at"):
+            gateway_queue_wait.labels(backend=backend.name, endpoint=fields[b"endpoint"].decode()).observe(
+                time.time() - float(fields[b"enqueued_at"])
+            )
+        try:
+            deadline = fields.get(b"deadline") or b""
+            await execute(
+                sink,
+                backend,
+                fields[b"endpoint"].decode(),
+                orjson.loads(fields[b"body"]),
+                fields[b"stream"] == b"1",
+                float(deadline) if deadline else None,
+                int(fields[b"prompt_tokens"]) if fields.get(b"prompt_tokens") else None,
+            )
+        finally:
+            backend.tokens.release(cost)
+    finally:
+        sink.outbox.put_nowait(None)
+        await forwarder
+        backend.limiter.release()
+        await _release_lease(lease)
+        _working.pop(entry_id, None)
+        with contextlib.suppress(Exception):
+            await r.xack(key, GROUP, entry_id)
+            await r.xdel(key, entry_id)
+
+
+async def _heartbeat(backends: List[Any], stop: asyncio.Event) -> None:
+    r = _redis()
+    ttl = settings.distributed_lease_ttl_s
+    while not stop.is_set():
+        await asyncio.sleep(ttl / 3)
+        try:
+            for lease, key in list(_leases.items()):
+                await r.eval(_LUA_RENEW, 1, key, ttl, lease)
+            # Claiming our own entries resets their idle time, so they are not taken as orphaned
+            by_stream: Dict[str, List[Any]] = {}
+            for entry_id, key in list(_working.items()):
+                by_stream.setdefault(key, []).append(entry_id)
+            for key, ids in by_stream.items():
+                await r.xclaim(key, GROUP, INSTANCE_ID, 0, ids, justid=True)
+            for backend in backends:
+                await _sync_limit(backend)
+                await _reap(backend)
+        except Exception as e:
+            logger.warning("Distributed queue heartbeat failed: %s", e)
+
+
+async def _sync_limit(backend) -> None:
+    limiter = backend.limiter
+    # The shared value outlives an instance restart, but not the whole deployment
+    expire_s = int(settings.distributed_lease_ttl_s * 20)
+    shared = await _redis().eval(
+        _LUA_SYNC_LIMIT, 1, _limit_key(backend), limiter.current(), repr(limiter.adjusted_at), expire_s
+    )
+    if shared is not None:
+        limiter.adopt(int(shared))
+
+
+async def _reap(backend) -> None:
+    """Answer jobs whose worker died mid-flight with an error."""
+    r = _redis()
+    key = _jobs_key(backend)
+    min_idle_ms = int(settings.distributed_lease_ttl_s * 2 * 1000)
+    resp = await r.xautoclaim(key, GROUP, INSTANCE_ID, min_idle_ms, start_id="0-0", count=100)
+    claimed: List[Tuple[Any, Optional[Dict[bytes, bytes]]]] = resp[1] if resp else []
+    for entry_id, fields in claimed:
+        if entry_id in _working:
+            continue
+        if fields:
+            logger.warning("Job %s was orphaned by a crashed gateway worker", fields[b"id"].decode())
+            sink = _RemoteSink(fields[b"id"].decode())
+            message = "Gateway worker lost while running the request"
+            if fields[b"stream"] == b"1":
+                sink.publish(vllm_client.sse_error({"status": 502, "message": message}))
+                sink.finish()
+            else:
+                sink.set_result({"__error__": True, "message": message, "status_code": 502})
+            sink.outbox.put_nowait(None)
+            await _forward(fields[b"origin"].decode(), sink)
+        await r.xack(key, GROUP, entry_id)
+        await r.xdel(key, entry_id)
+
+
+async def run(backends: List[Any], execute: Execute, stop: asyncio.Event, running: set) -> None:
+    logger.info("Distributed queue enabled (instance %s)", INSTANCE_ID)
+    await asyncio.gather(
+        _listen(stop),
+        _heartbeat(backends, stop),
+        *(_consume(b, execute, stop, running) for b in backends),
+    )
+
+
+async def aclose() -> None:
+    global _client
+    for lease in list(_leases):
+        await _release_lease(lease)
+    if _client is not None:
+        with contextlib.suppress(Exception):
+            await _client.delete(_results_key(INSTANCE_ID))
+            await _client.aclose()
+        _client = None
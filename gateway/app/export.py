@@ -0,0 +1,388 @@
+# app/export.py
+
+import base64
+import csv
+import io
+import logging
+import os
+import time as _time
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import orjson
+from sqlalchemy import text
+
+from .config import settings
+from .db import get_read_session
+
+try:
+    import pyarrow as pa  # optional: only needed for Parquet exports
+    import pyarrow.parquet as pq
+except Exception:  # pragma: no cover
+    pa = None  # type: ignore
+    pq = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+REQUEST_COLUMNS = [
+    "id",
+    "created_at",
+    "key_id",
+    "user_id",
+    "endpoint",
+    "model",
+    "status_code",
+    "error_message",
+    "prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+    "latency_ms",
+    "cache_hit",
+]
+REQUEST_BODY_COLUMNS = ["request_body", "response_body"]
+
+USAGE_COLUMNS = [
+    "id",
+    "day",
+    "key_id",
+    "user_id",
+    "request_count",
+    "prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+]
+
+
+# --- Cursors
+# Rows are exported in a stable (sort key, id) order so a client can resume an
+# interrupted download from the cursor of the last row it received.
+
+def encode_cursor(sort_value: Any, row_id: Any) -> str:
+    raw = f"{sort_value.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(cursor + padding).decode("utf-8")
+        sort_value, row_id = raw.split("|", 1)
+        return sort_value, row_id
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+# --- Filters
+
+def parse_bound(value: Optional[str], end: bool = False) -> Optional[datetime]:
+    """Parse YYYY-MM-DD or an ISO datetime; date-only upper bounds cover the whole day."""
+    if not value:
+        return None
+    s = value.strip()
+    try:
+        dt = datetime.fromisoformat(s)
+    except ValueError:
+        d = date.fromisoformat(s)  # raises ValueError on bad input
+        dt = datetime.combine(d, time.max if end else time.min)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def request_filters(
+    from_ts: Optional[datetime] = None,
+    to_ts: Optional[datetime] = None,
+    key_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    endpoint: Optional[str] = None,
+    model: Optional[str] = None,
+    status_code: Optional[int] = None,
+    errors_only: Optional[bool] = None,
+) -> Tuple[List[str], Dict[str, Any]]:
+    """WHERE clauses shared by the request log view and the request export."""
+    clauses: List[str] = []
+    params: Dict[str, Any] = {}
+    if from_ts is not None:
+        clauses.append("created_at >= :from_ts")
+        params["from_ts"] = from_ts
+    if to_ts is not None:
+        clauses.append("created_at <= :to_ts")
+        params["to_ts"] = to_ts
+    if key_id:
+        clauses.append("key_id = :key_id")
+        params["key_id"] = key_id
+    if user_id:
+        clauses.append("user_id = :user_id")
+        params["user_id"] = user_id
+    if endpoint:
+        clauses.append("endpoint = :endpoint")
+        params["endpoint"] = endpoint
+    if model:
+        clauses.append("model = :model")
+        params["model"] = model
+    if status_code is not None:
+        clauses.append("status_code = :status_code")
+        params["status_code"] = status_code
+    if errors_only:
+        clauses.append("status_code >= 400")
+    return clauses, params
+
+
+def usage_filters(
+    from_day: Optional[date] = None,
+    to_day: Optional[date] = None,
+    key_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+) -> Tuple[List[str], Dict[str, Any]]:
+    clauses: List[str] = []
+    params: Dict[str, Any] = {}
+    if from_day is not None:
+        clauses.append("day >= :from_day")
+        params["from_day"] = from_day
+    if to_day is not None:
+        clauses.append("day <= :to_day")
+        params["to_day"] = to_day
+    if key_id:
+        clauses.append("key_id = :key_id")
+        params["key_id"] = key_id
+    if user_id:
+        clauses.append("user_id = :user_id")
+        params["user_id"] = user_id
+    return clauses, params
+
+
+# --- Server-side cursor iteration
+
+def _iter_rows(
+    table: str,
+    columns: List[str],
+    sort_col: str,
+    clauses: List[str],
+    params: Dict[str, Any],
+    after: Optional[str],
+    limit: Optional[int],
+) -> Iterator[Dict[str, Any]]:
+    clauses = list(clauses)
+    params = dict(params)
+    if after:
+        sort_value, row_id = decode_cursor(after)
+        clauses.append(f"({sort_col}, id) > (:after_sort, :after_id)")
+        try:
+            params["after_sort"] = date.fromisoformat(sort_value) if sort_col == "day" else datetime.fromisoformat(sort_value)
+            params["after_id"] = uuid.UUID(row_id) if table == "requests" else int(row_id)
+        except ValueError:
+            raise ValueError("Invalid cursor")
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    limit_sql = ""
+    if limit:
+        limit_sql = "LIMIT :limit"
+        params["limit"] = limit
+    sql = text(
+        f"SELECT {', '.join(columns)} FROM {table} {where} ORDER BY {sort_col} ASC, id ASC {limit_sql}"
+    ).execution_options(stream_results=True, yield_per=settings.export_batch_size)
+    # Cursor/filter errors surface above, before the response starts streaming
+    return _stream_rows(sql, params, sort_col)
+
+
+def _stream_rows(sql, params: Dict[str, Any], sort_col: str) -> Iterator[Dict[str, Any]]:
+    with get_read_session() as db:
+        result = db.execute(sql, params)
+        for row in result:
+            item = dict(row._mapping)
+            item["cursor"] = encode_cursor(item[sort_col], item["id"])
+            yield item
+
+
+def iter_requests(clauses, params, after=None, limit=None, include_bodies=False) -> Iterator[Dict[str, Any]]:
+    columns = REQUEST_COLUMNS + (REQUEST_BODY_COLUMNS if include_bodies else [])
+    return _iter_rows("requests", columns, "created_at", clauses, params, after, limit)
+
+
+def iter_usage(clauses, params, after=None, limit=None) -> Iterator[Dict[str, Any]]:
+    return _iter_rows("usage_rollups", USAGE_COLUMNS, "day", clauses, params, after, limit)
+
+
+# --- Encoders (sync generators: Starlette drives them from its threadpool, so
+# the blocking cursor reads never run on the event loop)
+
+def _batched(rows: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def to_ndjson(rows: Iterator[Dict[str, Any]]) -> Iterator[bytes]:
+    for batch in _batched(rows, settings.export_batch_size):
+        yield b"".join(orjson.dumps(r, option=orjson.OPT_APPEND_NEWLINE) for r in batch)
+
+
+def _csv_value(v: Any) -> Any:
+    if v is None:
+        return ""
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    if isinstance(v, (dict, list)):
+        return orjson.dumps(v).decode("utf-8")
+    return v
+
+
+def to_csv(rows: Iterator[Dict[str, Any]], columns: List[str]) -> Iterator[bytes]:
+    header = columns + ["cursor"]
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    yield buf.getvalue().encode("utf-8")
+    for batch in _batched(rows, settings.export_batch_size):
+        buf.seek(0)
+        buf.truncate(0)
+        for r in batch:
+            writer.writerow([_csv_value(r.get(c)) for c in header])
+        yield buf.getvalue().encode("utf-8")
+
+
+# --- Background Parquet exports
+
+# Finished exports (and their files) are kept for EXPORT_TTL_S, and at most
+# EXPORT_MAX_KEPT of them; ids of pruned exports are remembered (bounded) so
+# their status answers "expired" rather than "not found".
+_exports: Dict[str, Dict[str, Any]] = {}
+_expired: "OrderedDict[str, None]" = OrderedDict()
+_EXPIRED_IDS_KEPT = 10000
+
+
+def parquet_available() -> bool:
+    return pa is not None
+
+
+def _drop_export(export_id: str) -> None:
+    rec = _exports.pop(export_id)
+    try:
+        os.remove(rec["path"])
+    except OSError:
+        pass
+    _expired[export_id] = None
+    while len(_expired) > _EXPIRED_IDS_KEPT:
+        _expired.popitem(last=False)
+
+
+def prune_exports() -> None:
+    """Remove finished exports past their TTL, then the oldest finished beyond the cap."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.export_ttl_s)
+    finished = [r for r in _exports.values() if r["finished_at"] is not None]
+    finished.sort(key=lambda r: r["finished_at"])
+    excess = len(finished) - settings.export_max_kept
+    for i, rec in enumerate(finished):
+        if i < excess or datetime.fromisoformat(rec["finished_at"]) < cutoff:
+            _drop_export(rec["id"])
+
+
+def _sweep_export_dir() -> None:
+    # Files from earlier processes have no record left; age them out by mtime
+    live = {r["path"] for r in _exports.values()} | {r["path"] + ".part" for r in _exports.values()}
+    cutoff = _time.time() - settings.export_ttl_s
+    try:
+        names = os.listdir(settings.export_dir)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(settings.export_dir, name)
+        if path in live or not name.endswith((".parquet", ".parquet.part")):
+            continue
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def get_export(export_id: str) -> Optional[Dict[str, Any]]:
+    prune_exports()
+    return _exports.get(export_id)
+
+
+def export_expired(export_id: str) -> bool:
+    return export_id in _expired
+
+
+def new_export(dataset: str) -> Dict[str, Any]:
+    prune_exports()
+    _sweep_export_dir()
+    export_id = uuid.uuid4().hex
+    rec = {
+        "id": export_id,
+        "dataset": dataset,
+        "format": "parquet",
+        "status": "pending",
+        "rows": 0,
+        "last_cursor": None,
+        "error": None,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "finished_at": None,
+        "path": os.path.join(settings.export_dir, f"{dataset}-{export_id}.parquet"),
+    }
+    _exports[export_id] = rec
+    return rec
+
+
+def _parquet_value(v: Any) -> Any:
+    if isinstance(v, uuid.UUID):
+        return str(v)
+    if isinstance(v, (dict, list)):
+        return orjson.dumps(v).decode("utf-8")
+    return v
+
+
+def _parquet_schema(columns: List[str]):
+    types = {
+        "created_at": pa.timestamp("us", tz="UTC"),
+        "day": pa.date32(),
+        "status_code": pa.int32(),
+        "latency_ms": pa.int32(),
+        "prompt_tokens": pa.int64(),
+        "completion_tokens": pa.int64(),
+        "total_tokens": pa.int64(),
+        "request_count": pa.int64(),
+        "cache_hit": pa.bool_(),
+    }
+    return pa.schema([(c, types.get(c, pa.string())) for c in columns + ["cursor"]])
+
+
+def write_parquet(export_id: str, rows: Iterator[Dict[str, Any]], columns: List[str]) -> None:
+    """Write rows batch by batch so memory stays bounded by export_batch_size."""
+    rec = _exports[export_id]
+    rec["status"] = "running"
+    tmp_path = rec["path"] + ".part"
+    schema = _parquet_schema(columns)
+    writer = None
+    try:
+        os.makedirs(settings.export_dir, exist_ok=True)
+        writer = pq.ParquetWriter(tmp_path, schema)
+        for batch in _batched(rows, settings.export_batch_size):
+            data = {f.name: [_parquet_value(r.get(f.name)) for r in batch] for f in schema}
+            writer.write_table(pa.table(data, schema=schema))
+            rec["rows"] += len(batch)
+            rec["last_cursor"] = batch[-1]["cursor"]
+        writer.close()
+        writer = None
+        os.replace(tmp_path, rec["path"])
+        rec["status"] = "done"
+    except Exception as e:
+        logger.exception("Parquet export %s failed: %s", export_id, e)
+        rec["status"] = "failed"
+        rec["error"] = f"{type(e).__name__}: {e}"
+        if writer is not None:
+            writer.close()
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    finally:
+        rec["finished_at"] = datetime.now(timezone.utc).isoformat()
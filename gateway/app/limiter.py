@@ -0,0 +1,327 @@
+# app/limiter.py
+
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import httpx
+
+from .config import settings
+from .metrics import (
+    gateway_concurrency_adjustments,
+    gateway_concurrency_limit,
+    gateway_tokens_inflight,
+    gateway_ttft_seconds,
+    gateway_vllm_kv_cache_usage,
+    gateway_vllm_waiting,
+)
+
+logger = logging.getLogger(__name__)
+
+# Adaptive in-flight limit per model backend (AIMD).
+# Every ADAPTIVE_INTERVAL_S the limit is cut multiplicatively when the backend
+# shows signs of overload -- vLLM reports waiting requests or a nearly full KV
+# cache on /metrics, time-to-first-token or inter-token latency drift well above
+# their running baseline, or upstream calls fail -- and grows by one when the
+# limit was the bottleneck and none of those apply. With ADAPTIVE_CONCURRENCY
+# off the limit stays at the backend's max_concurrency.
+
+# vLLM v0 exposes gpu_cache_usage_perc, v1 kv_cache_usage_perc (both 0..1)
+_VLLM_WAITING = ("vllm:num_requests_waiting",)
+_VLLM_KV_USAGE = ("vllm:kv_cache_usage_perc", "vllm:gpu_cache_usage_perc")
+
+# TokenBudget below additionally caps the estimated tokens in flight, since a
+# 16k-token prompt and a short chat are very different loads.
+
+# Every limiter created (one per model backend), for the adjust loop
+_limiters: List["AdaptiveLimiter"] = []
+
+
+class AdaptiveLimiter:
+    def __init__(self, name: str, initial: int, urls: Optional[List[str]] = None):
+        self.name = name
+        self.adaptive = settings.adaptive_concurrency
+        self.min_limit = max(1, settings.adaptive_min_concurrency)
+        self.max_limit = max(initial, settings.adaptive_max_concurrency) if self.adaptive else initial
+        self.limit = float(initial)
+        self.inflight = 0
+        self.urls = [u.rstrip("/") for u in urls or []]
+        self._waiters: Deque[asyncio.Future] = deque()
+        # Recent (EWMA) and baseline (slow-rising minimum) latencies
+        self.ttft_s: Optional[float] = None
+        self.itl_s: Optional[float] = None
+        self.ttft_base_s: Optional[float] = None
+        self.itl_base_s: Optional[float] = None
+        # Non-streamed requests: whole-request time per output token, prefill included
+        self.tpot_s: Optional[float] = None
+        self.tpot_base_s: Optional[float] = None
+        self.vllm_waiting: Optional[float] = None
+        self.kv_cache_usage: Optional[float] = None
+        self._saturated = False
+        self._errors = 0
+        self.last_reason: Optional[str] = None
+        # Wall-clock time of this instance's last own change; in distributed mode the
+        # most recent change across instances becomes everyone's limit (see distributed.py)
+        self.adjusted_at = 0.0
+        gateway_concurrency_limit.labels(backend=name).set(initial)
+        _limiters.append(self)
+
+    def current(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    async def acquire(self) -> None:
+        if self.inflight < self.current() and not self._waiters:
+            self.inflight += 1
+            return
+        self._saturated = True
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()  # granted just before the cancellation landed
+            else:
+                with contextlib.suppress(ValueError):
+                    self._waiters.remove(fut)
+            raise
+
+    def release(self) -> None:
+        self.inflight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.inflight < self.current():
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self.inflight += 1
+                fut.set_result(None)
+
+    # --- Signals
+
+    def observe(
+        self, ttft_s: Optional[float] = None, itl_s: Optional[float] = None, tpot_s: Optional[float] = None
+    ) -> None:
+        if ttft_s is not None:
+            gateway_ttft_seconds.labels(backend=self.name).observe(ttft_s)
+            self.ttft_s, self.ttft_base_s = _track(self.ttft_s, self.ttft_base_s, ttft_s)
+        if itl_s is not None:
+            self.itl_s, self.itl_base_s = _track(self.itl_s, self.itl_base_s, itl_s)
+        if tpot_s is not None:
+            self.tpot_s, self.tpot_base_s = _track(self.tpot_s, self.tpot_base_s, tpot_s)
+
+    def observe_error(self) -> None:
+        self._errors += 1
+
+    def _overload_reason(self) -> Optional[str]:
+        if self.kv_cache_usage is not None and self.kv_cache_usage >= settings.adaptive_kv_cache_high:
+            return "kv_cache"
+        if self.vllm_waiting:
+            return "vllm_waiting"
+        if self._errors:
+            return "errors"
+        tolerance = settings.adaptive_latency_tolerance
+        if self.ttft_s is not None and self.ttft_base_s and self.ttft_s > self.ttft_base_s * tolerance:
+            return "ttft"
+        if self.itl_s is not None and self.itl_base_s and self.itl_s > self.itl_base_s * tolerance:
+            return "itl"
+        if self.tpot_s is not None and self.tpot_base_s and self.tpot_s > self.tpot_base_s * tolerance:
+            return "tpot"
+        return None
+
+    def adjust(self) -> None:
+        reason = self._overload_reason()
+        before = self.current()
+        if reason is not None:
+            self.limit = max(float(self.min_limit), self.limit * settings.adaptive_backoff)
+            direction = "decrease"
+        elif self._saturated and self.limit < self.max_limit:
+            self.limit = min(float(self.max_limit), self.limit + 1)
+            direction, reason = "increase", "saturated"
+        else:
+            direction = None
+        self._saturated = self.inflight >= self.current()
+        self._errors = 0
+        if direction is None or self.current() == before:
+            return
+        self.last_reason = reason
+        self.adjusted_at = time.time()
+        gateway_concurrency_limit.labels(backend=self.name).set(self.current())
+        gateway_concurrency_adjustments.labels(backend=self.name, direction=direction, reason=reason).inc()
+        logger.debug("Concurrency limit for %s: %d -> %d (%s)", self.name, before, self.current(), reason)
+        self._wake()
+
+    def adopt(self, limit: int) -> None:
+        """Take over the shared limit published by another instance."""
+        limit = min(max(int(limit), self.min_limit), self.max_limit)
+        if limit == self.current():
+            return
+        self.limit = float(limit)
+        gateway_concurrency_limit.labels(backend=self.name).set(self.current())
+        self._wake()
+
+    async def scrape(self, client: httpx.AsyncClient) -> None:
+        """Sum waiting requests and take the fullest KV cache across the backend's replicas."""
+        waiting: Optional[float] = None
+        usage: Optional[float] = None
+        for url in self.urls:
+            try:
+                r = await client.get(f"{url}/metrics", timeout=settings.upstream_health_timeout_s)
+                r.raise_for_status()
+            except Exception as e:
+                logger.debug("vLLM metrics scrape failed for %s: %s", url, e)
+                continue
+            w, u = parse_vllm_metrics(r.text)
+            if w is not None:
+                waiting = (waiting or 0.0) + w
+            if u is not None:
+                usage = u if usage is None else max(usage, u)
+        self.vllm_waiting, self.kv_cache_usage = waiting, usage
+        if waiting is not None:
+            gateway_vllm_waiting.labels(backend=self.name).set(waiting)
+        if usage is not None:
+            gateway_vllm_kv_cache_usage.labels(backend=self.name).set(usage)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "adaptive": self.adaptive,
+            "limit": self.current(),
+            "min": self.min_limit,
+            "max": self.max_limit,
+            "inflight": self.inflight,
+            "waiting": len(self._waiters),
+            "ttft_s": self.ttft_s,
+            "ttft_baseline_s": self.ttft_base_s,
+            "itl_s": self.itl_s,
+            "itl_baseline_s": self.itl_base_s,
+            "tpot_s": self.tpot_s,
+            "tpot_baseline_s": self.tpot_base_s,
+            "vllm_waiting": self.vllm_waiting,
+            "kv_cache_usage": self.kv_cache_usage,
+            "last_reason": self.last_reason,
+        }
+
+
+class TokenBudget:
+    """Admits jobs by estimated tokens in flight (prompt + max_tokens); 0 disables it.
+
+    Grants are FIFO, and a job larger than the whole budget still runs once
+    nothing else is in flight so it cannot starve.
+    """
+
+    def __init__(self, name: str, budget: int):
+        self.name = name
+        self.budget = budget
+        self.inflight = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+    def _fits(self, cost: int) -> bool:
+        return self.inflight == 0 or self.inflight + cost <= self.budget
+
+    async def acquire(self, cost: int) -> None:
+        if self.budget <= 0:
+            return
+        if not self._waiters and self._fits(cost):
+            self._take(cost)
+            return
+        fut = asyncio.get_running_loop().create_future()
+        entry = (cost, fut)
+        self._waiters.append(entry)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release(cost)
+            else:
+                with contextlib.suppress(ValueError):
+                    self._waiters.remove(entry)
+                self._wake()
+            raise
+
+    def release(self, cost: int) -> None:
+        if self.budget <= 0:
+            return
+        self.inflight -= cost
+        gateway_tokens_inflight.labels(backend=self.name).set(self.inflight)
+        self._wake()
+
+    def _take(self, cost: int) -> None:
+        self.inflight += cost
+        gateway_tokens_inflight.labels(backend=self.name).set(self.inflight)
+
+    def _wake(self) -> None:
+        while self._waiters and self._fits(self._waiters[0][0]):
+            cost, fut = self._waiters.popleft()
+            if not fut.done():
+                self._take(cost)
+                fut.set_result(None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"budget": self.budget, "inflight": self.inflight, "waiting": len(self._waiters)}
+
+
+def _track(recent: Optional[float], base: Optional[float], sample: float):
+    recent = sample if recent is None else 0.8 * recent + 0.2 * sample
+    # The baseline follows drops immediately and creeps up slowly, so it
+    # approximates the unloaded latency
+    base = sample if base is None or sample < base else base + 0.01 * (sample - base)
+    return recent, base
+
+
+def parse_vllm_metrics(text: str):
+    """(num_requests_waiting summed over models, highest KV cache usage) from a Prometheus scrape."""
+    waiting: Optional[float] = None
+    usage: Optional[float] = None
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        if "{" in line:
+            name, rest = line[: line.index("{")], line[line.rindex("}") + 1 :]
+        else:
+            name, _, rest = line.partition(" ")
+        try:
+            value = float(rest.split()[0])
+        except (IndexError, ValueError):
+            continue
+        if name in _VLLM_WAITING:
+            waiting = (waiting or 0.0) + value
+        elif name in _VLLM_KV_USAGE:
+            usage = value if usage is None else max(usage, value)
+    return waiting, usage
+
+
+# --- Adjust loop
+
+_adjust_task: Optional[asyncio.Task] = None
+
+
+async def _adjust_loop() -> None:
+    interval = settings.adaptive_interval_s
+    async with httpx.AsyncClient() as client:
+        while True:
+            await asyncio.sleep(interval)
+            if settings.vllm_metrics_scrape:
+                await asyncio.gather(*(lim.scrape(client) for lim in _limiters))
+            for lim in _limiters:
+                try:
+                    lim.adjust()
+                except Exception:
+                    logger.exception("Concurrency adjustment failed for %s", lim.name)
+
+
+def start_adaptive_concurrency() -> Optional[asyncio.Task]:
+    global _adjust_task
+    if not settings.adaptive_concurrency or settings.adaptive_interval_s <= 0:
+        return None
+    _adjust_task = asyncio.create_task(_adjust_loop(), name="adaptive-concurrency")
+    return _adjust_task
+
+
+async def stop_adaptive_concurrency() -> None:
+    if _adjust_task:
+        _adjust_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await _adjust_task
@@ -0,0 +1,165 @@
+# app/loopmon.py
+
+import asyncio
+import contextlib
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Dict, List, Optional
+
+from .config import settings
+from .metrics import gateway_event_loop_lag, gateway_event_loop_stalls
+
+logger = logging.getLogger(__name__)
+
+# Event-loop lag monitor.
+# A coroutine sleeps LOOP_MONITOR_INTERVAL_S at a time and records how late it
+# wakes up. A watchdog thread watches that heartbeat: when the loop has not
+# come back for LOOP_LAG_THRESHOLD_S it grabs the loop thread's stack, which
+# at that moment is the blocking call (sync DB, bcrypt, logging, ...). Call
+# sites are aggregated for /admin/loop-lag and stacks are logged at most once
+# per LOOP_LAG_LOG_INTERVAL_S.
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class _Site:
+    __slots__ = ("count", "stalled_s", "last_seen", "stack")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.stalled_s = 0.0
+        self.last_seen = 0.0
+        self.stack = ""
+
+
+class LoopMonitor:
+    def __init__(self) -> None:
+        self.interval = settings.loop_monitor_interval_s
+        self.threshold = settings.loop_lag_threshold_s
+        self.sites: Dict[str, _Site] = {}
+        self.stalls = 0
+        self.max_lag_s = 0.0
+        self._beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._pending_site: Optional[str] = None
+        self._last_log = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+
+    # --- Loop side
+
+    async def _tick(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self._beat = time.monotonic()
+            gateway_event_loop_lag.observe(lag)
+            self.max_lag_s = max(self.max_lag_s, lag)
+            if lag >= self.threshold:
+                with self._lock:
+                    site = self._pending_site
+                    self._pending_site = None
+                    if site is not None:
+                        self.sites[site].stalled_s += lag
+
+    # --- Watchdog thread
+
+    def _watch(self) -> None:
+        captured = False
+        while not self._stop.wait(self.threshold / 2):
+            stalled = time.monotonic() - self._beat - self.interval
+            if stalled < self.threshold:
+                captured = False
+                continue
+            if captured:
+                continue  # one sample per stall
+            captured = True
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            self._record(traceback.extract_stack(frame), stalled)
+
+    def _record(self, stack: traceback.StackSummary, stalled: float) -> None:
+        site = _call_site(stack)
+        text = "".join(stack.format())
+        now = time.monotonic()
+        with self._lock:
+            entry = self.sites.setdefault(site, _Site())
+            entry.count += 1
+            entry.last_seen = time.time()
+            entry.stack = text
+            self._pending_site = site
+            self.stalls += 1
+            should_log = now - self._last_log >= settings.loop_lag_log_interval_s
+            if should_log:
+                self._last_log = now
+        gateway_event_loop_stalls.inc()
+        if should_log:
+            logger.warning("Event loop blocked for %.3fs+ at %s\n%s", stalled, site, text)
+
+    # --- Lifecycle
+
+    def start(self) -> None:
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._tick(), name="loop-monitor")
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+
+    def report(self, limit: int = 20) -> Dict[str, Any]:
+        with self._lock:
+            top = sorted(self.sites.items(), key=lambda kv: kv[1].stalled_s or kv[1].count, reverse=True)[:limit]
+            items: List[Dict[str, Any]] = [
+                {
+                    "site": site,
+                    "count": s.count,
+                    "stalled_s": round(s.stalled_s, 3),
+                    "last_seen": s.last_seen,
+                    "stack": s.stack,
+                }
+                for site, s in top
+            ]
+        return {
+            "interval_s": self.interval,
+            "threshold_s": self.threshold,
+            "stalls": self.stalls,
+            "max_lag_s": round(self.max_lag_s, 3),
+            "items": items,
+        }
+
+
+def _call_site(stack: traceback.StackSummary) -> str:
+    """The innermost gateway frame (where the blocking call was made) plus the frame actually running."""
+    inner = stack[-1]
+    ours = next((f for f in reversed(stack) if f.filename.startswith(_APP_DIR)), None)
+    where = f"{os.path.basename(inner.filename)}:{inner.lineno} {inner.name}"
+    if ours is None or ours is inner:
+        return where
+    return f"{os.path.relpath(ours.filename, os.path.dirname(_APP_DIR))}:{ours.lineno} {ours.name} -> {where}"
+
+
+monitor = LoopMonitor()
+
+
+def start_loop_monitor() -> None:
+    if settings.loop_monitor_enabled:
+        monitor.start()
+
+
+async def stop_loop_monitor() -> None:
+    await monitor.stop()
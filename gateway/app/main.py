@@ -1,10 +1,16 @@
 from fastapi import FastAPI
 from .routes import public, admin, user
 from .metrics import metrics_router
-from .db import init_db
+from .db import init_db, start_replica_checks, stop_replica_checks
 from .queue import start_dispatcher, stop_dispatcher
+from .upstreams import start_health_checks, stop_health_checks
+from .limiter import start_adaptive_concurrency, stop_adaptive_concurrency
+from .loopmon import start_loop_monitor, stop_loop_monitor
+from . import distributed, registry, vllm_client
 from .logging import setup_logging
+from .config import settings
 from fastapi.middleware.cors import CORSMiddleware
+import logging
 import os
 
 setup_logging()
@@ -62,11 +68,28 @@ import asyncio
 async def lifespan(app: FastAPI):
     # startup
     await init_db()
+    if settings.gateway_workers > 1 and not settings.distributed_queue:
+        logging.getLogger(__name__).warning(
+            "Running %d workers without DISTRIBUTED_QUEUE: queues and VLLM_MAX_CONCURRENCY apply per worker",
+            settings.gateway_workers,
+        )
+    await registry.start_discovery()
     dispatcher_task = start_dispatcher()  # returns asyncio.Task
+    start_health_checks()
+    start_adaptive_concurrency()
+    start_loop_monitor()
+    start_replica_checks()
     try:
         yield
     finally:
         # shutdown
         await stop_dispatcher(dispatcher_task)
+        await stop_health_checks()
+        await registry.stop_discovery()
+        await stop_adaptive_concurrency()
+        await stop_loop_monitor()
+        await stop_replica_checks()
+        await vllm_client.aclose()
+        await distributed.aclose()
 
 app.router.lifespan_context = lifespan
@@ -1,16 +1,163 @@
+import heapq
+import os
+from typing import Dict, Optional, Set
+
 from fastapi import APIRouter, Response
 from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import CollectorRegistry, multiprocess
+
+from .config import settings
 
 metrics_router = APIRouter()
 
-gateway_requests_total = Counter("gateway_requests_total", "Total requests", ["status", "endpoint"])
-gateway_tokens_total = Counter("gateway_tokens_total", "Total tokens", ["key_id"])
-gateway_queue_depth = Gauge("gateway_queue_depth", "Queue depth", ["endpoint"])
-gateway_upstream_latency = Histogram("gateway_upstream_latency_seconds", "Upstream latency")
+# With several workers (GATEWAY_WORKERS > 1, see start.sh) PROMETHEUS_MULTIPROC_DIR
+# is set and every process writes its samples to mmap'd files there; /metrics
+# aggregates them at scrape time. Gauges declare how worker values combine
+# (livesum for queue depth and in-flight counts, livemax/livemin for states).
+# gateway_concurrency_limit depends on the queue mode: each worker's own limit
+# adds up (livesum) with per-process queues, but with DISTRIBUTED_QUEUE every
+# worker reports the same shared limit, so the max is taken instead.
+#
+# Labels: "backend" is the registry backend name on every metric (bounded by
+# configuration, never the raw request field), so series join across metrics;
+# "key" goes through KeyLabeler below.
+
+_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+gateway_requests_total = Counter("gateway_requests_total", "Total requests", ["endpoint", "backend", "status"])
+gateway_tokens_total = Counter("gateway_tokens_total", "Total tokens (top keys, the rest as 'other')", ["backend", "kind", "key"])
+gateway_queue_depth = Gauge("gateway_queue_depth", "Jobs waiting in the local queue", ["backend"], multiprocess_mode="livesum")
+gateway_queue_wait = Histogram("gateway_queue_wait_seconds", "Time from enqueue to dispatch", ["backend", "endpoint"], buckets=_LATENCY_BUCKETS)
+gateway_itl_seconds = Histogram(
+    "gateway_itl_seconds",
+    "Mean inter-chunk latency of a streamed response",
+    ["backend"],
+    buckets=(0.005, 0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.2, 0.5, 1),
+)
+gateway_tokens_per_second = Histogram(
+    "gateway_tokens_per_second",
+    "Completion tokens per second of generation",
+    ["backend"],
+    buckets=(1, 5, 10, 20, 30, 50, 75, 100, 150, 250, 500),
+)
+gateway_upstream_responses = Counter("gateway_upstream_responses_total", "Upstream call outcomes", ["backend", "status"])
+gateway_accounting_lag = Histogram(
+    "gateway_accounting_lag_seconds", "Time from request completion to its accounting commit", buckets=_LATENCY_BUCKETS
+)
+gateway_accounting_errors = Counter("gateway_accounting_errors_total", "Requests that could not be accounted")
+gateway_upstream_latency = Histogram("gateway_upstream_latency_seconds", "Upstream latency", ["upstream"])
+gateway_upstream_inflight = Gauge("gateway_upstream_inflight", "Requests in flight per upstream", ["upstream"], multiprocess_mode="livesum")
+gateway_upstream_healthy = Gauge("gateway_upstream_healthy", "1 if the upstream passes health checks", ["upstream"], multiprocess_mode="livemin")
+gateway_upstream_affinity = Counter("gateway_upstream_affinity_total", "Prefix-affinity routing outcomes", ["result"])
+gateway_upstream_ejections = Counter("gateway_upstream_ejections_total", "Passive ejections after consecutive errors", ["upstream"])
+gateway_concurrency_limit = Gauge(
+    "gateway_concurrency_limit",
+    "Current in-flight limit per model backend",
+    ["backend"],
+    multiprocess_mode="livemax" if settings.distributed_queue else "livesum",
+)
+gateway_concurrency_adjustments = Counter("gateway_concurrency_adjustments_total", "Adaptive concurrency limit changes", ["backend", "direction", "reason"])
+gateway_ttft_seconds = Histogram(
+    "gateway_ttft_seconds", "Time to first streamed chunk from the upstream", ["backend"], buckets=_LATENCY_BUCKETS
+)
+gateway_vllm_waiting = Gauge("gateway_vllm_num_requests_waiting", "Requests waiting inside vLLM (scraped)", ["backend"], multiprocess_mode="livemax")
+gateway_vllm_kv_cache_usage = Gauge("gateway_vllm_kv_cache_usage", "Highest vLLM KV cache usage across replicas (scraped)", ["backend"], multiprocess_mode="livemax")
+gateway_jobs_cancelled = Counter("gateway_jobs_cancelled_total", "Jobs cancelled by an administrator", ["backend", "state"])
+gateway_jobs_expired = Counter("gateway_jobs_expired_total", "Queued jobs dropped because their deadline passed", ["backend"])
+gateway_tokens_inflight = Gauge("gateway_tokens_inflight", "Estimated tokens (prompt + max_tokens) admitted per backend", ["backend"], multiprocess_mode="livesum")
+gateway_token_estimate_ratio = Histogram(
+    "gateway_token_estimate_ratio",
+    "Actual prompt tokens / local estimate",
+    ["method"],
+    buckets=(0.5, 0.7, 0.8, 0.9, 0.95, 1.0, 1.05, 1.1, 1.25, 1.5, 2.0),
+)
+gateway_token_bytes_per_token = Gauge("gateway_token_bytes_per_token", "Calibrated UTF-8 bytes per token for the byte heuristic", multiprocess_mode="livemostrecent")
+gateway_context_checks = Counter("gateway_context_checks_total", "Requests rejected or clamped by the pre-queue context check", ["backend", "result"])
+gateway_breaker_state = Gauge("gateway_breaker_state", "Circuit breaker state per backend (0 closed, 1 half-open, 2 open)", ["backend"], multiprocess_mode="livemax")
+gateway_breaker_transitions = Counter("gateway_breaker_transitions_total", "Circuit breaker state changes", ["backend", "to"])
+gateway_breaker_rejections = Counter("gateway_breaker_rejections_total", "Requests refused while the circuit was open", ["backend"])
+gateway_stream_timeouts = Counter("gateway_stream_timeouts_total", "Upstream streams aborted by the watchdog", ["limit"])
+gateway_log_records_dropped = Counter("gateway_log_records_dropped_total", "Log records not written", ["reason"])
+gateway_event_loop_lag = Histogram(
+    "gateway_event_loop_lag_seconds",
+    "How late the event loop ran a scheduled wakeup",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+gateway_event_loop_stalls = Counter("gateway_event_loop_stalls_total", "Event loop stalls over LOOP_LAG_THRESHOLD_S")
 gateway_rl_exceeded = Counter("gateway_rate_limit_exceeded_total", "Rate limit exceeded")
+gateway_single_flight_joins = Counter("gateway_single_flight_joins_total", "Requests attached to an identical in-flight job", ["stream"])
+gateway_response_cache_total = Counter("gateway_response_cache_total", "Response cache lookups", ["tier", "result"])
+gateway_response_cache_bytes = Counter("gateway_response_cache_hit_bytes_total", "Bytes served from the response cache", ["tier"])
+gateway_response_cache_lru_bytes = Gauge("gateway_response_cache_lru_bytes", "Bytes held by the in-process response cache", multiprocess_mode="livesum")
+
+
+class KeyLabeler:
+    """Bounded label values for per-key metrics.
+
+    A Space-Saving sketch (capacity 4k) tracks the heaviest keys by token volume;
+    a key gets its own label once it ranks in the top k, at most 2k keys are ever
+    labelled, and everything else is reported as "other".
+
+    The sketch is per process. With several workers each one picks its own top
+    keys, so a key can have its own series in one worker and count as "other"
+    in another: summed over workers, a key's series undercounts it and "other"
+    holds the rest. Totals across all labels stay exact; for exact per-key
+    figures use the usage rollups (/admin/usage), not these series.
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+        self.capacity = 4 * k
+        self.counts: Dict[str, float] = {}
+        self.labelled: Set[str] = set()
+
+    def label(self, key: Optional[str], weight: float = 1.0) -> str:
+        if not key or self.k <= 0:
+            return "other"
+        if key in self.counts:
+            self.counts[key] += weight
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = weight
+        else:
+            # Replace the smallest counter, inheriting its count (Space-Saving)
+            smallest = min(self.counts, key=self.counts.__getitem__)
+            self.counts[key] = self.counts.pop(smallest) + weight
+        if key in self.labelled:
+            return key
+        if len(self.labelled) < 2 * self.k:
+            threshold = heapq.nlargest(self.k, self.counts.values())[-1] if len(self.counts) >= self.k else 0
+            if self.counts[key] >= threshold:
+                self.labelled.add(key)
+                return key
+        return "other"
+
+
+key_labeler = KeyLabeler(settings.metrics_top_keys)
+
+
+def count_request(endpoint: str, backend: Optional[str], status: int) -> None:
+    gateway_requests_total.labels(endpoint=endpoint, backend=backend or "unknown", status=str(status)).inc()
+
+
+def count_tokens(backend: Optional[str], key_id: Optional[str], prompt_tokens: int, completion_tokens: int) -> None:
+    key = key_labeler.label(key_id, prompt_tokens + completion_tokens)
+    if prompt_tokens:
+        gateway_tokens_total.labels(backend=backend or "unknown", kind="prompt", key=key).inc(prompt_tokens)
+    if completion_tokens:
+        gateway_tokens_total.labels(backend=backend or "unknown", kind="completion", key=key).inc(completion_tokens)
 
 
 @metrics_router.get("/metrics")
 def metrics() -> Response:
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
     return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
+
+def mark_process_dead(pid: int) -> None:
+    """Drop a finished worker's live gauges (called from the gunicorn child_exit hook)."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
+
@@ -1,5 +1,5 @@
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, Text, Integer, BigInteger, Date, ForeignKey, text
+from sqlalchemy import Column, Text, Integer, BigInteger, Boolean, Date, ForeignKey, text
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy import DateTime
 from sqlalchemy.sql import func
@@ -51,6 +51,7 @@ class Request(Base):
     completion_tokens = Column(Integer, nullable=False)
     total_tokens = Column(Integer, nullable=False)
     latency_ms = Column(Integer, nullable=True)
+    cache_hit = Column(Boolean, nullable=False, server_default=text("false"))
 
 
 class UsageRollup(Base):
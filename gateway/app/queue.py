@@ -1,48 +1,234 @@
 import asyncio
-from typing import Any, Dict, Optional, AsyncGenerator
+import time
+import contextlib
+import logging
+import uuid
+import httpx
+from typing import Any, Dict, List, Optional, AsyncGenerator, Tuple
 from .config import settings
-from . import vllm_client
+from . import distributed, tokens, vllm_client
+from .registry import ModelBackend, backends
+from .metrics import (
+    gateway_itl_seconds,
+    gateway_jobs_cancelled,
+    gateway_jobs_expired,
+    gateway_queue_depth,
+    gateway_queue_wait,
+    gateway_single_flight_joins,
+    gateway_tokens_per_second,
+    gateway_upstream_responses,
+)
+from .response_cache import is_deterministic, request_hash
+from .upstreams import is_upstream_failure
 
-_queue: asyncio.Queue = asyncio.Queue(maxsize=settings.queue_max_size)
-_sem: asyncio.Semaphore = asyncio.Semaphore(settings.vllm_max_concurrency)
+logger = logging.getLogger(__name__)
+
+# Each model backend has its own queue and concurrency limiter (see registry.py)
 _shutdown_event = asyncio.Event()
 
+# Single-flight: identical deterministic requests that are queued or running
+_inflight: Dict[str, "Job"] = {}
+
+# Every job created here that has not completed yet, for /admin/queue
+_jobs: Dict[str, "Job"] = {}
+
 class Job:
-    def __init__(self, payload: Dict[str, Any], stream: bool = False):
+    def __init__(
+        self,
+        payload: Dict[str, Any],
+        backend: ModelBackend,
+        stream: bool = False,
+        flight_key: Optional[str] = None,
+        deadline: Optional[float] = None,
+        prompt_tokens: Optional[int] = None,
+    ):
+        self.id = uuid.uuid4().hex
         self.payload = payload
+        self.backend = backend
+        # Absolute wall-clock time after which nobody waits for the result
+        self.deadline = deadline
+        self.enqueued_at = time.time()
+        # Local estimates used for token-aware admission
+        if prompt_tokens is None:
+            prompt_tokens = tokens.estimate_prompt_tokens(payload["body"].get("messages") or [])
+        self.prompt_tokens = prompt_tokens
+        self.cost = tokens.estimate_cost(payload["body"], self.prompt_tokens)
+        self.flight_key = flight_key
+        self.subscribers = 1
+        # Subscribers per API key: single-flight joins can come from other keys
+        key_id = (payload.get("principal") or {}).get("key_id")
+        self.keys: Dict[Optional[str], int] = {key_id: 1}
+        # Keys an administrator detached from the job, with the (status, message) they get
+        self._detached: Dict[Optional[str], Tuple[int, str]] = {}
         self._stream = stream
         self._event = asyncio.Event()
         self._result: Optional[Dict[str, Any]] = None
-        self._stream_q: Optional[asyncio.Queue] = asyncio.Queue() if stream else None
+        self._waiters: List[Tuple[Optional[str], asyncio.Future]] = []
+        # Streams fan out to one queue per subscriber. Joinable jobs also keep
+        # the chunks sent so far so a late subscriber can catch up.
+        self._stream_qs: List[asyncio.Queue] = [asyncio.Queue()] if stream else []
+        self._primary_q: Optional[asyncio.Queue] = self._stream_qs[0] if stream else None
+        self._stream_keys: Dict[asyncio.Queue, Optional[str]] = {self._primary_q: key_id} if stream else {}
+        self._history: Optional[List[bytes]] = [] if (stream and flight_key) else None
+        self._finished = False
+        self._primary_taken = False
+        # Progress, for introspection. started_at is only known in-process;
+        # in distributed mode the first chunk is the first sign of life.
+        self.started_at: Optional[float] = None
+        self.first_chunk_at: Optional[float] = None
+        self.chunks = 0
+        self.task: Optional[asyncio.Task] = None
+        self.cancelled = False
 
     def set_result(self, result: Dict[str, Any]) -> None:
+        _release_flight(self)
+        _jobs.pop(self.id, None)
         self._result = result
         self._event.set()
+        for _, waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(result)
+
+    async def result(self, key_id: Optional[str] = None) -> Dict[str, Any]:
+        if key_id in self._detached:
+            return _error_result(*self._detached[key_id])
+        if self._event.is_set():
+            return self._result or {}
+        entry = (key_id, asyncio.get_running_loop().create_future())
+        self._waiters.append(entry)
+        try:
+            return await entry[1] or {}
+        finally:
+            self._waiters.remove(entry)
 
-    async def result(self) -> Dict[str, Any]:
-        await self._event.wait()
-        return self._result or {}
+    def publish(self, chunk: bytes) -> None:
+        if self.first_chunk_at is None:
+            self.first_chunk_at = time.time()
+        self.chunks += 1
+        if self._history is not None:
+            self._history.append(chunk)
+        for q in self._stream_qs:
+            q.put_nowait(chunk)
 
-    async def stream(self) -> AsyncGenerator[bytes, None]:
-        if not self._stream_q:
+    def finish(self) -> None:
+        # No new subscribers once the stream has ended
+        _release_flight(self)
+        _jobs.pop(self.id, None)
+        self._finished = True
+        self._history = None
+        for q in self._stream_qs:
+            q.put_nowait(None)
+
+    def _subscribe(self, key_id: Optional[str]) -> Optional[asyncio.Queue]:
+        if not self._stream:
+            return None
+        if not self._primary_taken and self._stream_keys.get(self._primary_q) == key_id:
+            self._primary_taken = True
+            return self._primary_q
+        q: asyncio.Queue = asyncio.Queue()
+        if key_id in self._detached:
+            q.put_nowait(_error_frame(*self._detached[key_id]))
+            q.put_nowait(None)
+            return q
+        for chunk in self._history or []:
+            q.put_nowait(chunk)
+        if self._finished:
+            q.put_nowait(None)
+        self._stream_qs.append(q)
+        self._stream_keys[q] = key_id
+        return q
+
+    def stream(self, key_id: Optional[str] = None) -> AsyncGenerator[bytes, None]:
+        # Subscribe eagerly so nothing published before iteration starts is lost
+        return self._drain(self._subscribe(key_id))
+
+    def detach(self, key_id: Optional[str], status: int, message: str) -> int:
+        """Fail only key_id's subscribers; the job keeps running for the other keys."""
+        count = self.keys.pop(key_id, 0)
+        if not count:
+            return 0
+        self.subscribers -= count
+        self._detached[key_id] = (status, message)
+        for q, k in list(self._stream_keys.items()):
+            if k == key_id and q in self._stream_qs:
+                self._stream_qs.remove(q)
+                q.put_nowait(_error_frame(status, message))
+                q.put_nowait(None)
+        for k, waiter in self._waiters:
+            if k == key_id and not waiter.done():
+                waiter.set_result(_error_result(status, message))
+        return count
+
+    async def _drain(self, q: Optional[asyncio.Queue]) -> AsyncGenerator[bytes, None]:
+        if q is None:
             return
-        while True:
-            chunk = await self._stream_q.get()
-            try:
+        try:
+            while True:
+                chunk = await q.get()
                 if chunk is None:
                     break
                 yield chunk
-            finally:
-                self._stream_q.task_done()
+        finally:
+            if q is not self._primary_q:
+                if q in self._stream_qs:
+                    self._stream_qs.remove(q)
+                self._stream_keys.pop(q, None)
 
-async def enqueue_job(endpoint: str, body: Dict[str, Any], principal: Any, stream: bool = False) -> Job:
-    job = Job({"endpoint": endpoint, "body": body, "principal": principal.model_dump()}, stream=stream)
-    await _queue.put(job)
+async def enqueue_job(
+    endpoint: str,
+    body: Dict[str, Any],
+    principal: Any,
+    backend: ModelBackend,
+    stream: bool = False,
+    deadline: Optional[float] = None,
+    prompt_tokens: Optional[int] = None,
+) -> Job:
+    flight_key = None
+    if settings.single_flight_enabled and is_deterministic(body):
+        flight_key = f"{backend.name}:{endpoint}:{request_hash(body)}:{int(stream)}"
+        existing = _inflight.get(flight_key)
+        # A key that was detached from the job gets a fresh one rather than its old error
+        if existing is not None and principal.key_id not in existing._detached:
+            # Attach to the identical request already queued or running
+            existing.subscribers += 1
+            existing.keys[principal.key_id] = existing.keys.get(principal.key_id, 0) + 1
+            if existing.deadline is not None:
+                existing.deadline = None if deadline is None else max(existing.deadline, deadline)
+            gateway_single_flight_joins.labels(stream=str(stream).lower()).inc()
+            logger.info("Single-flight join for key_id=%s (%d subscribers)", principal.key_id, existing.subscribers)
+            return existing
+    job = Job(
+        {"endpoint": endpoint, "body": body, "principal": principal.model_dump()},
+        backend,
+        stream=stream,
+        flight_key=flight_key,
+        deadline=deadline,
+        prompt_tokens=prompt_tokens,
+    )
+    if flight_key:
+        _inflight[flight_key] = job
+    _jobs[job.id] = job
+    try:
+        if distributed.enabled():
+            await distributed.submit(job, backend)
+        else:
+            await backend.queue.put(job)
+            gateway_queue_depth.labels(backend=backend.name).set(backend.queue.qsize())
+    except BaseException:
+        _release_flight(job)
+        _jobs.pop(job.id, None)
+        raise
     return job
 
+
+def _release_flight(job: Job) -> None:
+    if job.flight_key and _inflight.get(job.flight_key) is job:
+        del _inflight[job.flight_key]
+
 # --- Dispatcher lifecycle
 
 _dispatcher_task: Optional[asyncio.Task] = None
+_running: set = set()
 
 def start_dispatcher() -> asyncio.Task:
     # Use the currently running loop; don't construct a new one
@@ -61,52 +247,340 @@ async def stop_dispatcher(task: Optional[asyncio.Task]) -> None:
             task.cancel()
             with contextlib.suppress(asyncio.CancelledError):
                 await task
+    # Give in-flight jobs a moment to finish, then cancel the rest
+    if _running:
+        _, pending = await asyncio.wait(set(_running), timeout=5)
+        for t in pending:
+            t.cancel()
 
 async def _dispatcher():
+    if distributed.enabled():
+        # Shared Redis queue and global concurrency leases (see distributed.py)
+        await distributed.run(backends(), _execute, _shutdown_event, _running)
+        return
+    # One dispatch loop per model backend so a long queue for one model
+    # cannot hold up the others.
+    await asyncio.gather(*(_dispatch_backend(b) for b in backends()))
+
+async def _dispatch_backend(backend: ModelBackend):
+    # Hold a concurrency slot per job and run it in its own task, so up to the
+    # backend's current limit of jobs are in flight across its upstream pool.
     while not _shutdown_event.is_set():
         try:
-            job: Job = await asyncio.wait_for(_queue.get(), timeout=0.2)
+            job: Job = await asyncio.wait_for(backend.queue.get(), timeout=0.2)
         except asyncio.TimeoutError:
             continue
+        gateway_queue_depth.labels(backend=backend.name).set(backend.queue.qsize())
+
+        if job.cancelled:
+            backend.queue.task_done()
+            continue
+        if _expired(job.deadline):
+            # The caller has already given up; don't spend a slot on it
+            _drop_expired(job, backend, job._stream)
+            _release_flight(job)
+            backend.queue.task_done()
+            continue
+
+        await backend.limiter.acquire()
+        await backend.tokens.acquire(job.cost)
+        if job.cancelled:
+            # Cancelled while waiting for a slot
+            backend.tokens.release(job.cost)
+            backend.limiter.release()
+            backend.queue.task_done()
+            continue
+        job.started_at = time.time()
+        gateway_queue_wait.labels(backend=backend.name, endpoint=job.payload["endpoint"]).observe(time.time() - job.enqueued_at)
+        task = asyncio.create_task(_run_job(job), name=f"vllm-job:{backend.name}")
+        job.task = task
+        _running.add(task)
+        task.add_done_callback(_running.discard)
+
+async def _run_job(job: Job) -> None:
+    try:
+        await _execute(
+            job,
+            job.backend,
+            job.payload.get("endpoint"),
+            job.payload.get("body"),
+            job._stream,
+            job.deadline,
+            job.prompt_tokens,
+        )
+    finally:
+        job.backend.tokens.release(job.cost)
+        job.backend.limiter.release()
+        _release_flight(job)
+        job.backend.queue.task_done()
+
+def _upstream_status(e: Optional[BaseException]) -> str:
+    if e is None:
+        return "200"
+    if isinstance(e, vllm_client.UpstreamHTTPError):
+        return str(e.status_code)
+    if isinstance(e, vllm_client.BreakerOpenError):
+        return "breaker_open"
+    if isinstance(e, vllm_client.DeadlineExceededError):
+        return "deadline"
+    if isinstance(e, (asyncio.TimeoutError, httpx.TimeoutException)):
+        return "timeout"
+    if isinstance(e, httpx.TransportError):
+        return "connect_error"
+    return "error"
+
+def _expired(deadline: Optional[float]) -> bool:
+    return deadline is not None and time.time() >= deadline
+
+def _drop_expired(job: Any, backend: ModelBackend, stream: bool) -> None:
+    gateway_jobs_expired.labels(backend=backend.name).inc()
+    _fail(job, stream, 504, "Request deadline exceeded before it reached the model")
+
+def _error_frame(status: int, message: str) -> bytes:
+    return vllm_client.sse_error({"status": status, "message": message})
+
+def _error_result(status: int, message: str) -> Dict[str, Any]:
+    return {"__error__": True, "message": message, "status_code": status}
+
+def _fail(job: Any, stream: bool, status: int, message: str) -> None:
+    if stream:
+        job.publish(_error_frame(status, message))
+        job.finish()
+    else:
+        job.set_result(_error_result(status, message))
+
+# --- Introspection and admin cancellation (/admin/queue)
+
+_AGE_BUCKETS = ((1, "<1s"), (5, "1-5s"), (30, "5-30s"), (120, "30s-2m"), (float("inf"), ">2m"))
+
+def _state(job: Job) -> str:
+    if job.started_at is not None or job.first_chunk_at is not None:
+        return "running"
+    # Distributed jobs may already be running on another instance
+    return "submitted" if distributed.enabled() else "queued"
+
+class SharedJobError(Exception):
+    """The job serves single-flight subscribers from several keys; cancel it per key instead."""
+
+    def __init__(self, job: Job):
+        self.keys = list(job.keys)
+        super().__init__(f"Job {job.id} is shared by {len(self.keys)} keys")
+
+def _describe(job: Job, now: float) -> Dict[str, Any]:
+    started = job.started_at
+    return {
+        "id": job.id,
+        "state": _state(job),
+        "backend": job.backend.name,
+        # Every key with a subscriber, the submitting key first
+        "key_ids": list(job.keys),
+        "stream": job._stream,
+        "subscribers": job.subscribers,
+        "prompt_tokens": job.prompt_tokens,
+        "estimated_tokens": job.cost,
+        "age_s": round(now - job.enqueued_at, 3),
+        "elapsed_s": None if started is None else round(now - started, 3),
+        "ttft_s": None if started is None or job.first_chunk_at is None else round(job.first_chunk_at - started, 3),
+        # vLLM sends one token per SSE chunk
+        "tokens_streamed": job.chunks,
+        "deadline_in_s": None if job.deadline is None else round(job.deadline - now, 3),
+    }
+
+def snapshot(limit: int = 100) -> Dict[str, Any]:
+    """Queued and running jobs grouped per backend; one pass over the live jobs, no locks."""
+    now = time.time()
+    groups: Dict[str, Dict[str, Any]] = {}
+    for b in backends():
+        groups[b.name] = {
+            "name": b.name,
+            "concurrency_limit": b.limiter.current(),
+            "inflight": b.limiter.inflight,
+            "tokens": b.tokens.snapshot(),
+            "queue_depth": b.queue.qsize(),
+            "queued": 0,
+            "queued_tokens": 0,
+            "running": 0,
+            "age": {label: 0 for _, label in _AGE_BUCKETS},
+            "by_key": {},
+        }
+    queued: List[Dict[str, Any]] = []
+    running: List[Dict[str, Any]] = []
+    for job in list(_jobs.values()):
+        group = groups.get(job.backend.name)
+        if group is None:
+            continue
+        info = _describe(job, now)
+        if info["state"] == "running":
+            group["running"] += 1
+            running.append(info)
+            continue
+        group["queued"] += 1
+        group["queued_tokens"] += job.cost
+        age = info["age_s"]
+        group["age"][next(label for bound, label in _AGE_BUCKETS if age < bound)] += 1
+        # A shared job counts for each of its keys, so by_key totals can exceed queued
+        for key_id in info["key_ids"]:
+            per_key = group["by_key"].setdefault(key_id, {"key_id": key_id, "jobs": 0, "tokens": 0, "oldest_s": 0.0})
+            per_key["jobs"] += 1
+            per_key["tokens"] += job.cost
+            per_key["oldest_s"] = max(per_key["oldest_s"], age)
+        queued.append(info)
+    for group in groups.values():
+        group["by_key"] = sorted(group["by_key"].values(), key=lambda k: k["tokens"], reverse=True)
+    queued.sort(key=lambda j: j["age_s"], reverse=True)
+    running.sort(key=lambda j: j["elapsed_s"] or j["age_s"], reverse=True)
+    return {
+        "distributed": distributed.enabled(),
+        "backends": list(groups.values()),
+        "queued": queued[:limit],
+        "running": running[:limit],
+    }
 
+def cancel_job(
+    job_id: str, message: str = "Request cancelled by an administrator", key_id: Optional[str] = None
+) -> Optional[str]:
+    """Fail a queued or running job; returns the state it was in, or None if there is no such job.
+
+    With key_id only that key's subscribers are failed, and the job is cancelled
+    only if no other key is waiting on it. A job shared by several keys raises
+    SharedJobError unless key_id is given.
+    """
+    job = _jobs.get(job_id)
+    if job is None or (key_id is not None and key_id not in job.keys):
+        return None
+    state = _state(job)
+    if key_id is None and len(job.keys) > 1:
+        raise SharedJobError(job)
+    if key_id is not None and len(job.keys) > 1:
+        job.detach(key_id, 503, message)
+        logger.info("Detached key_id=%s from shared %s job %s (%d keys left)", key_id, state, job.id, len(job.keys))
+        return state
+    job.cancelled = True
+    backend = job.backend
+    if state == "queued":
         try:
-            async with _sem:
-                endpoint = job.payload.get("endpoint")
-                body = job.payload.get("body")
-
-                if endpoint == "/v1/chat/completions":
-                    if job._stream_q is not None:
-                        # stream mode
-                        try:
-                            async for chunk in vllm_client.stream_chat_completions(body):
-                                await job._stream_q.put(chunk)
-                        except Exception as e:
-                            # Surface streaming error as a terminal SSE error frame
-                            err = f"event: error\ndata: {{" \
-                                  f"\"message\": \"{type(e).__name__}: {str(e)}\"}}\n\n"
-                            await job._stream_q.put(err.encode("utf-8"))
-                        finally:
-                            # Signal end of stream
-                            await job._stream_q.put(None)
-                    else:
-                        try:
-                            result = await vllm_client.chat_completions(body)
-                        except vllm_client.UpstreamHTTPError as e:
-                            job.set_result({
-                                "__error__": True,
-                                "message": e.message,
-                                "status_code": e.status_code,
-                                "body": e.body,
-                            })
-                        except Exception as e:
-                            job.set_result({
-                                "__error__": True,
-                                "message": f"{type(e).__name__}: {str(e)}",
-                                "status_code": 502,
-                            })
-                        else:
-                            job.set_result(result)
-                else:
-                    job.set_result({"__error__": True, "message": "unsupported endpoint", "status_code": 404})
-        finally:
-            _queue.task_done()
+            backend.queue._queue.remove(job)
+        except ValueError:
+            pass  # taken by the dispatcher, which skips cancelled jobs
+        else:
+            backend.queue.task_done()
+            gateway_queue_depth.labels(backend=backend.name).set(backend.queue.qsize())
+    distributed.forget(job.id)
+    _fail(job, job._stream, 503, message)
+    if job.task is not None:
+        job.task.cancel()
+    gateway_jobs_cancelled.labels(backend=backend.name, state=state).inc()
+    logger.info("Cancelled %s job %s for key_id=%s", state, job.id, next(iter(job.keys), None))
+    return state
+
+def evict_key(key_id: str, running: bool = False) -> List[str]:
+    """Fail every queued (and optionally running) request from an API key.
+
+    Single-flight jobs shared with other keys only lose this key's subscribers.
+    """
+    victims = [j for j in list(_jobs.values()) if key_id in j.keys and (running or _state(j) != "running")]
+    message = "Requests for this key were evicted by an administrator"
+    return [j.id for j in victims if cancel_job(j.id, message, key_id=key_id)]
+
+async def _execute(
+    job: Any,
+    backend: ModelBackend,
+    endpoint: str,
+    body: Dict[str, Any],
+    stream: bool,
+    deadline: Optional[float] = None,
+    prompt_tokens: Optional[int] = None,
+) -> None:
+    # job is a Job here, or a stand-in forwarding to another instance in distributed mode
+    if _expired(deadline):
+        # Expired while waiting for a concurrency slot
+        _drop_expired(job, backend, stream)
+        return
+    # The remaining budget bounds the upstream call
+    timeout = None if deadline is None else max(0.001, deadline - time.time())
+    if endpoint == "/v1/chat/completions":
+        if stream:
+            # stream mode
+            started = time.monotonic()
+            first = last = None
+            chunks = 0
+            tail = b""
+            try:
+                async for chunk in vllm_client.stream_chat_completions(
+                    body, backend.pool, timeout=timeout, breaker=backend.breaker
+                ):
+                    last = time.monotonic()
+                    if first is None:
+                        first = last
+                    chunks += 1
+                    tail = tail[-4096:] + chunk
+                    job.publish(chunk)
+            except Exception as e:
+                gateway_upstream_responses.labels(backend=backend.name, status=_upstream_status(e)).inc()
+                if is_upstream_failure(e):
+                    backend.limiter.observe_error()
+                # Surface streaming error as a terminal SSE error frame
+                job.publish(vllm_client.sse_error_frame(e))
+            else:
+                gateway_upstream_responses.labels(backend=backend.name, status="200").inc()
+                # Usage is only streamed with stream_options.include_usage
+                usage = tokens.usage_from_sse(tail) or {}
+                if first is not None:
+                    itl = (last - first) / (chunks - 1) if chunks > 1 else None
+                    backend.limiter.observe(ttft_s=first - started, itl_s=itl)
+                    if itl is not None:
+                        gateway_itl_seconds.labels(backend=backend.name).observe(itl)
+                    if usage.get("completion_tokens") and last > first:
+                        gateway_tokens_per_second.labels(backend=backend.name).observe(usage["completion_tokens"] / (last - first))
+                if prompt_tokens is not None:
+                    tokens.record_actual(prompt_tokens, usage, body.get("messages"))
+            finally:
+                job.finish()
+        else:
+            started = time.monotonic()
+            try:
+                result = await vllm_client.chat_completions(body, backend.pool, timeout=timeout, breaker=backend.breaker)
+            except vllm_client.BreakerOpenError as e:
+                gateway_upstream_responses.labels(backend=backend.name, status="breaker_open").inc()
+                job.set_result({
+                    "__error__": True,
+                    "message": str(e),
+                    "status_code": 503,
+                    "retry_after": e.retry_after,
+                })
+            except vllm_client.DeadlineExceededError as e:
+                gateway_upstream_responses.labels(backend=backend.name, status="deadline").inc()
+                job.set_result({"__error__": True, "message": str(e), "status_code": 504})
+            except vllm_client.UpstreamHTTPError as e:
+                gateway_upstream_responses.labels(backend=backend.name, status=str(e.status_code)).inc()
+                if is_upstream_failure(e):
+                    backend.limiter.observe_error()
+                job.set_result({
+                    "__error__": True,
+                    "message": e.message,
+                    "status_code": e.status_code,
+                    "body": e.body,
+                })
+            except Exception as e:
+                gateway_upstream_responses.labels(backend=backend.name, status=_upstream_status(e)).inc()
+                if is_upstream_failure(e):
+                    backend.limiter.observe_error()
+                job.set_result({
+                    "__error__": True,
+                    "message": f"{type(e).__name__}: {str(e)}",
+                    "status_code": 502,
+                })
+            else:
+                # No TTFT/ITL without streaming. Time per output token includes prefill, so it
+                # depends on prompt length and gets its own baseline rather than skewing ITL's
+                gateway_upstream_responses.labels(backend=backend.name, status="200").inc()
+                usage = (result or {}).get("usage") or {}
+                if usage.get("completion_tokens"):
+                    elapsed = time.monotonic() - started
+                    backend.limiter.observe(tpot_s=elapsed / usage["completion_tokens"])
+                    gateway_tokens_per_second.labels(backend=backend.name).observe(usage["completion_tokens"] / elapsed)
+                if prompt_tokens is not None:
+                    tokens.record_actual(prompt_tokens, usage, body.get("messages"))
+                job.set_result(result)
+    else:
+        job.set_result({"__error__": True, "message": "unsupported endpoint", "status_code": 404})
@@ -1,20 +1,8 @@
 import time
 from fastapi import HTTPException, status
 from .config import settings
-
-try:
-    from redis import asyncio as aioredis  # redis>=4 provides asyncio API
-except Exception:  # pragma: no cover
-    aioredis = None  # type: ignore
-
-_redis = None
-
-
-async def _get_redis():
-    global _redis
-    if _redis is None and aioredis is not None:
-        _redis = aioredis.from_url(settings.redis_url, encoding="utf-8", decode_responses=True)
-    return _redis
+from .metrics import gateway_rl_exceeded
+from .redis_client import get_redis
 
 
 _LUA_TOKEN_BUCKET = """
@@ -41,7 +29,7 @@ return {allowed, tokens}
 
 
 async def check_rate_limit(key_id: str) -> None:
-    client = await _get_redis()
+    client = await get_redis()
     if client is None:
         # No Redis available; allow request
         return
@@ -52,6 +40,7 @@ async def check_rate_limit(key_id: str) -> None:
     try:
         allowed, _ = await client.eval(_LUA_TOKEN_BUCKET, 1, f"rl:{key_id}", now_ms, rps, burst, ttl_ms)
         if int(allowed) != 1:
+            gateway_rl_exceeded.inc()
             raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Rate limit exceeded")
     except HTTPException:
         raise
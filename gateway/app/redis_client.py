@@ -0,0 +1,16 @@
+from .config import settings
+
+try:
+    from redis import asyncio as aioredis  # redis>=4 provides asyncio API
+except Exception:  # pragma: no cover
+    aioredis = None  # type: ignore
+
+_redis = None
+
+
+async def get_redis():
+    """Shared asyncio Redis client (string responses), or None when redis is unavailable."""
+    global _redis
+    if _redis is None and aioredis is not None:
+        _redis = aioredis.from_url(settings.redis_url, encoding="utf-8", decode_responses=True)
+    return _redis
@@ -0,0 +1,282 @@
+# app/registry.py
+
+import asyncio
+import contextlib
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from .breaker import CircuitBreaker
+from .config import settings
+from .limiter import AdaptiveLimiter, TokenBudget
+from .upstreams import UpstreamPool
+
+logger = logging.getLogger(__name__)
+
+# Model registry: maps public model names and aliases to a backend, i.e. a pool
+# of vLLM replicas with its own queue and concurrency limit, so a long queue
+# for one model cannot starve the others.
+#
+# Configured with MODEL_REGISTRY (inline JSON) or MODEL_REGISTRY_FILE:
+#
+#   {"models": [{"name": "mistral-small", "aliases": ["default"],
+#                "upstream_model": "mistralai/Mistral-Small-3.2-24B-Instruct-2506",
+#                "upstreams": ["http://vllm-a:8000", "http://vllm-b:8000"],
+#                "max_concurrency": 8, "queue_max_size": 2048,
+#                "strategy": "prefix_affinity", "context_length": 32768,
+#                "token_budget": 200000}]}
+#
+# Without a registry there is one backend built from VLLM_URL(S) that accepts
+# any model name and forwards it unchanged, as before.
+#
+# Model ids served by the upstreams' own /v1/models (e.g. LoRA adapters) and
+# their max_model_len are discovered at startup and then every
+# MODEL_DISCOVERY_TTL_S, and routed to the backend that serves them.
+
+
+class ModelBackend:
+    def __init__(
+        self,
+        name: str,
+        upstreams: List[str],
+        upstream_model: Optional[str] = None,
+        aliases: Optional[List[str]] = None,
+        max_concurrency: Optional[int] = None,
+        queue_max_size: Optional[int] = None,
+        strategy: Optional[str] = None,
+        context_length: Optional[int] = None,
+        token_budget: Optional[int] = None,
+        catch_all: bool = False,
+    ):
+        self.name = name
+        self.upstream_model = upstream_model
+        self.aliases = list(aliases or [])
+        self.max_concurrency = max_concurrency or settings.vllm_max_concurrency
+        self.context_length = context_length
+        self.catch_all = catch_all
+        self.pool = UpstreamPool(upstreams, strategy or settings.upstream_strategy)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_max_size or settings.queue_max_size)
+        self.limiter = AdaptiveLimiter(name, self.max_concurrency, [u.url for u in self.pool.upstreams])
+        self.breaker = CircuitBreaker(name, self.pool)
+        self.tokens = TokenBudget(name, settings.scheduler_token_budget if token_budget is None else token_budget)
+        # Filled by discovery: upstream model id -> metadata from /v1/models
+        self.discovered: Dict[str, Dict[str, Any]] = {}
+
+    def upstream_name(self, requested: Optional[str]) -> Optional[str]:
+        """The model name to send upstream for a request that resolved to this backend."""
+        if requested and (requested in self.discovered or requested not in (self.name, *self.aliases)):
+            # Discovered upstream id, or a name passed through by the catch-all backend
+            return requested
+        return self.upstream_model or requested
+
+    def context_limit(self, upstream_name: Optional[str]) -> Optional[int]:
+        """Context window for a model served here: discovered max_model_len, else the configured one."""
+        meta = self.discovered.get(upstream_name or "") or self.discovered.get(self.upstream_model or "") or {}
+        return meta.get("max_model_len") or self.context_length
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "aliases": self.aliases,
+            "upstream_model": self.upstream_model,
+            "max_concurrency": self.max_concurrency,
+            "concurrency": self.limiter.snapshot(),
+            "tokens": self.tokens.snapshot(),
+            "breaker": self.breaker.snapshot(),
+            "queue_depth": self.queue.qsize(),
+            "context_length": self.context_length,
+            "discovered": sorted(self.discovered),
+            "upstreams": self.pool.snapshot(),
+        }
+
+
+def _load_config() -> Optional[Dict[str, Any]]:
+    raw = settings.registry_config
+    if not raw and settings.registry_file:
+        with open(settings.registry_file, "r", encoding="utf-8") as f:
+            raw = f.read()
+    if not raw:
+        return None
+    return json.loads(raw)
+
+
+def _build() -> List[ModelBackend]:
+    config = _load_config()
+    if not config:
+        name = settings.display_model_name or "default"
+        aliases = ["default"] if name != "default" else []
+        return [
+            ModelBackend(
+                name,
+                settings.vllm_urls or [settings.vllm_url],
+                upstream_model=settings.display_model_name or None,
+                aliases=aliases,
+                catch_all=True,
+            )
+        ]
+
+    backends = []
+    for entry in config.get("models") or []:
+        backends.append(
+            ModelBackend(
+                name=entry["name"],
+                upstreams=entry.get("upstreams") or settings.vllm_urls or [settings.vllm_url],
+                upstream_model=entry.get("upstream_model") or entry["name"],
+                aliases=entry.get("aliases"),
+                max_concurrency=entry.get("max_concurrency"),
+                queue_max_size=entry.get("queue_max_size"),
+                strategy=entry.get("strategy"),
+                context_length=entry.get("context_length"),
+                token_budget=entry.get("token_budget"),
+            )
+        )
+    if not backends:
+        raise ValueError("Model registry has no models")
+    return backends
+
+
+_backends: List[ModelBackend] = _build()
+_by_name: Dict[str, ModelBackend] = {}
+for _b in _backends:
+    for _n in [_b.name, *_b.aliases]:
+        if _n in _by_name:
+            raise ValueError(f"Model name {_n!r} is registered twice")
+        _by_name[_n] = _b
+_default: ModelBackend = _by_name.get("default", _backends[0])
+_discovered_at: float = 0.0
+_discovery_lock: Optional[asyncio.Lock] = None
+
+
+def backends() -> List[ModelBackend]:
+    return _backends
+
+
+def _lookup(name: Optional[str]) -> Optional[ModelBackend]:
+    if not name:
+        return _default
+    backend = _by_name.get(name)
+    if backend is not None:
+        return backend
+    for b in _backends:
+        if name in b.discovered:
+            return b
+    return _default if _default.catch_all else None
+
+
+async def resolve(name: Optional[str]) -> Tuple[Optional[ModelBackend], Optional[str]]:
+    """Backend and upstream model name for a requested model, or (None, None) if unknown."""
+    backend = _lookup(name)
+    if backend is None and time.monotonic() - _discovered_at >= settings.registry_discovery_ttl_s:
+        # Maybe an adapter that was loaded since the last discovery
+        await refresh_discovery()
+        backend = _lookup(name)
+    if backend is None:
+        return None, None
+    return backend, backend.upstream_name(name)
+
+
+async def refresh_discovery(force: bool = False) -> None:
+    global _discovered_at, _discovery_lock
+    if settings.registry_discovery_ttl_s <= 0:
+        return
+    if _discovery_lock is None:
+        _discovery_lock = asyncio.Lock()
+    async with _discovery_lock:
+        if not force and time.monotonic() - _discovered_at < settings.registry_discovery_ttl_s:
+            return
+        async with httpx.AsyncClient(timeout=settings.upstream_health_timeout_s) as client:
+            await asyncio.gather(*(_discover(client, b) for b in _backends))
+        _discovered_at = time.monotonic()
+
+
+async def _discover(client: httpx.AsyncClient, backend: ModelBackend) -> None:
+    found: Dict[str, Dict[str, Any]] = {}
+    for up in backend.pool.upstreams:
+        try:
+            r = await client.get(f"{up.url}/v1/models")
+            r.raise_for_status()
+            for m in r.json().get("data") or []:
+                if m.get("id"):
+                    found.setdefault(m["id"], m)
+        except Exception as e:
+            logger.debug("Model discovery failed for %s: %s", up.url, e)
+    if found:
+        backend.discovered = found
+
+
+_discovery_task: Optional[asyncio.Task] = None
+_discovery_kick: Optional[asyncio.Task] = None
+
+
+async def _discovery_loop() -> None:
+    while True:
+        await asyncio.sleep(settings.registry_discovery_ttl_s)
+        try:
+            await refresh_discovery(force=True)
+        except Exception:
+            logger.exception("Model discovery failed")
+
+
+async def start_discovery() -> Optional[asyncio.Task]:
+    """Discover once before serving (context limits depend on it), then keep refreshing."""
+    global _discovery_task
+    if settings.registry_discovery_ttl_s <= 0:
+        return None
+    try:
+        await refresh_discovery(force=True)
+    except Exception:
+        logger.exception("Model discovery failed")
+    _discovery_task = asyncio.create_task(_discovery_loop(), name="model-discovery")
+    return _discovery_task
+
+
+def schedule_discovery() -> None:
+    """Refresh in the background if due; for request paths, which must not wait on upstreams."""
+    global _discovery_kick
+    if settings.registry_discovery_ttl_s <= 0 or (_discovery_kick is not None and not _discovery_kick.done()):
+        return
+    if time.monotonic() - _discovered_at < settings.registry_discovery_ttl_s:
+        return
+    _discovery_kick = asyncio.create_task(refresh_discovery(), name="model-discovery-kick")
+    _discovery_kick.add_done_callback(_log_discovery_error)
+
+
+def _log_discovery_error(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Model discovery failed: %s", task.exception())
+
+
+async def stop_discovery() -> None:
+    if _discovery_task:
+        _discovery_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await _discovery_task
+
+
+async def list_models() -> List[Dict[str, Any]]:
+    """OpenAI-style model list: registry names and aliases plus discovered upstream ids."""
+    await refresh_discovery()
+    seen = set()
+    data = []
+
+    def _add(model_id: str, backend: ModelBackend, meta: Optional[Dict[str, Any]] = None) -> None:
+        if model_id in seen:
+            return
+        seen.add(model_id)
+        item = {"id": model_id, "object": "model", "owned_by": "gateway", "backend": backend.name}
+        max_len = (meta or {}).get("max_model_len") or backend.context_length
+        if max_len:
+            item["max_model_len"] = max_len
+        data.append(item)
+
+    for b in _backends:
+        upstream_meta = b.discovered.get(b.upstream_model or "")
+        _add(b.name, b, upstream_meta)
+        for alias in b.aliases:
+            _add(alias, b, upstream_meta)
+        for model_id, meta in b.discovered.items():
+            _add(model_id, b, meta)
+    return data
@@ -0,0 +1,149 @@
+# app/response_cache.py
+
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional
+
+import orjson
+
+from .config import settings
+from .metrics import (
+    gateway_response_cache_bytes,
+    gateway_response_cache_lru_bytes,
+    gateway_response_cache_total,
+)
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Opt-in cache for deterministic (temperature=0) chat completions.
+# Tier 1 is a per-process LRU bounded by entries and bytes; tier 2 is Redis
+# with a TTL, shared by every gateway instance.
+
+# ChatCompletionRequest fields that change the generated output
+_KEY_FIELDS = (
+    "model",
+    "messages",
+    "max_tokens",
+    "temperature",
+    "top_p",
+    "presence_penalty",
+    "frequency_penalty",
+    "stop",
+)
+
+
+class _LRU:
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._data: "OrderedDict[str, bytes]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old)
+        self._data[key] = value
+        self.bytes += len(value)
+        while self._data and (len(self._data) > self.max_entries or self.bytes > self.max_bytes):
+            _, evicted = self._data.popitem(last=False)
+            self.bytes -= len(evicted)
+        gateway_response_cache_lru_bytes.set(self.bytes)
+
+
+_lru = _LRU(settings.response_cache_lru_max_entries, settings.response_cache_lru_max_bytes)
+
+
+def is_deterministic(body: Dict[str, Any]) -> bool:
+    return body.get("temperature") == 0
+
+
+def request_hash(body: Dict[str, Any]) -> str:
+    """Canonical sha256 of the request fields that affect the generated output."""
+    canonical = {f: body.get(f) for f in _KEY_FIELDS}
+    canonical["model"] = canonical["model"] or "default"
+    return hashlib.sha256(orjson.dumps(canonical, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def cache_key(body: Dict[str, Any]) -> Optional[str]:
+    """Redis/LRU key for a cacheable request, or None if caching does not apply."""
+    if not settings.response_cache_enabled or not is_deterministic(body):
+        return None
+    return f"respcache:{request_hash(body)}"
+
+
+async def get(key: str) -> Optional[Dict[str, Any]]:
+    raw = _lru.get(key)
+    if raw is not None:
+        gateway_response_cache_total.labels(tier="memory", result="hit").inc()
+        gateway_response_cache_bytes.labels(tier="memory").inc(len(raw))
+        return orjson.loads(raw)
+    gateway_response_cache_total.labels(tier="memory", result="miss").inc()
+
+    client = await get_redis() if settings.response_cache_redis else None
+    if client is None:
+        return None
+    try:
+        text = await client.get(key)
+    except Exception as e:
+        logger.warning("Response cache read failed: %s", e)
+        return None
+    if text is None:
+        gateway_response_cache_total.labels(tier="redis", result="miss").inc()
+        return None
+    raw = text.encode("utf-8")
+    gateway_response_cache_total.labels(tier="redis", result="hit").inc()
+    gateway_response_cache_bytes.labels(tier="redis").inc(len(raw))
+    _lru.put(key, raw)
+    return orjson.loads(raw)
+
+
+async def put(key: str, result: Dict[str, Any]) -> None:
+    raw = orjson.dumps(result)
+    if len(raw) > settings.response_cache_max_item_bytes:
+        return
+    _lru.put(key, raw)
+    client = await get_redis() if settings.response_cache_redis else None
+    if client is None:
+        return
+    try:
+        await client.set(key, raw.decode("utf-8"), ex=settings.response_cache_ttl_s)
+    except Exception as e:
+        logger.warning("Response cache write failed: %s", e)
+
+
+def _sse(obj: Dict[str, Any]) -> bytes:
+    return b"data: " + orjson.dumps(obj) + b"\n\n"
+
+
+def replay_sse(result: Dict[str, Any], include_usage: bool = False) -> Iterator[bytes]:
+    """Re-emit a cached chat.completion as chat.completion.chunk SSE frames.
+
+    Like a live stream, the usage frame is only sent for stream_options.include_usage.
+    """
+    base = {
+        "id": result.get("id"),
+        "object": "chat.completion.chunk",
+        "created": result.get("created") or int(time.time()),
+        "model": result.get("model"),
+    }
+    for choice in result.get("choices") or []:
+        index = choice.get("index", 0)
+        message = choice.get("message") or {}
+        delta = {"role": message.get("role", "assistant"), "content": message.get("content") or ""}
+        if message.get("tool_calls"):
+            delta["tool_calls"] = message["tool_calls"]
+        yield _sse({**base, "choices": [{"index": index, "delta": delta, "finish_reason": None}]})
+        yield _sse({**base, "choices": [{"index": index, "delta": {}, "finish_reason": choice.get("finish_reason")}]})
+    if include_usage and result.get("usage"):
+        yield _sse({**base, "choices": [], "usage": result["usage"]})
+    yield b"data: [DONE]\n\n"
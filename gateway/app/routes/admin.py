@@ -1,7 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request
+from starlette.responses import FileResponse, PlainTextResponse, StreamingResponse
 from ..auth import require_admin, Principal
 from ..db import (
     get_session,
+    get_read_session,
     create_user as db_create_user,
     list_users as db_list_users,
 )
@@ -13,13 +15,34 @@ from ..db import (
     audit as db_audit,
 )
 from ..db import get_user as db_get_user, update_user as db_update_user, list_keys_for_user as db_list_keys_for_user
+from ..db import (
+    bulk_create_users as db_bulk_create_users,
+    bulk_insert_api_keys as db_bulk_insert_api_keys,
+    bulk_revoke_keys as db_bulk_revoke_keys,
+    existing_user_ids as db_existing_user_ids,
+    parse_expires_at,
+)
+from ..security import hash_keys
+from ..config import settings
 from ..types import UserCreate, KeyCreate, UserUpdate
-from sqlalchemy.exc import IntegrityError
+from .. import export, usage_cache
+from .. import profiler, registry
+from .. import queue as job_queue
+from ..loopmon import monitor as loop_monitor
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy import text
 from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+import asyncio
 import json
+import logging
+import secrets
+import time
+import uuid
 
 
+logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
@@ -122,7 +145,202 @@ async def create_key(payload: KeyCreate, principal: Principal = Depends(require_
             expires_at=payload.expires_at,
         )
         db_audit(db, principal.key_id, "CREATE_KEY", rec["id"], {"name": payload.name})
-        return rec
+    await usage_cache.invalidate_keys(rec["user_id"])
+    return rec
+
+
+# --- Bulk provisioning
+# Bodies are a JSON array, {"items": [...]}, or NDJSON (application/x-ndjson).
+# Items are written in batches of BULK_BATCH_SIZE, each batch in a single
+# transaction together with its audit rows. Results are returned per item, in
+# input order; a failing batch only fails its own items, and is also listed
+# (first and last item index) under failed_batches.
+# Registered before /keys/{key_id}/revoke so "bulk" is not taken for a key id.
+
+async def _bulk_items(request: Request) -> List[Any]:
+    raw = await request.body()
+    ctype = request.headers.get("content-type", "")
+    try:
+        if ctype.startswith(("application/x-ndjson", "application/jsonl", "application/ndjson")):
+            items = [json.loads(line) for line in raw.splitlines() if line.strip()]
+        else:
+            data = json.loads(raw or b"null")
+            items = data.get("items") if isinstance(data, dict) else data
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array, {\"items\": [...]} or NDJSON")
+    if len(items) > settings.bulk_max_items:
+        raise HTTPException(status_code=413, detail=f"At most {settings.bulk_max_items} items per request")
+    return items
+
+
+def _item_error(index: int, message: str) -> Dict[str, Any]:
+    return {"index": index, "ok": False, "error": message}
+
+
+def _validation_message(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())
+
+
+def _bulk_summary(results: List[Dict[str, Any]], failed_batches: List[Dict[str, Any]]) -> Dict[str, Any]:
+    ok = sum(1 for r in results if r.get("ok"))
+    return {"items": results, "succeeded": ok, "failed": len(results) - ok, "failed_batches": failed_batches}
+
+
+def _fail_batch(results: List[Optional[Dict[str, Any]]], indexes: List[int], e: Exception) -> Dict[str, Any]:
+    """Mark a failed batch's undecided items as errors; returns its failed_batches entry."""
+    message = f"{type(e).__name__}: batch failed"
+    for i in indexes:
+        if results[i] is None:
+            results[i] = _item_error(i, message)
+    return {"from_index": indexes[0], "to_index": indexes[-1], "items": len(indexes), "error": message}
+
+
+def _batches(items: List[Any]):
+    size = max(1, settings.bulk_batch_size)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _run_in_session(fn, *args):
+    with get_session() as db:
+        return fn(db, *args)
+
+
+@router.post("/users/bulk")
+async def bulk_create_users(request: Request, principal: Principal = Depends(require_admin)):
+    items = await _bulk_items(request)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    valid = []
+    for i, raw in enumerate(items):
+        try:
+            payload = UserCreate.model_validate(raw)
+        except ValidationError as e:
+            results[i] = _item_error(i, _validation_message(e))
+            continue
+        valid.append((i, payload.model_dump()))
+
+    failed_batches = []
+    for batch in _batches(valid):
+        try:
+            out = await asyncio.to_thread(_run_in_session, db_bulk_create_users, principal.key_id, [it for _, it in batch])
+        except SQLAlchemyError as e:
+            failed_batches.append(_fail_batch(results, [i for i, _ in batch], e))
+            continue
+        for (i, _), rec in zip(batch, out):
+            results[i] = {"index": i, **rec}
+    return _bulk_summary(results, failed_batches)
+
+
+@router.post("/keys/bulk")
+async def bulk_create_keys(request: Request, principal: Principal = Depends(require_admin)):
+    items = await _bulk_items(request)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    valid = []
+    for i, raw in enumerate(items):
+        try:
+            payload = KeyCreate.model_validate(raw)
+            uuid.UUID(payload.user_id)
+            expires_at = parse_expires_at(payload.expires_at)
+        except ValidationError as e:
+            results[i] = _item_error(i, _validation_message(e))
+            continue
+        except ValueError as e:
+            msg = str(e) if "expires_at" in str(e) else "Invalid user_id"
+            results[i] = _item_error(i, msg)
+            continue
+        valid.append((i, payload, expires_at))
+
+    touched_users = set()
+    failed_batches = []
+    for batch in _batches(valid):
+        # Earlier batches are committed and their plaintext keys exist only in this
+        # response, so no failure in a later batch may turn it into a bare 500
+        try:
+            known = await asyncio.to_thread(_run_in_session, db_existing_user_ids, [p.user_id for _, p, _ in batch])
+            pending = []
+            for i, payload, expires_at in batch:
+                if str(uuid.UUID(payload.user_id)) not in known:
+                    results[i] = _item_error(i, "User not found")
+                else:
+                    pending.append((i, payload, expires_at, secrets.token_urlsafe(32)))
+            if not pending:
+                continue
+
+            hashes = await hash_keys([plaintext for *_, plaintext in pending])
+            rows = [
+                {
+                    "id": uuid.uuid4(),
+                    "user_id": uuid.UUID(payload.user_id),
+                    "name": payload.name,
+                    "key_hash": key_hash,
+                    "key_last4": plaintext[-4:],
+                    "role": payload.role or "user",
+                    "status": "active",
+                    "monthly_token_quota": payload.monthly_quota_tokens,
+                    "daily_request_quota": payload.daily_request_quota,
+                    "expires_at": expires_at,
+                }
+                for (i, payload, expires_at, plaintext), key_hash in zip(pending, hashes)
+            ]
+            await asyncio.to_thread(_run_in_session, db_bulk_insert_api_keys, principal.key_id, rows)
+        except Exception as e:
+            if not isinstance(e, SQLAlchemyError):
+                logger.exception("Bulk key creation batch failed")
+            failed_batches.append(_fail_batch(results, [i for i, *_ in batch], e))
+            continue
+        for (i, payload, expires_at, plaintext), row in zip(pending, rows):
+            touched_users.add(str(row["user_id"]))
+            results[i] = {
+                "index": i,
+                "ok": True,
+                "id": str(row["id"]),
+                "user_id": str(row["user_id"]),
+                "name": row["name"],
+                "role": row["role"],
+                "status": row["status"],
+                "last4": row["key_last4"],
+                "expires_at": expires_at.isoformat() if expires_at else None,
+                "plaintext_key": plaintext,
+            }
+
+    for user_id in touched_users:
+        await usage_cache.invalidate_keys(user_id)
+    return _bulk_summary(results, failed_batches)
+
+
+@router.post("/keys/bulk/revoke")
+async def bulk_revoke_keys(request: Request, principal: Principal = Depends(require_admin)):
+    # Items are key ids, or objects with an "id"/"key_id" field
+    items = await _bulk_items(request)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    valid = []
+    for i, raw in enumerate(items):
+        key_id = (raw.get("key_id") or raw.get("id")) if isinstance(raw, dict) else raw
+        try:
+            valid.append((i, str(uuid.UUID(str(key_id)))))
+        except ValueError:
+            results[i] = _item_error(i, "Invalid key id")
+
+    touched_users = set()
+    failed_batches = []
+    for batch in _batches(valid):
+        try:
+            revoked = await asyncio.to_thread(_run_in_session, db_bulk_revoke_keys, principal.key_id, [k for _, k in batch])
+        except SQLAlchemyError as e:
+            failed_batches.append(_fail_batch(results, [i for i, _ in batch], e))
+            continue
+        for i, key_id in batch:
+            if key_id in revoked:
+                touched_users.add(revoked[key_id])
+                results[i] = {"index": i, "ok": True, "id": key_id, "status": "revoked"}
+            else:
+                results[i] = _item_error(i, "Key not found")
+
+    for user_id in touched_users:
+        await usage_cache.invalidate_keys(user_id)
+    return _bulk_summary(results, failed_batches)
 
 
 @router.post("/keys/{key_id}/revoke")
@@ -131,9 +349,10 @@ async def revoke_key(key_id: str, principal: Principal = Depends(require_admin))
         try:
             rec = db_revoke_key(db, key_id)
             db_audit(db, principal.key_id, "REVOKE_KEY", key_id, None)
-            return rec
         except ValueError:
             raise HTTPException(status_code=404, detail="Key not found")
+    await usage_cache.invalidate_keys(rec["user_id"])
+    return rec
 
 
 @router.post("/keys/{key_id}/rotate")
@@ -142,7 +361,6 @@ async def rotate_key(key_id: str, principal: Principal = Depends(require_admin))
         try:
             rec = db_rotate_key(db, key_id)
             db_audit(db, principal.key_id, "ROTATE_KEY", key_id, None)
-            return rec
         except ValueError as e:
             msg = str(e)
             if msg == "key not found":
@@ -151,6 +369,101 @@ async def rotate_key(key_id: str, principal: Principal = Depends(require_admin))
                 raise HTTPException(status_code=400, detail="Key is not expired; rotation not allowed")
             else:
                 raise HTTPException(status_code=400, detail=msg or "Rotation not allowed")
+    await usage_cache.invalidate_keys(rec["user_id"])
+    return rec
+
+
+@router.get("/upstreams")
+async def upstreams(_: Principal = Depends(require_admin)):
+    # Registry backends with their queue depth and upstream pool state
+    return {"items": [b.snapshot() for b in registry.backends()]}
+
+
+@router.get("/queue")
+async def queue_snapshot(limit: int = Query(100, ge=0, le=1000), _: Principal = Depends(require_admin)):
+    # Queued jobs grouped by backend and key, running jobs with their progress
+    return job_queue.snapshot(limit)
+
+
+@router.get("/queue/stream")
+async def queue_stream(
+    request: Request,
+    interval_s: float = Query(1.0, ge=0.2, le=60),
+    limit: int = Query(20, ge=0, le=1000),
+    _: Principal = Depends(require_admin),
+):
+    async def _gen():
+        while not await request.is_disconnected():
+            yield b"data: " + json.dumps(job_queue.snapshot(limit)).encode("utf-8") + b"\n\n"
+            await asyncio.sleep(interval_s)
+
+    return StreamingResponse(_gen(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.delete("/queue/jobs/{job_id}")
+async def cancel_queued_job(
+    job_id: str,
+    key_id: str | None = Query(default=None, description="Only fail this key's requests on a shared (single-flight) job"),
+    principal: Principal = Depends(require_admin),
+):
+    try:
+        state = job_queue.cancel_job(job_id, key_id=key_id)
+    except job_queue.SharedJobError as e:
+        raise HTTPException(status_code=409, detail=f"{e}; pass key_id to cancel one key's requests ({', '.join(map(str, e.keys))})")
+    if state is None:
+        raise HTTPException(status_code=404, detail="Job not found (already finished?)")
+    with get_session() as db:
+        db_audit(db, principal.key_id, "CANCEL_JOB", job_id, {"state": state, "key_id": key_id})
+    return {"id": job_id, "cancelled": True, "state": state, "key_id": key_id}
+
+
+@router.delete("/queue/keys/{key_id}")
+async def evict_key_jobs(
+    key_id: str,
+    running: bool = Query(False, description="Also cancel jobs already running upstream"),
+    principal: Principal = Depends(require_admin),
+):
+    cancelled = job_queue.evict_key(key_id, running=running)
+    if cancelled:
+        with get_session() as db:
+            db_audit(db, principal.key_id, "EVICT_KEY_JOBS", key_id, {"jobs": len(cancelled), "running": running})
+    return {"key_id": key_id, "cancelled": cancelled}
+
+
+@router.get("/loop-lag")
+async def loop_lag(limit: int = Query(20, ge=1, le=200), _: Principal = Depends(require_admin)):
+    # Call sites that blocked the event loop, worst first
+    return loop_monitor.report(limit)
+
+
+@router.get("/profile")
+async def profile(
+    seconds: float = Query(10, gt=0, description="How long to sample (capped at PROFILER_MAX_SECONDS)"),
+    mode: str = Query("wall", description="wall or cpu"),
+    interval_ms: float = Query(10, gt=0, description="Sampling interval (floored at PROFILER_MIN_INTERVAL_MS)"),
+    threads: str = Query("loop", description="loop (event-loop thread only) or all"),
+    task: str | None = Query(default=None, description="Only event-loop samples whose asyncio task name matches this glob, e.g. vllm-*"),
+    format: str = Query("collapsed", description="collapsed (flamegraph.pl / speedscope input) or json"),
+    _: Principal = Depends(require_admin),
+):
+    if not settings.profiler_enabled:
+        raise HTTPException(status_code=404, detail="Profiler disabled")
+    if threads not in ("loop", "all"):
+        raise HTTPException(status_code=400, detail="threads must be loop or all")
+    if format not in ("collapsed", "json"):
+        raise HTTPException(status_code=400, detail="format must be collapsed or json")
+    try:
+        result = await profiler.profile(seconds, mode, interval_ms, all_threads=threads == "all", task_glob=task)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except profiler.ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == "json":
+        return profiler.summary(result)
+    return PlainTextResponse(
+        profiler.collapsed(result["stacks"]),
+        headers={"Content-Disposition": f'attachment; filename="gateway-{mode}-{int(time.time())}.collapsed"'},
+    )
 
 
 @router.get("/usage")
@@ -173,7 +486,7 @@ async def usage(
         where_extra = " AND key_id = :key_id"
         params["key_id"] = key_id
 
-    with get_session() as db:
+    with get_read_session() as db:
         # Totals across the range
         totals_row = db.execute(
             text(
@@ -222,19 +535,60 @@ async def usage(
         }
 
 
+def _request_log_filters(
+    from_date: str | None,
+    to_date: str | None,
+    key_id: str | None,
+    user_id: str | None,
+    endpoint: str | None,
+    model: str | None,
+    status_code: int | None,
+    errors_only: bool | None,
+):
+    try:
+        from_ts = export.parse_bound(from_date)
+        to_ts = export.parse_bound(to_date, end=True)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD or ISO datetime")
+    return export.request_filters(
+        from_ts=from_ts,
+        to_ts=to_ts,
+        key_id=key_id,
+        user_id=user_id,
+        endpoint=endpoint,
+        model=model,
+        status_code=status_code,
+        errors_only=errors_only,
+    )
+
+
 @router.get("/requests")
-async def requests(_: Principal = Depends(require_admin)):
-    with get_session() as db:
+async def requests(
+    _: Principal = Depends(require_admin),
+    from_date: str | None = Query(default=None, alias="from", description="Start YYYY-MM-DD or ISO datetime (inclusive)"),
+    to_date: str | None = Query(default=None, alias="to", description="End YYYY-MM-DD or ISO datetime (inclusive)"),
+    key_id: str | None = Query(default=None, description="Filter by API key ID"),
+    user_id: str | None = Query(default=None, description="Filter by user ID"),
+    endpoint: str | None = Query(default=None, description="Filter by endpoint"),
+    model: str | None = Query(default=None, description="Filter by model"),
+    status_code: int | None = Query(default=None, description="Filter by HTTP status code"),
+    errors_only: bool | None = Query(default=None, description="Only requests with status_code >= 400"),
+):
+    clauses, params = _request_log_filters(from_date, to_date, key_id, user_id, endpoint, model, status_code, errors_only)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    with get_read_session() as db:
         rows = db.execute(
             text(
-                """
+                f"""
                 SELECT id, created_at, endpoint, status_code, latency_ms, user_id, key_id,
-                       total_tokens, error_message, request_body, response_body
+                       total_tokens, error_message, request_body, response_body, cache_hit
                 FROM requests
+                {where}
                 ORDER BY created_at DESC
                 LIMIT 100
                 """
-            )
+            ),
+            params,
         ).fetchall()
 
         def _to_str(val):
@@ -253,6 +607,7 @@ async def requests(_: Principal = Depends(require_admin)):
                     "user_id": _to_str(r.user_id),
                     "key_id": _to_str(r.key_id),
                     "tokens_used": r.total_tokens,
+                    "cache_hit": bool(r.cache_hit),
                     "error_message": r.error_message,
                     # The admin UI expects stringified JSON it can JSON.parse safely
                     "request_body": json.dumps(r.request_body) if r.request_body is not None else None,
@@ -261,3 +616,115 @@ async def requests(_: Principal = Depends(require_admin)):
             )
 
         return results
+
+
+# --- Bulk exports
+# NDJSON/CSV stream straight from a server-side cursor in (sort key, id) order.
+# Every row carries a `cursor`; pass the last one back as `after` to resume.
+
+_EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _export_response(rows, columns, fmt: str, dataset: str) -> StreamingResponse:
+    if fmt == "csv":
+        body = export.to_csv(rows, columns)
+    else:
+        body = export.to_ndjson(rows)
+    headers = {
+        "Content-Disposition": f'attachment; filename="{dataset}.{fmt}"',
+        "X-Accel-Buffering": "no",
+    }
+    return StreamingResponse(body, media_type=_EXPORT_MEDIA_TYPES[fmt], headers=headers)
+
+
+def _start_parquet_export(background: BackgroundTasks, dataset: str, rows, columns) -> dict:
+    if not export.parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow")
+    rec = export.new_export(dataset)
+    background.add_task(export.write_parquet, rec["id"], rows, columns)
+    return {k: v for k, v in rec.items() if k != "path"}
+
+
+@router.get("/export/requests")
+async def export_requests(
+    background: BackgroundTasks,
+    principal: Principal = Depends(require_admin),
+    format: str = Query(default="ndjson", pattern="^(ndjson|csv|parquet)$", description="ndjson|csv|parquet"),
+    after: str | None = Query(default=None, description="Resume after this row cursor"),
+    limit: int | None = Query(default=None, ge=1, description="Maximum rows to export"),
+    include_bodies: bool = Query(default=False, description="Include request/response JSON bodies"),
+    from_date: str | None = Query(default=None, alias="from", description="Start YYYY-MM-DD or ISO datetime (inclusive)"),
+    to_date: str | None = Query(default=None, alias="to", description="End YYYY-MM-DD or ISO datetime (inclusive)"),
+    key_id: str | None = Query(default=None, description="Filter by API key ID"),
+    user_id: str | None = Query(default=None, description="Filter by user ID"),
+    endpoint: str | None = Query(default=None, description="Filter by endpoint"),
+    model: str | None = Query(default=None, description="Filter by model"),
+    status_code: int | None = Query(default=None, description="Filter by HTTP status code"),
+    errors_only: bool | None = Query(default=None, description="Only requests with status_code >= 400"),
+):
+    clauses, params = _request_log_filters(from_date, to_date, key_id, user_id, endpoint, model, status_code, errors_only)
+    try:
+        rows = export.iter_requests(clauses, params, after=after, limit=limit, include_bodies=include_bodies)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    columns = export.REQUEST_COLUMNS + (export.REQUEST_BODY_COLUMNS if include_bodies else [])
+    with get_session() as db:
+        db_audit(db, principal.key_id, "EXPORT_REQUESTS", None, {"format": format, "after": after})
+    if format == "parquet":
+        return _start_parquet_export(background, "requests", rows, columns)
+    return _export_response(rows, columns, format, "requests")
+
+
+@router.get("/export/usage")
+async def export_usage(
+    background: BackgroundTasks,
+    principal: Principal = Depends(require_admin),
+    format: str = Query(default="ndjson", pattern="^(ndjson|csv|parquet)$", description="ndjson|csv|parquet"),
+    after: str | None = Query(default=None, description="Resume after this row cursor"),
+    limit: int | None = Query(default=None, ge=1, description="Maximum rows to export"),
+    from_date: str | None = Query(default=None, alias="from", description="Start date YYYY-MM-DD (inclusive)"),
+    to_date: str | None = Query(default=None, alias="to", description="End date YYYY-MM-DD (inclusive)"),
+    key_id: str | None = Query(default=None, description="Filter by API key ID"),
+    user_id: str | None = Query(default=None, description="Filter by user ID"),
+):
+    try:
+        from_day = date.fromisoformat(from_date) if from_date else None
+        to_day = date.fromisoformat(to_date) if to_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    clauses, params = export.usage_filters(from_day=from_day, to_day=to_day, key_id=key_id, user_id=user_id)
+    try:
+        rows = export.iter_usage(clauses, params, after=after, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    with get_session() as db:
+        db_audit(db, principal.key_id, "EXPORT_USAGE", None, {"format": format, "after": after})
+    if format == "parquet":
+        return _start_parquet_export(background, "usage", rows, export.USAGE_COLUMNS)
+    return _export_response(rows, export.USAGE_COLUMNS, format, "usage")
+
+
+@router.get("/exports/{export_id}")
+async def export_status(export_id: str, _: Principal = Depends(require_admin)):
+    rec = export.get_export(export_id)
+    if not rec:
+        if export.export_expired(export_id):
+            raise HTTPException(status_code=410, detail="Export expired")
+        raise HTTPException(status_code=404, detail="Export not found")
+    return {k: v for k, v in rec.items() if k != "path"}
+
+
+@router.get("/exports/{export_id}/download")
+async def export_download(export_id: str, _: Principal = Depends(require_admin)):
+    rec = export.get_export(export_id)
+    if not rec:
+        if export.export_expired(export_id):
+            raise HTTPException(status_code=410, detail="Export expired")
+        raise HTTPException(status_code=404, detail="Export not found")
+    if rec["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Export is {rec['status']}")
+    return FileResponse(
+        rec["path"],
+        media_type="application/vnd.apache.parquet",
+        filename=f"{rec['dataset']}-{rec['id']}.parquet",
+    )
@@ -2,9 +2,12 @@
 
 import logging
 import json
+import math
 import time
 import asyncio
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
 from starlette.responses import StreamingResponse, JSONResponse
 
 from ..auth import require_key, Principal
@@ -12,20 +15,27 @@ from ..types import ChatCompletionRequest
 from ..ratelimit import check_rate_limit
 from ..queue import enqueue_job
 from ..accounting import record_request
+from .. import registry, response_cache, tokens
+from ..config import settings
+from ..metrics import count_request, gateway_context_checks
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+_ENDPOINT = "/v1/chat/completions"
+
 
 @router.get("/v1/models")
 async def list_models():
     logger.debug("GET /v1/models called")
-    return {"object": "list", "data": [{"id": "default", "object": "model"}]}
+    return {"object": "list", "data": await registry.list_models()}
 
 
 @router.post("/v1/chat/completions")
 async def chat_completions(
-    body: ChatCompletionRequest, principal: Principal = Depends(require_key)
+    body: ChatCompletionRequest,
+    principal: Principal = Depends(require_key),
+    x_request_timeout: Optional[str] = Header(default=None),
 ):
     logger.info(
         "POST /v1/chat/completions called for key_id=%s user_id=%s stream=%s",
@@ -34,14 +44,56 @@ async def chat_completions(
         body.stream,
     )
 
-    await check_rate_limit(principal.key_id)
+    try:
+        await check_rate_limit(principal.key_id)
+    except HTTPException as e:
+        count_request(_ENDPOINT, None, e.status_code)
+        raise
+
+    # Reject unknown models before they take a queue slot
+    backend, upstream_model = await registry.resolve(body.model)
+    if backend is None:
+        count_request(_ENDPOINT, None, 404)
+        raise HTTPException(status_code=404, detail=f"The model '{body.model}' does not exist")
+    # Fail fast while the backend's circuit is open instead of queueing doomed work
+    retry_after = backend.breaker.retry_after()
+    if retry_after is not None:
+        count_request(_ENDPOINT, backend.name, 503)
+        raise HTTPException(
+            status_code=503,
+            detail=f"Model '{backend.name}' is temporarily unavailable",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
 
     started = time.time()
+    deadline = started + _timeout_s(body, x_request_timeout)
+    request_body = body.model_dump()
+    request_body["model"] = upstream_model
+    prompt_tokens = tokens.estimate_prompt_tokens(request_body["messages"])
+    if settings.context_check:
+        if not backend.discovered:
+            # Startup discovery failed or hasn't finished: check against the configured
+            # context_length (if any) now, and let a background refresh find max_model_len
+            registry.schedule_discovery()
+        try:
+            _check_context(backend, upstream_model, request_body, prompt_tokens)
+        except HTTPException as e:
+            count_request(_ENDPOINT, backend.name, e.status_code)
+            raise
+    cache_key = response_cache.cache_key(request_body)
+    if cache_key:
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            return await _serve_cached(body, principal, cached, started, backend.name)
+
     job = await enqueue_job(
         endpoint="/v1/chat/completions",
-        body=body.model_dump(),
+        body=request_body,
         principal=principal,
+        backend=backend,
         stream=bool(body.stream),
+        deadline=deadline,
+        prompt_tokens=prompt_tokens,
     )
 
     # STREAMING MODE
@@ -51,22 +103,12 @@ async def chat_completions(
         async def _gen():
             last_with_usage = None
             try:
-                async for chunk in job.stream():
+                async for chunk in job.stream(principal.key_id):
                     # Forward raw SSE chunk to client
                     yield chunk
-
-                    # Try to parse JSON from SSE "data:" lines
-                    try:
-                        text_chunk = chunk.decode("utf-8").strip()
-                        if text_chunk.startswith("data: "):
-                            payload = text_chunk[len("data: "):].strip()
-                            if payload != "[DONE]":
-                                parsed = json.loads(payload)
-                                if "usage" in parsed:
-                                    last_with_usage = parsed
-                    except Exception:
-                        # Ignore parse errors — keep streaming
-                        pass
+                    parsed = _usage_frame(chunk)
+                    if parsed is not None:
+                        last_with_usage = parsed
             finally:
                 try:
                     latency_ms = int((time.time() - started) * 1000)
@@ -83,6 +125,7 @@ async def chat_completions(
                         status_code=200,
                         error_message=None,
                         latency_ms=latency_ms,
+                        backend=backend.name,
                     )
                 except Exception as e:
                     logger.exception("Error recording streamed request: %s", e)
@@ -99,12 +142,10 @@ async def chat_completions(
     # NON-STREAMING MODE
     try:
         logger.debug("Waiting for job result...")
-        result = await asyncio.wait_for(
-            job.result(),
-            timeout=body.timeout_s if hasattr(body, "timeout_s") else 300,
-        )
+        result = await asyncio.wait_for(job.result(principal.key_id), timeout=max(0.0, deadline - time.time()))
         logger.debug("Job result received: %s", result)
     except asyncio.TimeoutError:
+        count_request(_ENDPOINT, backend.name, 504)
         raise HTTPException(status_code=504, detail="Upstream timeout")
 
     latency_ms = int((time.time() - started) * 1000)
@@ -124,8 +165,10 @@ async def chat_completions(
             status_code=status_code,
             error_message=error_message,
             latency_ms=latency_ms,
+            backend=backend.name,
         )
-        raise HTTPException(status_code=status_code, detail=error_message)
+        headers = {"Retry-After": str(math.ceil(result["retry_after"]))} if result.get("retry_after") else None
+        raise HTTPException(status_code=status_code, detail=error_message, headers=headers)
 
     await record_request(
         key_id=principal.key_id,
@@ -137,5 +180,89 @@ async def chat_completions(
         status_code=status_code,
         error_message=error_message,
         latency_ms=latency_ms,
+        backend=backend.name,
     )
-    return JSONResponse(result, status_code=status_code)
+    headers = {}
+    if cache_key:
+        await response_cache.put(cache_key, result)
+        headers["X-Cache"] = "MISS"
+    return JSONResponse(result, status_code=status_code, headers=headers)
+
+
+def _check_context(backend, upstream_model: Optional[str], request_body: dict, prompt_tokens: int) -> None:
+    """Reject prompts that cannot fit the model's context window, and clamp max_tokens if enabled."""
+    limit = backend.context_limit(upstream_model)
+    if not limit:
+        return
+    # The estimate can be off, so only reject when it is clearly over
+    if prompt_tokens > limit * settings.context_check_slack:
+        gateway_context_checks.labels(backend=backend.name, result="rejected").inc()
+        raise HTTPException(
+            status_code=400,
+            detail=(
+                f"This model's maximum context length is {limit} tokens. "
+                f"However, your messages resulted in about {prompt_tokens} tokens."
+            ),
+        )
+    max_tokens = request_body.get("max_tokens")
+    if settings.clamp_max_tokens and max_tokens and prompt_tokens + max_tokens > limit:
+        request_body["max_tokens"] = max(1, limit - prompt_tokens)
+        gateway_context_checks.labels(backend=backend.name, result="clamped").inc()
+
+
+def _usage_frame(chunk: bytes) -> Optional[dict]:
+    """The parsed SSE "data:" frame if it carries usage, else None."""
+    try:
+        text_chunk = chunk.decode("utf-8").strip()
+        if text_chunk.startswith("data: "):
+            payload = text_chunk[len("data: "):].strip()
+            if payload != "[DONE]":
+                parsed = json.loads(payload)
+                if "usage" in parsed:
+                    return parsed
+    except Exception:
+        # Ignore parse errors — keep streaming
+        pass
+    return None
+
+
+def _timeout_s(body: ChatCompletionRequest, header: Optional[str]) -> float:
+    """How long the caller will wait: X-Request-Timeout, then timeout_s, then the server default."""
+    timeout = body.timeout_s or settings.request_timeout_s
+    if header:
+        try:
+            timeout = float(header)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="X-Request-Timeout must be a number of seconds")
+        if timeout <= 0:
+            raise HTTPException(status_code=400, detail="X-Request-Timeout must be positive")
+    return min(timeout, settings.request_timeout_max_s)
+
+
+async def _serve_cached(body: ChatCompletionRequest, principal: Principal, cached: dict, started: float, backend: str):
+    logger.info("Response cache hit for key_id=%s stream=%s", principal.key_id, body.stream)
+    await record_request(
+        key_id=principal.key_id,
+        user_id=principal.user_id,
+        endpoint="/v1/chat/completions",
+        model=(body.model or None),
+        request_body=body.model_dump(),
+        response_body=cached,
+        status_code=200,
+        error_message=None,
+        latency_ms=int((time.time() - started) * 1000),
+        cache_hit=True,
+        backend=backend,
+    )
+    if body.stream:
+        headers = {
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",
+            "X-Cache": "HIT",
+        }
+        include_usage = bool((body.stream_options or {}).get("include_usage"))
+        return StreamingResponse(
+            response_cache.replay_sse(cached, include_usage), media_type="text/event-stream", headers=headers
+        )
+    return JSONResponse(cached, headers={"X-Cache": "HIT"})
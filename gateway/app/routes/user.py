@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
 from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
 from ..db import (
     get_session,
@@ -7,10 +7,10 @@ from ..db import (
     verify_user_password,
     list_keys_for_user,
 )
-from sqlalchemy import text
 from ..schemas import SelfRegister, LoginRequest, TokenResponse
 from ..user_auth import jwt_encode, jwt_decode, require_user
 from ..config import settings
+from .. import usage_cache
 
 router = APIRouter()
 
@@ -165,51 +165,34 @@ async def my_keys(user: dict = Depends(require_user)):
 
 
 @router.get("/me/usage")
-async def my_usage(user: dict = Depends(require_user)):
-    # Aggregate token usage & requests per key for this user (last 30 days)
-    params = {"uid": user["sub"]}
-    sql = text(
-        """
-        SELECT key_id, COALESCE(SUM(request_count),0) AS request_count, COALESCE(SUM(total_tokens),0) AS total_tokens
-        FROM usage_rollups
-        WHERE user_id = :uid AND day >= (CURRENT_DATE - INTERVAL '30 days')
-        GROUP BY key_id
-        ORDER BY total_tokens DESC
-        """
-    )
-    with get_session() as db:
-        rows = db.execute(sql, params).fetchall()
-    return {
-        "items": [
-            {
-                "key_id": str(r.key_id) if getattr(r, "key_id", None) else None,
-                "request_count": int(r.request_count or 0),
-                "total_tokens": int(r.total_tokens or 0),
-            }
-            for r in rows
-        ]
-    }
+async def my_usage(
+    user: dict = Depends(require_user),
+    if_none_match: str | None = Header(default=None, alias="If-None-Match"),
+):
+    # Token usage & requests per key for this user (last 30 days), served from the usage cache
+    items = await usage_cache.get_usage(user["sub"])
+    etag = usage_cache.etag_for(user["sub"], items)
+    headers = usage_cache.cache_headers(etag)
+    if usage_cache.not_modified(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({"items": items}, headers=headers)
 
 
 @router.get("/dashboard", response_class=HTMLResponse)
-async def dashboard(request: Request, user: dict = Depends(require_user)):
+async def dashboard(
+    request: Request,
+    user: dict = Depends(require_user),
+    if_none_match: str | None = Header(default=None, alias="If-None-Match"),
+):
     # Load keys and usage
-    with get_session() as db:
-        keys = list_keys_for_user(db, user_id=user["sub"])  # [{...}]
-        rows = db.execute(
-            text(
-                """
-                SELECT key_id, COALESCE(SUM(request_count),0) AS request_count, COALESCE(SUM(total_tokens),0) AS total_tokens
-                FROM usage_rollups
-                WHERE user_id = :uid AND day >= (CURRENT_DATE - INTERVAL '30 days')
-                GROUP BY key_id
-                ORDER BY total_tokens DESC
-                """
-            ),
-            {"uid": user["sub"]},
-        ).fetchall()
-
-    usage_map = {str(r.key_id): {"request_count": int(r.request_count or 0), "total_tokens": int(r.total_tokens or 0)} for r in rows}
+    keys = await usage_cache.get_keys(user["sub"])  # [{...}]
+    items = await usage_cache.get_usage(user["sub"])
+    etag = usage_cache.etag_for(user["sub"], user.get("email"), user.get("name"), keys, items)
+    headers = usage_cache.cache_headers(etag)
+    if usage_cache.not_modified(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    usage_map = {i["key_id"]: i for i in items}
 
     # Build table
     if not keys:
@@ -235,5 +218,7 @@ async def dashboard(request: Request, user: dict = Depends(require_user)):
       <button type='submit'>Refresh Access Token</button>
     </form>
     """
-    return _html_page("Dashboard", body)
+    page = _html_page("Dashboard", body)
+    page.headers.update(headers)
+    return page
 
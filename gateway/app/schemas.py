@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Any
+from typing import Any, Dict, List, Optional
 
 
 class ChatMessage(BaseModel):
@@ -17,6 +17,9 @@ class ChatCompletionRequest(BaseModel):
     presence_penalty: Optional[float] = None
     frequency_penalty: Optional[float] = None
     stop: Optional[Any] = None
+    stream_options: Optional[Dict[str, Any]] = None
+    # Gateway-only: seconds the caller will wait (also X-Request-Timeout); not sent upstream
+    timeout_s: Optional[float] = Field(default=None, gt=0, exclude=True)
 
 
 # Admin / Users
@@ -1,8 +1,15 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 from passlib.context import CryptContext
+from .config import settings
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt releases the GIL, so a small thread pool hashes in parallel
+_hash_pool = ThreadPoolExecutor(max_workers=settings.hash_workers, thread_name_prefix="bcrypt")
+
 
 def hash_key(plaintext: str) -> str:
     return pwd_context.hash(plaintext)
@@ -14,3 +21,8 @@ def verify_key(plaintext: str, key_hash: str) -> bool:
     except Exception:
         return False
 
+
+async def hash_keys(plaintexts: List[str]) -> List[str]:
+    """Hash many secrets off the event loop, in parallel."""
+    loop = asyncio.get_running_loop()
+    return list(await asyncio.gather(*(loop.run_in_executor(_hash_pool, hash_key, p) for p in plaintexts)))
@@ -0,0 +1,105 @@
+# app/tokens.py
+
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+import orjson
+
+from .config import settings
+from .metrics import gateway_token_bytes_per_token, gateway_token_estimate_ratio
+
+logger = logging.getLogger(__name__)
+
+# Local prompt token estimates for scheduling.
+# TOKENIZER selects a real tokenizer when its package is installed:
+#   hf:<repo id or tokenizer.json path>   (tokenizers)
+#   tiktoken:<encoding name>              (tiktoken)
+# Otherwise prompts are estimated from their UTF-8 size with a bytes-per-token
+# ratio that is recalibrated from the upstream's reported usage.
+
+# Chat template overhead per message and per request, roughly
+_PER_MESSAGE = 4
+_PER_REQUEST = 3
+
+
+def _load_tokenizer(spec: str) -> Optional[Callable[[str], int]]:
+    kind, _, name = spec.partition(":")
+    try:
+        if kind == "hf":
+            from tokenizers import Tokenizer
+
+            tok = Tokenizer.from_file(name) if name.endswith(".json") else Tokenizer.from_pretrained(name)
+            return lambda text: len(tok.encode(text, add_special_tokens=False).ids)
+        if kind == "tiktoken":
+            import tiktoken
+
+            enc = tiktoken.get_encoding(name)
+            return lambda text: len(enc.encode(text, disallowed_special=()))
+    except Exception as e:
+        logger.warning("Tokenizer %r unavailable, estimating from bytes: %s", spec, e)
+        return None
+    logger.warning("Unknown TOKENIZER %r, estimating from bytes", spec)
+    return None
+
+
+_count: Optional[Callable[[str], int]] = _load_tokenizer(settings.tokenizer) if settings.tokenizer else None
+_bytes_per_token: float = settings.token_bytes_per_token
+gateway_token_bytes_per_token.set(_bytes_per_token)
+
+
+def method() -> str:
+    return "tokenizer" if _count is not None else "bytes"
+
+
+def _text(content: Any) -> str:
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        # Multi-part content: count the text parts
+        return "".join(p.get("text") or "" for p in content if isinstance(p, dict))
+    return orjson.dumps(content).decode("utf-8")
+
+
+def estimate_prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    texts = [_text(m.get("content")) for m in messages or []]
+    if _count is not None:
+        body = sum(_count(t) for t in texts)
+    else:
+        body = int(sum(len(t.encode("utf-8")) for t in texts) / _bytes_per_token)
+    return body + _PER_MESSAGE * len(texts) + _PER_REQUEST
+
+
+def estimate_cost(body: Dict[str, Any], prompt_tokens: Optional[int] = None) -> int:
+    """Tokens a request will occupy on the model: prompt plus the completion it may generate."""
+    if prompt_tokens is None:
+        prompt_tokens = estimate_prompt_tokens(body.get("messages") or [])
+    return prompt_tokens + (body.get("max_tokens") or settings.scheduler_default_max_tokens)
+
+
+def record_actual(estimated: int, usage: Optional[Dict[str, Any]], messages: List[Dict[str, Any]]) -> None:
+    """Compare an estimate with the upstream's usage and, for the byte heuristic, recalibrate."""
+    global _bytes_per_token
+    actual = (usage or {}).get("prompt_tokens")
+    if not actual or estimated <= 0:
+        return
+    gateway_token_estimate_ratio.labels(method=method()).observe(actual / estimated)
+    if _count is None and settings.token_estimate_autocalibrate:
+        size = sum(len(_text(m.get("content")).encode("utf-8")) for m in messages or [])
+        body_tokens = actual - (estimated - int(size / _bytes_per_token))
+        if size and body_tokens > 0:
+            observed = size / body_tokens
+            _bytes_per_token = min(8.0, max(1.0, 0.95 * _bytes_per_token + 0.05 * observed))
+            gateway_token_bytes_per_token.set(_bytes_per_token)
+
+
+def usage_from_sse(tail: bytes) -> Optional[Dict[str, Any]]:
+    """The usage object from the last SSE data frame that carries one, if any."""
+    for line in reversed(tail.split(b"\n")):
+        if line.startswith(b"data: {") and b'"usage"' in line:
+            try:
+                return orjson.loads(line[len(b"data: "):]).get("usage")
+            except orjson.JSONDecodeError:
+                return None
+    return None
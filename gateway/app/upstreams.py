@@ -0,0 +1,258 @@
+# app/upstreams.py
+
+import asyncio
+import bisect
+import contextlib
+import hashlib
+import logging
+import math
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from .config import settings
+from .metrics import (
+    gateway_upstream_affinity,
+    gateway_upstream_ejections,
+    gateway_upstream_healthy,
+    gateway_upstream_inflight,
+    gateway_upstream_latency,
+)
+
+logger = logging.getLogger(__name__)
+
+# Pool of vLLM replicas. Each job is routed to the replica with the fewest
+# outstanding requests (or the better of two random picks), skipping replicas
+# that fail active health checks or were ejected after consecutive errors.
+# Replicas that (re)join ramp up their share of traffic over a slow-start window.
+#
+# "prefix_affinity" keeps requests that share a prompt prefix on the same
+# replica so vLLM's automatic prefix cache gets hits: the leading messages are
+# hashed onto a consistent-hash ring, and a replica already carrying more than
+# AFFINITY_LOAD_FACTOR x the average load is skipped for the next one on the
+# ring (consistent hashing with bounded loads).
+
+STRATEGIES = ("least_outstanding", "p2c", "prefix_affinity")
+
+# Every pool created (one per model backend), for the health checker
+_pools: List["UpstreamPool"] = []
+
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+def affinity_key(body: Optional[Dict[str, Any]]) -> Optional[bytes]:
+    """The first AFFINITY_PREFIX_CHARS characters of the conversation (system prompt first)."""
+    messages = (body or {}).get("messages") or []
+    if not messages:
+        return None
+    budget = settings.affinity_prefix_chars
+    parts: List[str] = []
+    for m in messages:
+        content = m.get("content") or ""
+        if not isinstance(content, str):
+            content = str(content)
+        part = f"{m.get('role') or ''}\x1f{content}\x1e"[:budget]
+        parts.append(part)
+        budget -= len(part)
+        if budget <= 0:
+            break
+    return "".join(parts).encode("utf-8")
+
+
+class Upstream:
+    def __init__(self, url: str, weight: float = 1.0):
+        self.url = url.rstrip("/")
+        self.weight = weight
+        self.inflight = 0
+        self.healthy = True
+        self.ejected_until = 0.0
+        self.consecutive_failures = 0
+        self.joined_at = time.monotonic()
+        self.ewma_latency_s: Optional[float] = None
+        gateway_upstream_healthy.labels(upstream=self.url).set(1)
+
+    def available(self, now: float) -> bool:
+        return self.healthy and now >= self.ejected_until
+
+    def effective_weight(self, now: float) -> float:
+        if settings.upstream_slow_start_s <= 0:
+            return self.weight
+        ramp = (now - self.joined_at) / settings.upstream_slow_start_s
+        return self.weight * min(1.0, max(0.1, ramp))
+
+    def load(self, now: float) -> float:
+        return (self.inflight + 1) / self.effective_weight(now)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "ejected": now < self.ejected_until,
+            "inflight": self.inflight,
+            "effective_weight": round(self.effective_weight(now), 3),
+            "ewma_latency_s": self.ewma_latency_s,
+        }
+
+
+class UpstreamPool:
+    def __init__(self, urls: List[str], strategy: str = "least_outstanding"):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown upstream strategy {strategy!r}; expected one of {STRATEGIES}")
+        self.upstreams = [Upstream(u) for u in urls]
+        self.strategy = strategy
+        ring = sorted(
+            (_hash64(f"{u.url}#{i}".encode("utf-8")), idx)
+            for idx, u in enumerate(self.upstreams)
+            for i in range(settings.affinity_vnodes)
+        )
+        self._ring_hashes = [h for h, _ in ring]
+        self._ring_owners = [idx for _, idx in ring]
+        _pools.append(self)
+
+    def _candidates(self, now: float) -> List[Upstream]:
+        ready = [u for u in self.upstreams if u.available(now)]
+        # Panic mode: if nothing looks available, spread over everything rather than fail outright
+        return ready or self.upstreams
+
+    def pick(self, body: Optional[Dict[str, Any]] = None) -> Upstream:
+        now = time.monotonic()
+        candidates = self._candidates(now)
+        if len(candidates) == 1:
+            return candidates[0]
+        if self.strategy == "prefix_affinity":
+            key = affinity_key(body)
+            if key is not None:
+                up, preferred = self.pick_affinity(key, candidates, now)
+                gateway_upstream_affinity.labels(result="preferred" if preferred else "spilled").inc()
+                return up
+        if self.strategy == "p2c":
+            a, b = random.sample(candidates, 2)
+            return a if a.load(now) <= b.load(now) else b
+        return self._least_loaded(candidates, now)
+
+    def _least_loaded(self, candidates: List[Upstream], now: float) -> Upstream:
+        best = min(u.load(now) for u in candidates)
+        return random.choice([u for u in candidates if u.load(now) == best])
+
+    def pick_affinity(self, key: bytes, candidates: List[Upstream], now: float):
+        """Walk the ring from the key's position; returns (upstream, landed_on_preferred)."""
+        allowed = set(id(u) for u in candidates)
+        total = sum(u.inflight for u in candidates) + 1
+        capacity = math.ceil(settings.affinity_load_factor * total / len(candidates))
+        start = bisect.bisect(self._ring_hashes, _hash64(key)) % len(self._ring_hashes)
+        seen = set()
+        first: Optional[Upstream] = None
+        for step in range(len(self._ring_owners)):
+            idx = self._ring_owners[(start + step) % len(self._ring_owners)]
+            if idx in seen:
+                continue
+            seen.add(idx)
+            up = self.upstreams[idx]
+            if id(up) not in allowed:
+                continue
+            if first is None:
+                first = up
+            # Slow-starting replicas get a proportionally smaller share of the bound
+            if up.inflight < max(1, math.floor(capacity * up.effective_weight(now) / up.weight)):
+                return up, up is first
+            if len(seen) == len(self.upstreams):
+                break
+        return self._least_loaded(candidates, now), False
+
+    @asynccontextmanager
+    async def acquire(self, body: Optional[Dict[str, Any]] = None) -> AsyncIterator[Upstream]:
+        up = self.pick(body)
+        up.inflight += 1
+        gateway_upstream_inflight.labels(upstream=up.url).inc()
+        started = time.monotonic()
+        try:
+            yield up
+        except BaseException as e:
+            if is_upstream_failure(e):
+                self.report_failure(up)
+            raise
+        else:
+            self.report_success(up, time.monotonic() - started)
+        finally:
+            up.inflight -= 1
+            gateway_upstream_inflight.labels(upstream=up.url).dec()
+
+    def report_success(self, up: Upstream, latency_s: float) -> None:
+        up.consecutive_failures = 0
+        up.ewma_latency_s = latency_s if up.ewma_latency_s is None else 0.8 * up.ewma_latency_s + 0.2 * latency_s
+        gateway_upstream_latency.labels(upstream=up.url).observe(latency_s)
+
+    def report_failure(self, up: Upstream) -> None:
+        up.consecutive_failures += 1
+        if up.consecutive_failures >= settings.upstream_eject_failures and len(self.upstreams) > 1:
+            up.ejected_until = time.monotonic() + settings.upstream_eject_s
+            up.joined_at = up.ejected_until  # slow-start again once it is back
+            up.consecutive_failures = 0
+            gateway_upstream_ejections.labels(upstream=up.url).inc()
+            logger.warning("Ejecting upstream %s for %ss after repeated errors", up.url, settings.upstream_eject_s)
+
+    async def check_health(self, client: httpx.AsyncClient) -> None:
+        async def _probe(up: Upstream) -> None:
+            try:
+                r = await client.get(f"{up.url}/health", timeout=settings.upstream_health_timeout_s)
+                ok = r.status_code < 500
+            except Exception:
+                ok = False
+            if ok and not up.healthy:
+                logger.info("Upstream %s is healthy again", up.url)
+                up.joined_at = time.monotonic()
+            elif not ok and up.healthy:
+                logger.warning("Upstream %s failed its health check", up.url)
+            up.healthy = ok
+            gateway_upstream_healthy.labels(upstream=up.url).set(1 if ok else 0)
+
+        await asyncio.gather(*(_probe(u) for u in self.upstreams))
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [u.snapshot() for u in self.upstreams]
+
+
+def is_upstream_failure(e: BaseException) -> bool:
+    """Errors that say something about the replica (not about the request)."""
+    from .vllm_client import DeadlineExceededError, StreamTimeoutError, UpstreamHTTPError
+
+    if isinstance(e, DeadlineExceededError):
+        return False  # the caller's budget ran out, not the replica's patience
+    if isinstance(e, StreamTimeoutError):
+        return e.limit in ("ttft", "idle")
+    if isinstance(e, UpstreamHTTPError):
+        return e.status_code >= 500
+    return isinstance(e, (httpx.TransportError, asyncio.TimeoutError))
+
+
+# --- Active health checks
+
+_health_task: Optional[asyncio.Task] = None
+
+
+async def _health_loop() -> None:
+    async with httpx.AsyncClient() as client:
+        while True:
+            await asyncio.gather(*(p.check_health(client) for p in _pools))
+            await asyncio.sleep(settings.upstream_health_interval_s)
+
+
+def start_health_checks() -> Optional[asyncio.Task]:
+    global _health_task
+    if settings.upstream_health_interval_s <= 0:
+        return None
+    _health_task = asyncio.create_task(_health_loop(), name="upstream-health")
+    return _health_task
+
+
+async def stop_health_checks() -> None:
+    if _health_task:
+        _health_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await _health_task
@@ -0,0 +1,221 @@
+# app/usage_cache.py
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from .config import settings
+from .db import get_read_session, get_session, list_keys_for_user
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Per-user 30-day usage summary shared by /me/usage and /dashboard.
+# Backends: "redis" (shared across workers), "memory" (per process) or "off".
+# Entries are short-lived and accounting bumps cached counters in place, so a
+# page load only reaches the database once per TTL per user.
+
+_USAGE_SQL = text(
+    """
+    SELECT key_id, COALESCE(SUM(request_count),0) AS request_count, COALESCE(SUM(total_tokens),0) AS total_tokens
+    FROM usage_rollups
+    WHERE user_id = :uid AND day >= (CURRENT_DATE - INTERVAL '30 days')
+    GROUP BY key_id
+    """
+)
+
+# Only bump counters of summaries that are already cached; a miss recomputes.
+_LUA_INCR_IF_CACHED = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+  redis.call('HINCRBY', KEYS[1], 'r:' .. ARGV[1], ARGV[2])
+  redis.call('HINCRBY', KEYS[1], 't:' .. ARGV[1], ARGV[3])
+  return 1
+end
+return 0
+"""
+
+# In-memory backend: insertion order is expiry order (one TTL for all), so
+# expired entries are pruned from the front on every write, and the oldest
+# go first beyond USAGE_CACHE_MAX_ENTRIES.
+_mem_usage: "OrderedDict[str, Tuple[float, Dict[str, List[int]]]]" = OrderedDict()
+_mem_keys: "OrderedDict[str, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+
+
+def _mem_get(cache: "OrderedDict[str, Tuple[float, Any]]", user_id: str) -> Any:
+    hit = cache.get(user_id)
+    if hit is None:
+        return None
+    if hit[0] <= time.monotonic():
+        del cache[user_id]
+        return None
+    return hit[1]
+
+
+def _mem_put(cache: "OrderedDict[str, Tuple[float, Any]]", user_id: str, value: Any) -> None:
+    now = time.monotonic()
+    cache.pop(user_id, None)
+    cache[user_id] = (now + settings.usage_cache_ttl_s, value)
+    while cache:
+        oldest, (expires, _) = next(iter(cache.items()))
+        if expires > now and len(cache) <= settings.usage_cache_max_entries:
+            break
+        del cache[oldest]
+
+
+def _usage_key(user_id: str) -> str:
+    return f"usage:summary:{user_id}"
+
+
+def _keys_key(user_id: str) -> str:
+    return f"usage:keys:{user_id}"
+
+
+def _load_usage(user_id: str) -> Dict[str, List[int]]:
+    with get_read_session() as db:
+        rows = db.execute(_USAGE_SQL, {"uid": user_id}).fetchall()
+    return {
+        str(r.key_id): [int(r.request_count or 0), int(r.total_tokens or 0)]
+        for r in rows
+        if getattr(r, "key_id", None)
+    }
+
+
+def _load_keys(user_id: str) -> List[Dict[str, Any]]:
+    with get_session() as db:
+        return list_keys_for_user(db, user_id=user_id)
+
+
+async def _redis_client():
+    if settings.usage_cache_backend != "redis":
+        return None
+    return await get_redis()
+
+
+async def get_usage(user_id: str) -> List[Dict[str, Any]]:
+    """Per-key request/token totals for the last 30 days, highest usage first."""
+    counts: Optional[Dict[str, List[int]]] = None
+    backend = settings.usage_cache_backend
+    client = await _redis_client()
+
+    if client is not None:
+        try:
+            raw = await client.hgetall(_usage_key(user_id))
+            if raw:
+                counts = {}
+                for field, value in raw.items():
+                    kind, _, key_id = field.partition(":")
+                    if kind in ("r", "t") and key_id:
+                        counts.setdefault(key_id, [0, 0])[0 if kind == "r" else 1] = int(value)
+        except Exception as e:
+            logger.warning("Usage cache read failed: %s", e)
+            client = None
+    elif backend == "memory":
+        counts = _mem_get(_mem_usage, user_id)
+
+    if counts is None:
+        counts = await asyncio.to_thread(_load_usage, user_id)
+        if client is not None:
+            mapping: Dict[str, Any] = {"_": 1}  # marker so empty summaries are cached too
+            for key_id, (req, tok) in counts.items():
+                mapping[f"r:{key_id}"] = req
+                mapping[f"t:{key_id}"] = tok
+            try:
+                pipe = client.pipeline()
+                pipe.hset(_usage_key(user_id), mapping=mapping)
+                pipe.expire(_usage_key(user_id), settings.usage_cache_ttl_s)
+                await pipe.execute()
+            except Exception as e:
+                logger.warning("Usage cache write failed: %s", e)
+        elif backend == "memory":
+            _mem_put(_mem_usage, user_id, counts)
+
+    items = [
+        {"key_id": key_id, "request_count": req, "total_tokens": tok}
+        for key_id, (req, tok) in counts.items()
+    ]
+    items.sort(key=lambda i: i["total_tokens"], reverse=True)
+    return items
+
+
+async def get_keys(user_id: str) -> List[Dict[str, Any]]:
+    """The user's API keys (no secrets); invalidated by admin key changes."""
+    backend = settings.usage_cache_backend
+    client = await _redis_client()
+    if client is not None:
+        try:
+            raw = await client.get(_keys_key(user_id))
+            if raw is not None:
+                return json.loads(raw)
+        except Exception as e:
+            logger.warning("Key list cache read failed: %s", e)
+            client = None
+    elif backend == "memory":
+        hit = _mem_get(_mem_keys, user_id)
+        if hit is not None:
+            return hit
+
+    keys = await asyncio.to_thread(_load_keys, user_id)
+    if client is not None:
+        try:
+            await client.set(_keys_key(user_id), json.dumps(keys), ex=settings.usage_cache_ttl_s)
+        except Exception as e:
+            logger.warning("Key list cache write failed: %s", e)
+    elif backend == "memory":
+        _mem_put(_mem_keys, user_id, keys)
+    return keys
+
+
+async def record_usage(user_id: str, key_id: str, total_tokens: int) -> None:
+    """Fold one accounted request into the cached summary, if there is one."""
+    backend = settings.usage_cache_backend
+    if backend == "memory":
+        cached = _mem_get(_mem_usage, user_id)
+        if cached is not None:
+            counts = cached.setdefault(key_id, [0, 0])
+            counts[0] += 1
+            counts[1] += total_tokens
+        return
+    client = await _redis_client()
+    if client is None:
+        return
+    try:
+        await client.eval(_LUA_INCR_IF_CACHED, 1, _usage_key(user_id), key_id, 1, total_tokens)
+    except Exception as e:
+        logger.warning("Usage cache update failed: %s", e)
+
+
+async def invalidate_keys(user_id: str) -> None:
+    _mem_keys.pop(user_id, None)
+    client = await _redis_client()
+    if client is None:
+        return
+    try:
+        await client.delete(_keys_key(user_id))
+    except Exception as e:
+        logger.warning("Key list cache invalidation failed: %s", e)
+
+
+def etag_for(*parts: Any) -> str:
+    digest = hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f'W/"{digest[:20]}"'
+
+
+def cache_headers(etag: str) -> Dict[str, str]:
+    return {
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={settings.usage_cache_max_age_s}",
+        "Vary": "Authorization, Cookie",
+    }
+
+
+def not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {t.strip() for t in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates or etag.removeprefix("W/") in candidates
@@ -1,6 +1,13 @@
-from typing import Any, Dict, AsyncGenerator
+import asyncio
+import contextlib
+import math
+from typing import Any, Dict, AsyncGenerator, Optional
 import httpx
+import orjson
 from .config import settings
+from .metrics import gateway_stream_timeouts
+from .breaker import BreakerOpenError, CircuitBreaker
+from .upstreams import UpstreamPool
 
 class UpstreamHTTPError(Exception):
     def __init__(self, status_code: int, message: str, body: Any = None):
@@ -9,12 +16,55 @@ class UpstreamHTTPError(Exception):
         self.message = message
         self.body = body
 
-async def chat_completions(payload: Dict[str, Any]) -> Dict[str, Any]:
+class DeadlineExceededError(Exception):
+    """The caller's own deadline ran out while waiting on the upstream; says nothing about the replica."""
+
+    def __init__(self, seconds: float):
+        super().__init__(f"Request deadline exceeded after {seconds:g}s waiting on the upstream")
+
+# One pooled client for all upstream calls so connections are kept alive
+_client: Optional[httpx.AsyncClient] = None
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=settings.vllm_timeout_s,
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=settings.vllm_keepalive_connections),
+        )
+    return _client
+
+async def aclose() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _timeout(total: Optional[float]) -> httpx.Timeout:
+    # Short connect timeout so a down upstream fails fast instead of holding a slot
+    return httpx.Timeout(total, connect=settings.vllm_connect_timeout_s if total is None else min(total, settings.vllm_connect_timeout_s))
+
+async def chat_completions(
+    payload: Dict[str, Any],
+    pool: UpstreamPool,
+    timeout: Optional[float] = None,
+    breaker: Optional[CircuitBreaker] = None,
+) -> Dict[str, Any]:
     # Ensure we don't accidentally stream in non-stream path
     payload = dict(payload)
     payload.pop("stream", None)
-    async with httpx.AsyncClient(timeout=settings.vllm_timeout_s) as client:
-        r = await client.post(f"{settings.vllm_url}/v1/chat/completions", json=payload)
+    # VLLM_TIMEOUT_S is the upstream's limit (a failure when hit); a shorter
+    # request deadline is the caller's and is enforced separately
+    by_deadline = timeout is not None and timeout < settings.vllm_timeout_s
+    async with _guard(breaker), pool.acquire(payload) as upstream:
+        call = _get_client().post(f"{upstream.url}/v1/chat/completions", json=payload, timeout=_timeout(settings.vllm_timeout_s))
+        if by_deadline:
+            try:
+                r = await asyncio.wait_for(call, timeout=timeout)
+            except asyncio.TimeoutError:
+                raise DeadlineExceededError(timeout) from None
+        else:
+            r = await call
         if r.status_code >= 400:
             # propagate error details so the route can return a proper HTTP error
             body = None
@@ -26,20 +76,92 @@ async def chat_completions(payload: Dict[str, Any]) -> Dict[str, Any]:
             raise UpstreamHTTPError(r.status_code, str(message), body=body)
         return r.json()
 
-async def stream_chat_completions(payload: Dict[str, Any]) -> AsyncGenerator[bytes, None]:
+class StreamTimeoutError(asyncio.TimeoutError):
+    """A streaming upstream missed one of the watchdog limits (ttft, idle or total).
+
+    Only ttft and idle count as upstream failures; total is STREAM_MAX_DURATION_S.
+    """
+
+    def __init__(self, limit: str, seconds: float):
+        super().__init__(f"Upstream stream exceeded its {limit} limit ({seconds:g}s)")
+        self.limit = limit
+
+async def stream_chat_completions(
+    payload: Dict[str, Any],
+    pool: UpstreamPool,
+    timeout: Optional[float] = None,
+    breaker: Optional[CircuitBreaker] = None,
+) -> AsyncGenerator[bytes, None]:
     payload = dict(payload)
     payload["stream"] = True
-    async with httpx.AsyncClient(timeout=None) as client:
-        async with client.stream("POST", f"{settings.vllm_url}/v1/chat/completions", json=payload) as r:
+    # Watchdog: time to first chunk (headers included) and the gap between
+    # chunks are upstream stalls; the whole-stream cap and a shorter request
+    # deadline are limits on the request and don't count against the replica.
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    by_deadline = timeout is not None and timeout < settings.stream_max_duration_s
+    ends = started + (timeout if by_deadline else settings.stream_max_duration_s)
+
+    async def _within(aw, limit: str, limit_ends: float):
+        capped = ends <= limit_ends
+        try:
+            return await asyncio.wait_for(aw, timeout=max(0.0, min(ends, limit_ends) - loop.time()))
+        except asyncio.TimeoutError:
+            if capped and by_deadline:
+                gateway_stream_timeouts.labels(limit="deadline").inc()
+                raise DeadlineExceededError(timeout) from None
+            if capped:
+                limit = "total"
+            gateway_stream_timeouts.labels(limit=limit).inc()
+            seconds = {"ttft": settings.stream_ttft_timeout_s, "idle": settings.stream_idle_timeout_s}.get(
+                limit, settings.stream_max_duration_s
+            )
+            raise StreamTimeoutError(limit, seconds) from None
+
+    async with _guard(breaker), pool.acquire(payload) as upstream:
+        client = _get_client()
+        request = client.build_request(
+            "POST", f"{upstream.url}/v1/chat/completions", json=payload, timeout=_timeout(None)
+        )
+        ttft_ends = started + settings.stream_ttft_timeout_s
+        r = await _within(client.send(request, stream=True), "ttft", ttft_ends)
+        try:
             if r.status_code >= 400:
-                # Create a single SSE error frame then stop
+                # The dispatcher turns this into a single SSE error frame
                 text = await r.aread()
-                msg = text.decode("utf-8", errors="replace")
-                err = f"event: error\ndata: {{\"status\": {r.status_code}, \"message\": {msg!r}}}\n\n"
-                yield err.encode("utf-8")
-                return
-            async for chunk in r.aiter_raw():
+                raise UpstreamHTTPError(r.status_code, text.decode("utf-8", errors="replace"))
+            chunks = r.aiter_raw().__aiter__()
+            first = True
+            while True:
+                limit_ends = ttft_ends if first else loop.time() + settings.stream_idle_timeout_s
+                try:
+                    chunk = await _within(chunks.__anext__(), "ttft" if first else "idle", limit_ends)
+                except StopAsyncIteration:
+                    break
                 if not chunk:
                     continue
+                first = False
                 # Pass through vLLM's SSE bytes
                 yield chunk
+        finally:
+            # Closing the response drops the upstream connection, which aborts the generation in vLLM
+            await r.aclose()
+
+def _guard(breaker: Optional[CircuitBreaker]):
+    return breaker.guard() if breaker is not None else contextlib.nullcontext()
+
+def sse_error(data: Dict[str, Any]) -> bytes:
+    """An SSE error event; messages can hold quotes or backslashes, so always serialize."""
+    return b"event: error\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+def sse_error_frame(e: Exception) -> bytes:
+    if isinstance(e, DeadlineExceededError):
+        return sse_error({"status": 504, "message": str(e)})
+    if isinstance(e, BreakerOpenError):
+        return sse_error({"status": 503, "message": str(e), "retry_after": math.ceil(e.retry_after)})
+    if isinstance(e, StreamTimeoutError):
+        return sse_error({"status": 504, "message": str(e), "limit": e.limit})
+    if isinstance(e, UpstreamHTTPError):
+        return sse_error({"status": e.status_code, "message": e.message})
+    return sse_error({"message": f"{type(e).__name__}: {e}"})
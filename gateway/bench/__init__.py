@@ -0,0 +1 @@
+# Benchmarks and load tools for the gateway (run from gateway/: python -m bench.<tool>)
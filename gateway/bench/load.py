@@ -0,0 +1,226 @@
+"""End-to-end load benchmark for /v1/chat/completions.
+
+Drives the gateway at a fixed concurrency (closed loop) or arrival rate (open
+loop, Poisson) and prints one JSON object with RPS, latency and TTFT
+percentiles, errors by status and, when the gateway's CPU time can be read,
+CPU milliseconds per request. With --direct the same workload first runs
+straight against the upstream, and the difference is reported as the gateway's
+added latency and TTFT.
+
+Gateway CPU comes from --gateway-pid (Linux /proc, several pids for a worker
+pool) or else process_cpu_seconds_total on the gateway's /metrics (absent in
+multi-process mode).
+
+    cd gateway && python -m bench.stub_vllm --port 8000 &
+    VLLM_URL=http://127.0.0.1:8000 ADMIN_BOOTSTRAP_KEY=bench uvicorn app.main:app --port 8080 &
+    python -m bench.load --api-key bench --direct http://127.0.0.1:8000 --concurrency 32 --duration 30 --stream
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values) + 0.5)) - 1))]
+
+
+def _ms(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value * 1000, 2)
+
+
+def _body(args: argparse.Namespace, rng: random.Random) -> Dict[str, Any]:
+    # A nonce keeps the response cache and single-flight out of the measurement
+    filler = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(args.prompt_chars))
+    body: Dict[str, Any] = {
+        "model": args.model,
+        "messages": [{"role": "user", "content": f"{uuid.uuid4().hex} {filler}"}],
+        "max_tokens": args.max_tokens,
+        "temperature": 0.7,
+        "stream": args.stream,
+    }
+    if args.stream:
+        body["stream_options"] = {"include_usage": True}
+    return body
+
+
+async def _one(client: httpx.AsyncClient, url: str, headers: Dict[str, str], body: Dict[str, Any]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    ttft = None
+    try:
+        if body.get("stream"):
+            errored = False
+            async with client.stream("POST", url, json=body, headers=headers) as r:
+                async for chunk in r.aiter_bytes():
+                    if ttft is None and b'"content"' in chunk:
+                        ttft = time.perf_counter() - started
+                    errored = errored or b"event: error" in chunk
+                status = "stream_error" if r.status_code == 200 and errored else r.status_code
+        else:
+            r = await client.post(url, json=body, headers=headers)
+            status = r.status_code
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    return {"status": status, "latency": time.perf_counter() - started, "ttft": ttft}
+
+
+def _cpu_seconds(args: argparse.Namespace, client: httpx.Client) -> Optional[float]:
+    if args.gateway_pid:
+        total = 0.0
+        for pid in args.gateway_pid.split(","):
+            with open(f"/proc/{pid.strip()}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        return total
+    try:
+        text = client.get(f"{args.gateway.rstrip('/')}/metrics").text
+    except httpx.HTTPError:
+        return None
+    values = [float(line.split()[-1]) for line in text.splitlines() if line.startswith("process_cpu_seconds_total")]
+    return sum(values) if values else None
+
+
+async def run_phase(args: argparse.Namespace, base_url: str, headers: Dict[str, str]) -> Dict[str, Any]:
+    url = f"{base_url.rstrip('/')}/v1/chat/completions"
+    rng = random.Random(args.seed)
+    results: List[Dict[str, Any]] = []
+    completed = 0
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(timeout=args.timeout_s, limits=limits) as client:
+        started = time.perf_counter()
+        warm_until = started + args.warmup_s
+        stop_at = warm_until + args.duration
+
+        def more() -> bool:
+            if args.requests:
+                return len(results) + outstanding < args.requests
+            return time.perf_counter() < stop_at
+
+        async def record(body: Dict[str, Any]) -> None:
+            nonlocal outstanding, completed
+            try:
+                result = await _one(client, url, headers, body)
+            finally:
+                outstanding -= 1
+                completed += 1
+            if args.requests or time.perf_counter() - result["latency"] >= warm_until:
+                results.append(result)
+
+        outstanding = 0
+        if args.rate:
+            tasks = set()
+            while more():
+                await asyncio.sleep(rng.expovariate(args.rate))
+                if outstanding >= args.max_outstanding:
+                    continue  # open loop, but don't let a stalled target run away with memory
+                outstanding += 1
+                t = asyncio.create_task(record(_body(args, rng)))
+                tasks.add(t)
+                t.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        else:
+            async def worker() -> None:
+                nonlocal outstanding
+                while more():
+                    outstanding += 1
+                    await record(_body(args, rng))
+
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - max(started, warm_until if not args.requests else started)
+
+    ok = [r for r in results if r["status"] == 200]
+    latencies = [r["latency"] for r in ok]
+    ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+    return {
+        "url": url,
+        "requests": len(results),
+        # Including warmup, for CPU accounting
+        "completed": completed,
+        "ok": len(ok),
+        "errors": dict(Counter(str(r["status"]) for r in results if r["status"] != 200)),
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(ok) / elapsed, 2) if elapsed > 0 else None,
+        "latency_ms": {
+            "mean": _ms(sum(latencies) / len(latencies)) if latencies else None,
+            "p50": _ms(_percentile(latencies, 50)),
+            "p90": _ms(_percentile(latencies, 90)),
+            "p99": _ms(_percentile(latencies, 99)),
+        },
+        "ttft_ms": {"p50": _ms(_percentile(ttfts, 50)), "p99": _ms(_percentile(ttfts, 99))} if args.stream else None,
+    }
+
+
+async def main_async(args: argparse.Namespace) -> Dict[str, Any]:
+    report: Dict[str, Any] = {"params": vars(args)}
+    if args.direct:
+        report["direct"] = await run_phase(args, args.direct, {})
+    with httpx.Client(timeout=5) as sync_client:
+        cpu_before = _cpu_seconds(args, sync_client)
+        gateway = await run_phase(args, args.gateway, {"x-api-key": args.api_key} if args.api_key else {})
+        cpu_after = _cpu_seconds(args, sync_client)
+    if cpu_before is not None and cpu_after is not None and gateway["completed"]:
+        gateway["cpu_ms_per_request"] = round((cpu_after - cpu_before) * 1000 / gateway["completed"], 3)
+    else:
+        gateway["cpu_ms_per_request"] = None
+    report["gateway"] = gateway
+    if args.direct:
+        direct = report["direct"]
+
+        def diff(kind: str, q: str) -> Optional[float]:
+            a, b = (gateway.get(kind) or {}).get(q), (direct.get(kind) or {}).get(q)
+            return None if a is None or b is None else round(a - b, 2)
+
+        report["overhead_ms"] = {
+            "latency_p50": diff("latency_ms", "p50"),
+            "latency_p99": diff("latency_ms", "p99"),
+            "ttft_p50": diff("ttft_ms", "p50"),
+            "ttft_p99": diff("ttft_ms", "p99"),
+        }
+    return report
+
+
+def parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--gateway", default="http://127.0.0.1:8080")
+    p.add_argument("--api-key", default=os.getenv("BENCH_API_KEY"))
+    p.add_argument("--direct", default=None, help="upstream base URL to measure without the gateway")
+    p.add_argument("--model", default="stub-model")
+    p.add_argument("--stream", action="store_true")
+    p.add_argument("--concurrency", type=int, default=16, help="closed loop: requests kept in flight")
+    p.add_argument("--rate", type=float, default=None, help="open loop: mean arrivals per second (overrides --concurrency)")
+    p.add_argument("--max-outstanding", type=int, default=2000, help="open loop: skip arrivals beyond this many in flight")
+    p.add_argument("--duration", type=float, default=20.0, help="seconds measured after warmup")
+    p.add_argument("--requests", type=int, default=0, help="stop after this many requests instead (no warmup)")
+    p.add_argument("--warmup-s", type=float, default=2.0)
+    p.add_argument("--prompt-chars", type=int, default=400)
+    p.add_argument("--max-tokens", type=int, default=64)
+    p.add_argument("--timeout-s", type=float, default=120.0)
+    p.add_argument("--gateway-pid", default=None, help="comma-separated gateway pids for CPU accounting")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--out", default=None, help="also write the JSON report here")
+    return p
+
+
+def main() -> None:
+    args = parser().parse_args()
+    report = asyncio.run(main_async(args))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
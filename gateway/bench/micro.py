@@ -0,0 +1,363 @@
+"""Microbenchmarks for the per-request hot path, checked against stored baselines.
+
+Each benchmark runs its function in timed batches (sized to --min-time) for
+--repeat rounds and reports the median and best time per call. With no
+--update the best times (the least noisy figure on a shared machine) are
+compared with bench/baselines.json and the run exits non-zero when one is
+slower than its baseline by more than the tolerance
+(--tolerance, or a per-benchmark "tolerance" in the file), or when a
+benchmark raises (unless it is registered as optional for that error, in
+which case it is reported as skipped). Baselines are
+machine-specific: regenerate them with --update on the machine that checks
+them, and commit the file with the change that moved the numbers.
+
+External services are replaced by stand-ins so only gateway code is timed:
+the DB session is a fake that returns prepared rows, and Redis is a tiny
+in-process RESP server (the real redis-py client still does the round trip)
+unless --redis-url points at a real one.
+
+    cd gateway && python -m bench.micro                # compare
+    cd gateway && python -m bench.micro --update       # rewrite baselines
+    cd gateway && python -m bench.micro -k jwt,sse     # subset
+"""
+
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+_BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+# name -> setup coroutine returning the callable to time (sync or async)
+_BENCHMARKS: Dict[str, Callable[[argparse.Namespace], Awaitable[Callable[[], Any]]]] = {}
+# Benchmarks whose setup may fail for environmental reasons (reported as skipped)
+_OPTIONAL: Dict[str, Tuple[type, ...]] = {}
+
+
+def bench(name: str, optional: Tuple[type, ...] = ()):
+    """Register a benchmark; exceptions listed in optional skip it instead of failing the run."""
+
+    def register(setup):
+        _BENCHMARKS[name] = setup
+        if optional:
+            _OPTIONAL[name] = optional
+        return setup
+
+    return register
+
+
+# --- Stand-ins
+
+
+class _RespStandIn:
+    """Answers just enough RESP for the gateway's calls: EVAL gets [1, 9], anything else +OK."""
+
+    def __init__(self):
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"redis://{host}:{port}/0"
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                header = await reader.readline()
+                if not header:
+                    break
+                args = []
+                for _ in range(int(header[1:])):
+                    size = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(size + 2))[:-2])
+                command = args[0].upper()
+                writer.write(b"*2\r\n:1\r\n:9\r\n" if command in (b"EVAL", b"EVALSHA") else b"+OK\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+class _FakeQuery:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def filter(self, *args, **kwargs):
+        return self
+
+    def all(self):
+        return list(self.rows)
+
+
+class _FakeSession:
+    def __init__(self, rows=()):
+        self.rows = rows
+
+    def query(self, *args, **kwargs):
+        return _FakeQuery(self.rows)
+
+    def execute(self, *args, **kwargs):
+        return None
+
+    def commit(self):
+        return None
+
+
+def _fake_get_session(rows=()):
+    @contextmanager
+    def get_session():
+        yield _FakeSession(rows)
+
+    return get_session
+
+
+_stand_in = _RespStandIn()
+
+
+async def _use_redis(args: argparse.Namespace) -> None:
+    from redis import asyncio as aioredis
+
+    from app import redis_client
+
+    if redis_client._redis is None:
+        url = args.redis_url or await _stand_in.start()
+        redis_client._redis = aioredis.from_url(url, encoding="utf-8", decode_responses=True)
+
+
+async def _close_redis() -> None:
+    from app import redis_client
+
+    if redis_client._redis is not None:
+        await redis_client._redis.aclose()
+        redis_client._redis = None
+    if _stand_in.server is not None:
+        _stand_in.server.close()
+
+
+# --- Benchmarks
+
+
+@bench("auth.require_key")
+async def _require_key(args):
+    from app import auth
+
+    # The hash check is bcrypt's cost, not ours; a constant-time compare keeps the
+    # lookup and per-row checks in the measurement without depending on the bcrypt build
+    secret = "sk-bench-0123456789abcdef"
+    row = SimpleNamespace(
+        id="00000000-0000-0000-0000-000000000001",
+        user_id="00000000-0000-0000-0000-000000000002",
+        role="user",
+        status="active",
+        expires_at=None,
+        key_hash="bench-hash:" + secret,
+    )
+    auth.get_session = _fake_get_session([row])
+    auth.verify_key = lambda plain, hashed: hmac.compare_digest("bench-hash:" + plain, hashed)
+    return lambda: auth.require_key(secret)
+
+
+@bench("ratelimit.check_rate_limit")
+async def _check_rate_limit(args):
+    from app import ratelimit
+
+    await _use_redis(args)
+    return lambda: ratelimit.check_rate_limit("bench-key")
+
+
+@bench("accounting.record_request")
+async def _record_request(args):
+    from app import accounting
+    from app.config import settings
+
+    await _use_redis(args)
+    settings.usage_cache_backend = "redis"
+    accounting.get_session = _fake_get_session()
+    request_body = {"model": "bench", "messages": [{"role": "user", "content": "hello " * 200}], "stream": False}
+    response_body = {
+        "id": "chatcmpl-bench",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "tok " * 256}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 210, "completion_tokens": 256, "total_tokens": 466},
+    }
+    return lambda: accounting.record_request(
+        key_id="00000000-0000-0000-0000-000000000001",
+        user_id="00000000-0000-0000-0000-000000000002",
+        endpoint="/v1/chat/completions",
+        model="bench",
+        request_body=request_body,
+        response_body=response_body,
+        status_code=200,
+        error_message=None,
+        latency_ms=1234,
+        backend="bench",
+    )
+
+
+@bench("public.sse_stream_256_chunks")
+async def _sse_chunks(args):
+    from app.routes.public import _usage_frame
+
+    def frame(delta, usage=None):
+        chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "bench",
+                 "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+        if usage:
+            chunk["usage"] = usage
+        return f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+
+    # What _gen sees for one streamed response: role, 256 tokens, usage, [DONE]
+    chunks = [frame({"role": "assistant", "content": ""})]
+    chunks += [frame({"content": "tok "}) for _ in range(256)]
+    chunks.append(frame({}, {"prompt_tokens": 10, "completion_tokens": 256, "total_tokens": 266}))
+    chunks.append(b"data: [DONE]\n\n")
+
+    def run():
+        last = None
+        for chunk in chunks:
+            parsed = _usage_frame(chunk)
+            if parsed is not None:
+                last = parsed
+        return last
+
+    return run
+
+
+@bench("user_auth.jwt_decode")
+async def _jwt_decode(args):
+    from app import user_auth
+
+    token = user_auth.jwt_encode({"sub": "00000000-0000-0000-0000-000000000002", "email": "bench@example.com"}, 3600)
+    return lambda: user_auth.jwt_decode(token)
+
+
+@bench("schemas.chat_request_256_messages")
+async def _validate_request(args):
+    from app.types import ChatCompletionRequest
+
+    payload = {
+        "model": "bench",
+        "messages": [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i} " + "lorem ipsum " * 40}
+            for i in range(256)
+        ],
+        "max_tokens": 256,
+        "temperature": 0.7,
+    }
+    # Validation plus the model_dump the route does right after
+    return lambda: ChatCompletionRequest.model_validate(payload).model_dump()
+
+
+# --- Runner
+
+
+async def _time(fn: Callable[[], Any], args: argparse.Namespace) -> Dict[str, Any]:
+    is_async = asyncio.iscoroutine(first := fn())
+    if is_async:
+        await first
+
+    async def batch(n: int) -> float:
+        started = time.perf_counter()
+        if is_async:
+            for _ in range(n):
+                await fn()
+        else:
+            for _ in range(n):
+                fn()
+        return time.perf_counter() - started
+
+    # Calibrate the batch size so one batch takes about --min-time
+    n = 1
+    while True:
+        elapsed = await batch(n)
+        if elapsed >= args.min_time or n >= 1_000_000:
+            break
+        n = max(n * 2, int(n * args.min_time / max(elapsed, 1e-9)))
+    per_call = [(await batch(n)) / n for _ in range(args.repeat)]
+    return {
+        "median_us": round(statistics.median(per_call) * 1e6, 3),
+        "min_us": round(min(per_call) * 1e6, 3),
+        "calls_per_round": n,
+    }
+
+
+def _load_baselines() -> Dict[str, Any]:
+    try:
+        with open(_BASELINES) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"benchmarks": {}}
+
+
+async def main_async(args: argparse.Namespace) -> int:
+    import logging
+
+    # Timings exclude log I/O, which depends on the handler rather than the code
+    logging.disable(logging.INFO)
+
+    names = list(_BENCHMARKS)
+    if args.k:
+        wanted = [w.strip() for w in args.k.split(",") if w.strip()]
+        names = [n for n in names if any(w in n for w in wanted)]
+    baselines = _load_baselines()
+    stored = baselines.setdefault("benchmarks", {})
+    results: List[Dict[str, Any]] = []
+    failed = False
+    for name in names:
+        try:
+            fn = await _BENCHMARKS[name](args)
+            timing = await _time(fn, args)
+        except _OPTIONAL.get(name, ()) as e:
+            results.append({"name": name, "skipped": f"{type(e).__name__}: {e}"})
+            continue
+        except Exception as e:
+            results.append({"name": name, "error": f"{type(e).__name__}: {e}"})
+            failed = True
+            continue
+        entry: Dict[str, Any] = {"name": name, **timing}
+        base = (stored.get(name) or {}).get("min_us")
+        tolerance = (stored.get(name) or {}).get("tolerance", args.tolerance)
+        if base and not args.update:
+            entry["baseline_us"] = base
+            entry["change"] = round(timing["min_us"] / base - 1, 4)
+            entry["regressed"] = entry["change"] > tolerance
+            failed = failed or entry["regressed"]
+        results.append(entry)
+        if args.update:
+            stored[name] = {**(stored.get(name) or {}), "min_us": timing["min_us"]}
+    await _close_redis()
+    if args.update:
+        baselines["machine"] = {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "processor": platform.processor() or None,
+        }
+        with open(_BASELINES, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+    print(json.dumps({"tolerance": args.tolerance, "updated": args.update, "results": results}, indent=2))
+    return 1 if failed else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", default=None, help="only benchmarks whose name contains one of these (comma-separated)")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timed round")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument("--update", action="store_true", help="store these results as the new baselines")
+    parser.add_argument("--redis-url", default=None, help="use a real Redis instead of the in-process stand-in")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""Replay recorded production traffic against a gateway for capacity testing.
+
+Reads chat completion requests for a time window from the `requests` table
+(DATABASE_URL, same filters as the admin export) or from an NDJSON export
+made with include_bodies=true, and sends them again with the original arrival
+pattern, compressed by --speed (2 = twice the load). A request arrived at
+created_at - latency_ms, since rows are written when the response finishes.
+
+Keys: every recorded key is replayed as its own client. --key-map maps
+recorded key ids to API keys to send (e.g. load-test keys with the same
+limits); unmapped keys use --api-key. Unless --no-key-cap is given, each
+key is held to the peak concurrency it had in the recording, so a client that
+was a 4-worker batch job does not become 40 workers at 10x.
+
+--anonymize rewrites message text word by word into pseudo-words of the same
+length (deterministically, so shared prompt prefixes stay shared).
+
+The report compares the recorded latency distribution with the replay's,
+overall and per model, as JSON.
+
+    cd gateway && python -m bench.replay --from 2024-06-03T14:00 --to 2024-06-03T15:00 \\
+        --speed 2 --api-key $LOADTEST_KEY --anonymize --out replay-2x.json
+    cd gateway && python -m bench.replay --file requests.ndjson --speed 10 --key-map keys.json
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import re
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import httpx
+import orjson
+
+from .load import _ms, _one, _percentile
+
+_ENDPOINT = "/v1/chat/completions"
+_WORD = re.compile(r"[A-Za-z0-9]+")
+_LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+
+# --- Sources
+
+
+def _rows_from_file(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield orjson.loads(line)
+
+
+def _rows_from_db(args: argparse.Namespace) -> Iterator[Dict[str, Any]]:
+    from app import export
+
+    clauses, params = export.request_filters(
+        from_ts=export.parse_bound(args.from_ts),
+        to_ts=export.parse_bound(args.to_ts, end=True),
+        key_id=args.key_id,
+        endpoint=_ENDPOINT,
+        model=args.model,
+    )
+    return export.iter_requests(clauses, params, include_bodies=True)
+
+
+def _timestamp(value: Any) -> datetime:
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+def load_trace(rows: Iterable[Dict[str, Any]], args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Replayable requests sorted by arrival, with offsets in seconds from the first."""
+    trace = []
+    for row in rows:
+        if row.get("endpoint", _ENDPOINT) != _ENDPOINT or not row.get("request_body"):
+            continue
+        if args.skip_cache_hits and row.get("cache_hit"):
+            continue
+        body = row["request_body"]
+        if isinstance(body, str):
+            body = json.loads(body)
+        latency_ms = row.get("latency_ms") or 0
+        trace.append({
+            "arrival": _timestamp(row["created_at"]) - timedelta(milliseconds=latency_ms),
+            "key_id": str(row.get("key_id")),
+            "model": row.get("model") or body.get("model"),
+            "body": {k: v for k, v in body.items() if v is not None},
+            "latency_s": latency_ms / 1000 if row.get("latency_ms") is not None else None,
+            "status": row.get("status_code"),
+        })
+    trace.sort(key=lambda r: r["arrival"])
+    if trace:
+        start = trace[0]["arrival"]
+        for r in trace:
+            r["offset_s"] = (r["arrival"] - start).total_seconds()
+    return trace
+
+
+def peak_concurrency(trace: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Most requests each key had in flight at once in the recording."""
+    events = defaultdict(list)
+    for r in trace:
+        events[r["key_id"]].append((r["offset_s"], 1))
+        events[r["key_id"]].append((r["offset_s"] + (r["latency_s"] or 0), -1))
+    peaks = {}
+    for key, evs in events.items():
+        inflight = peak = 0
+        for _, delta in sorted(evs, key=lambda e: (e[0], e[1])):
+            inflight += delta
+            peak = max(peak, inflight)
+        peaks[key] = max(1, peak)
+    return peaks
+
+
+# --- Anonymization
+
+
+def _pseudo_word(word: str) -> str:
+    digest = hashlib.blake2b(word.encode("utf-8"), digest_size=32).digest()
+    out = "".join(_LETTERS[digest[i % len(digest)] % 26] for i in range(len(word)))
+    return out.capitalize() if word[:1].isupper() else out
+
+
+def anonymize(body: Dict[str, Any]) -> Dict[str, Any]:
+    body = dict(body)
+    body.pop("user", None)
+    messages = []
+    for m in body.get("messages") or []:
+        m = dict(m)
+        if isinstance(m.get("content"), str):
+            m["content"] = _WORD.sub(lambda w: _pseudo_word(w.group(0)), m["content"])
+        messages.append(m)
+    body["messages"] = messages
+    return body
+
+
+# --- Replay
+
+
+def _summary(latencies: List[float]) -> Dict[str, Any]:
+    return {
+        "count": len(latencies),
+        "mean": _ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50": _ms(_percentile(latencies, 50)),
+        "p90": _ms(_percentile(latencies, 90)),
+        "p99": _ms(_percentile(latencies, 99)),
+    }
+
+
+def _compare(recorded: List[Dict[str, Any]], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    original = _summary([r["latency_s"] for r in recorded if r["latency_s"] is not None and r["status"] == 200])
+    replay = _summary([r["latency"] for r in results if r["status"] == 200])
+    ratio = {
+        q: round(replay[q] / original[q], 3) if replay[q] and original[q] else None
+        for q in ("p50", "p90", "p99")
+    }
+    return {
+        "original_latency_ms": original,
+        "replay_latency_ms": replay,
+        "replay_vs_original": ratio,
+        "original_status": dict(Counter(str(r["status"]) for r in recorded)),
+        "replay_status": dict(Counter(str(r["status"]) for r in results)),
+    }
+
+
+async def replay(trace: List[Dict[str, Any]], args: argparse.Namespace, key_map: Dict[str, str]) -> Dict[str, Any]:
+    url = f"{args.gateway.rstrip('/')}{_ENDPOINT}"
+    caps = peak_concurrency(trace) if not args.no_key_cap else {}
+    slots = {key: asyncio.Semaphore(n) for key, n in caps.items()}
+    results: List[Optional[Dict[str, Any]]] = [None] * len(trace)
+    schedule_lag: List[float] = []
+    held_by_cap = 0
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+
+    async with httpx.AsyncClient(timeout=args.timeout_s, limits=limits) as client:
+
+        async def send(i: int, r: Dict[str, Any], due: float) -> None:
+            nonlocal held_by_cap
+            api_key = key_map.get(r["key_id"]) or args.api_key
+            body = anonymize(r["body"]) if args.anonymize else r["body"]
+            slot = slots.get(r["key_id"])
+            if slot is not None:
+                if slot.locked():
+                    held_by_cap += 1
+                await slot.acquire()
+            try:
+                schedule_lag.append(time.monotonic() - due)
+                results[i] = await _one(client, url, {"x-api-key": api_key}, body)
+            finally:
+                if slot is not None:
+                    slot.release()
+
+        started = time.monotonic()
+        tasks = []
+        for i, r in enumerate(trace):
+            due = started + r["offset_s"] / args.speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(i, r, due)))
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - started
+
+    done = [res for res in results if res is not None]
+    by_model: Dict[str, Any] = {}
+    for model in sorted({str(r["model"]) for r in trace}):
+        idx = [i for i, r in enumerate(trace) if str(r["model"]) == model]
+        by_model[model] = _compare([trace[i] for i in idx], [results[i] for i in idx if results[i] is not None])
+    ttfts = [res["ttft"] for res in done if res["ttft"] is not None]
+    return {
+        "requests": len(trace),
+        "keys": len({r["key_id"] for r in trace}),
+        "recorded_span_s": round(trace[-1]["offset_s"], 3) if trace else 0,
+        "replay_elapsed_s": round(elapsed, 3),
+        "offered_rps": round(len(trace) / (trace[-1]["offset_s"] / args.speed), 2) if len(trace) > 1 and trace[-1]["offset_s"] else None,
+        "achieved_rps": round(sum(1 for res in done if res["status"] == 200) / elapsed, 2) if elapsed else None,
+        # How late requests went out versus the recorded pattern (client lag or key caps)
+        "schedule_lag_ms": {"p50": _ms(_percentile(schedule_lag, 50)), "p99": _ms(_percentile(schedule_lag, 99))},
+        "held_by_key_cap": held_by_cap,
+        "replay_ttft_ms": {"p50": _ms(_percentile(ttfts, 50)), "p99": _ms(_percentile(ttfts, 99))},
+        **_compare(trace, done),
+        "by_model": by_model,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--file", help="NDJSON export with request bodies")
+    source.add_argument("--from", dest="from_ts", help="window start (YYYY-MM-DD or ISO datetime), read from the DB")
+    parser.add_argument("--to", dest="to_ts", default=None, help="window end (inclusive)")
+    parser.add_argument("--key-id", default=None, help="only requests from this recorded key (DB source)")
+    parser.add_argument("--model", default=None, help="only requests for this model (DB source)")
+    parser.add_argument("--gateway", default="http://127.0.0.1:8080")
+    parser.add_argument("--api-key", default=None, help="API key for recorded keys not in --key-map")
+    parser.add_argument("--key-map", default=None, help="JSON file mapping recorded key ids to API keys")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression: 2 = twice the arrival rate")
+    parser.add_argument("--limit", type=int, default=0, help="replay at most this many requests")
+    parser.add_argument("--anonymize", action="store_true", help="rewrite message text before sending")
+    parser.add_argument("--skip-cache-hits", action="store_true", help="leave out requests served from the response cache")
+    parser.add_argument("--no-key-cap", action="store_true", help="don't hold keys to their recorded peak concurrency")
+    parser.add_argument("--timeout-s", type=float, default=300.0)
+    parser.add_argument("--out", default=None, help="also write the JSON report here")
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+
+    key_map: Dict[str, str] = {}
+    if args.key_map:
+        with open(args.key_map) as f:
+            key_map = json.load(f)
+    rows = _rows_from_file(args.file) if args.file else _rows_from_db(args)
+    trace = load_trace(rows, args)
+    if args.limit:
+        trace = trace[: args.limit]
+    missing = {r["key_id"] for r in trace} - set(key_map)
+    if missing and not args.api_key:
+        parser.error(f"{len(missing)} recorded keys have no --key-map entry; pass --api-key for them")
+
+    report = {"params": vars(args), **asyncio.run(replay(trace, args, key_map))}
+    text = json.dumps(report, indent=2, default=str)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
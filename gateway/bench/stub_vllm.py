@@ -0,0 +1,181 @@
+"""Fake vLLM / OpenAI-compatible upstream for running the gateway without a GPU.
+
+Serves /v1/chat/completions (JSON and SSE streams), /v1/models, /health and a
+vLLM-style /metrics. Responses take --ttft-ms before the first token and then
+arrive at --tokens-per-s; --max-num-seqs bounds how many requests "decode" at
+once (the rest wait, and show up as vllm:num_requests_waiting), and
+--error-rate fails a fraction of requests with --error-status.
+
+    cd gateway && python -m bench.stub_vllm --port 8000 --tokens-per-s 50 --ttft-ms 200
+    VLLM_URL=http://127.0.0.1:8000 uvicorn app.main:app --port 8080
+"""
+
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from typing import Any, Dict
+
+import orjson
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+
+def _json(data: Any, status: int = 200) -> Response:
+    return Response(orjson.dumps(data), status_code=status, media_type="application/json")
+
+
+def build_app(args: argparse.Namespace) -> Starlette:
+    rng = random.Random(args.seed)
+    slots = asyncio.Semaphore(args.max_num_seqs) if args.max_num_seqs > 0 else None
+    state = {"running": 0, "waiting": 0, "requests": 0}
+
+    def jitter(seconds: float) -> float:
+        return max(0.0, seconds * rng.uniform(1 - args.jitter, 1 + args.jitter))
+
+    def plan(body: Dict[str, Any]) -> Dict[str, Any]:
+        prompt = sum(len(str(m.get("content") or "")) for m in body.get("messages") or [])
+        completion = args.completion_tokens
+        if body.get("max_tokens"):
+            completion = min(completion, int(body["max_tokens"]))
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "created": int(time.time()),
+            "model": body.get("model") or args.model,
+            "usage": {
+                "prompt_tokens": max(1, prompt // 4),
+                "completion_tokens": completion,
+                "total_tokens": max(1, prompt // 4) + completion,
+            },
+        }
+
+    async def admitted():
+        state["waiting"] += 1
+        try:
+            if slots is not None:
+                await slots.acquire()
+        finally:
+            state["waiting"] -= 1
+        state["running"] += 1
+
+    def done() -> None:
+        state["running"] -= 1
+        if slots is not None:
+            slots.release()
+
+    async def chat_completions(request: Request) -> Response:
+        body = orjson.loads(await request.body())
+        state["requests"] += 1
+        if args.error_rate and rng.random() < args.error_rate:
+            await asyncio.sleep(jitter(args.ttft_ms / 1000))
+            return _json({"error": {"message": "stub upstream error", "type": "server_error"}}, args.error_status)
+        p = plan(body)
+        n = p["usage"]["completion_tokens"]
+        per_token = 1.0 / args.tokens_per_s if args.tokens_per_s > 0 else 0.0
+
+        if not body.get("stream"):
+            await admitted()
+            try:
+                await asyncio.sleep(jitter(args.ttft_ms / 1000) + jitter(per_token * n))
+            finally:
+                done()
+            return _json({
+                "id": p["id"],
+                "object": "chat.completion",
+                "created": p["created"],
+                "model": p["model"],
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(["tok"] * n)},
+                    "finish_reason": "length" if n == body.get("max_tokens") else "stop",
+                }],
+                "usage": p["usage"],
+            })
+
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        def frame(delta: Dict[str, Any], finish: Any = None) -> bytes:
+            chunk = {
+                "id": p["id"],
+                "object": "chat.completion.chunk",
+                "created": p["created"],
+                "model": p["model"],
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }
+            return b"data: " + orjson.dumps(chunk) + b"\n\n"
+
+        async def events():
+            await admitted()
+            try:
+                await asyncio.sleep(jitter(args.ttft_ms / 1000))
+                yield frame({"role": "assistant", "content": ""})
+                for i in range(n):
+                    if i:
+                        await asyncio.sleep(jitter(per_token))
+                    yield frame({"content": "tok "})
+                yield frame({}, "stop")
+                if include_usage:
+                    usage = {"id": p["id"], "object": "chat.completion.chunk", "created": p["created"],
+                             "model": p["model"], "choices": [], "usage": p["usage"]}
+                    yield b"data: " + orjson.dumps(usage) + b"\n\n"
+                yield b"data: [DONE]\n\n"
+            finally:
+                done()
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def models(request: Request) -> Response:
+        return _json({
+            "object": "list",
+            "data": [{"id": args.model, "object": "model", "owned_by": "stub", "max_model_len": args.max_model_len}],
+        })
+
+    async def health(request: Request) -> Response:
+        return PlainTextResponse("")
+
+    async def metrics(request: Request) -> Response:
+        usage = state["running"] / args.max_num_seqs if args.max_num_seqs > 0 else 0.0
+        label = f'{{model_name="{args.model}"}}'
+        return PlainTextResponse(
+            f"vllm:num_requests_running{label} {state['running']}\n"
+            f"vllm:num_requests_waiting{label} {state['waiting']}\n"
+            f"vllm:kv_cache_usage_perc{label} {usage}\n"
+            f"stub_requests_total {state['requests']}\n"
+        )
+
+    return Starlette(routes=[
+        Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+        Route("/v1/models", models),
+        Route("/health", health),
+        Route("/metrics", metrics),
+    ])
+
+
+def parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8000)
+    p.add_argument("--model", default="stub-model")
+    p.add_argument("--max-model-len", type=int, default=8192)
+    p.add_argument("--ttft-ms", type=float, default=100.0, help="delay before the first token")
+    p.add_argument("--tokens-per-s", type=float, default=100.0, help="decode rate per request (0 = instant)")
+    p.add_argument("--completion-tokens", type=int, default=64, help="tokens per response, capped by max_tokens")
+    p.add_argument("--jitter", type=float, default=0.1, help="+/- fraction applied to each delay")
+    p.add_argument("--max-num-seqs", type=int, default=0, help="concurrent requests before queueing (0 = unlimited)")
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--error-status", type=int, default=500)
+    p.add_argument("--seed", type=int, default=None)
+    return p
+
+
+def main() -> None:
+    args = parser().parse_args()
+    uvicorn.run(build_app(args), host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
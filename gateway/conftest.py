@@ -0,0 +1 @@
+# Lets `pytest` run from the repo root as well as from gateway/ (tests import `app`)
@@ -0,0 +1,16 @@
+# Multi-worker launch (GATEWAY_WORKERS > 1, see start.sh): gunicorn supervises
+# uvicorn workers and cleans up each worker's metrics files when it exits.
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("GATEWAY_WORKERS", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+graceful_timeout = 30
+# Streaming responses can be long-lived; worker liveness is handled by the heartbeat, not request time
+timeout = 0
+
+
+def child_exit(server, worker):
+    from app.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
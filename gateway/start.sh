@@ -0,0 +1,20 @@
+#!/usr/bin/env bash
+# Container entrypoint: run migrations once, then start one uvicorn process or,
+# with GATEWAY_WORKERS > 1, a gunicorn-managed pool of uvicorn workers with
+# multi-process Prometheus metrics.
+set -euo pipefail
+
+if [ "${ALEMBIC_UPGRADE_ON_START:-false}" = "true" ]; then
+  alembic upgrade head
+fi
+
+workers="${GATEWAY_WORKERS:-1}"
+if [ "$workers" -gt 1 ]; then
+  export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus-multiproc}"
+  # Files left from a previous run would be aggregated as if still alive
+  rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+  mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+  exec gunicorn -c gunicorn.conf.py app.main:app
+fi
+
+exec uvicorn app.main:app --host 0.0.0.0 --port "${PORT:-8080}"
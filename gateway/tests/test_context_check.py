@@ -0,0 +1,102 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+
+from app import registry
+from app.auth import Principal, require_key
+from app.routes import public
+
+_AsyncClient = httpx.AsyncClient
+
+
+def _upstream(max_model_len: int) -> httpx.MockTransport:
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/v1/models":
+            return httpx.Response(200, json={"data": [{"id": "stub-model", "max_model_len": max_model_len}]})
+        return httpx.Response(500, json={"error": "unexpected upstream call"})
+
+    return httpx.MockTransport(handler)
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    transport = _upstream(1024)
+    monkeypatch.setattr(registry.httpx, "AsyncClient", lambda **kw: _AsyncClient(transport=transport, **kw))
+    monkeypatch.setattr(registry, "_discovered_at", 0.0)
+    for b in registry.backends():
+        monkeypatch.setattr(b, "discovered", {})
+
+    async def no_rate_limit(key_id):
+        return None
+
+    async def no_queue(**kwargs):
+        # Stands in for the queue: anything reaching it passed the context check
+        raise HTTPException(status_code=599, detail="queued")
+
+    monkeypatch.setattr(public, "check_rate_limit", no_rate_limit)
+    monkeypatch.setattr(public, "enqueue_job", no_queue)
+    app = FastAPI()
+    app.include_router(public.router)
+    app.dependency_overrides[require_key] = lambda: Principal(key_id="k", user_id="u")
+    return app
+
+
+async def _post(app: FastAPI, content: str) -> httpx.Response:
+    async with _AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://gateway") as client:
+        return await client.post(
+            "/v1/chat/completions",
+            json={"model": "stub-model", "messages": [{"role": "user", "content": content}]},
+        )
+
+
+def test_oversized_prompt_rejected_after_startup_discovery(gateway):
+    async def run():
+        await registry.start_discovery()
+        try:
+            return await _post(gateway, "word " * 5000)
+        finally:
+            await registry.stop_discovery()
+
+    r = asyncio.run(run())
+    assert r.status_code == 400
+    assert "maximum context length is 1024" in r.json()["detail"]
+
+
+def test_undiscovered_backend_uses_configured_length_without_waiting(gateway, monkeypatch):
+    async def hang(request):
+        await asyncio.sleep(30)
+
+    class Hanging(httpx.AsyncBaseTransport):
+        async def handle_async_request(self, request):
+            await hang(request)
+
+    monkeypatch.setattr(registry.httpx, "AsyncClient", lambda **kw: _AsyncClient(transport=Hanging(), **kw))
+    backend = registry.backends()[0]
+    monkeypatch.setattr(backend, "context_length", 512)
+
+    async def run():
+        started = asyncio.get_running_loop().time()
+        r = await _post(gateway, "word " * 5000)
+        elapsed = asyncio.get_running_loop().time() - started
+        if registry._discovery_kick is not None:
+            registry._discovery_kick.cancel()
+        return r, elapsed
+
+    r, elapsed = asyncio.run(run())
+    assert elapsed < 1
+    assert r.status_code == 400
+    assert "maximum context length is 512" in r.json()["detail"]
+
+
+def test_background_refresh_fills_discovered_limit(gateway):
+    async def run():
+        first = await _post(gateway, "word " * 5000)  # nothing known yet: no check, schedules a refresh
+        await registry._discovery_kick
+        return first, await _post(gateway, "word " * 5000)
+
+    first, second = asyncio.run(run())
+    assert first.status_code == 599
+    assert second.status_code == 400
+    assert "maximum context length is 1024" in second.json()["detail"]